@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Request, Response
+from concurrent.futures import ThreadPoolExecutor
+import os
+import base64
+import asyncio
+import importlib
+import contextvars
+
+router = APIRouter()
+
+# The Lambda modules are served as they are: each request is turned into an
+# API Gateway event and handled by the module's lambda_handler, so routing,
+# caching, ETags, compression and metrics behave the same in both
+# deployments. Both modules share the process's AWS clients and dataset
+# version (see shared_client and shared_dataset_version).
+MODULES = [importlib.import_module("api.lambda.course"), importlib.import_module("api.lambda.user")]
+
+# The handlers block on Athena and S3, so they run on this pool instead of
+# the event loop
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", "32"))
+_analytics_pool = ThreadPoolExecutor(max_workers=ANALYTICS_WORKERS, thread_name_prefix="analytics")
+
+# Cross-origin headers come from the app's CORS middleware instead
+DROPPED_HEADERS = {"access-control-allow-origin"}
+
+
+def lambda_event(request: Request):
+    return {
+        "path": request.url.path,
+        "httpMethod": request.method,
+        "headers": dict(request.headers),
+        "queryStringParameters": dict(request.query_params) or None,
+    }
+
+
+def to_response(result):
+    body = result.get("body") or ""
+    body = base64.b64decode(body) if result.get("isBase64Encoded") else body.encode("utf-8")
+    headers = {
+        name: value for name, value in (result.get("headers") or {}).items()
+        if name.lower() not in DROPPED_HEADERS
+    }
+    return Response(content=body, status_code=result["statusCode"], headers=headers)
+
+
+def analytics_endpoint(module):
+    async def endpoint(request: Request):
+        event = lambda_event(request)
+        context = contextvars.copy_context()
+        result = await asyncio.get_running_loop().run_in_executor(
+            _analytics_pool, context.run, module.lambda_handler, event, None
+        )
+        return to_response(result)
+    return endpoint
+
+
+for module in MODULES:
+    endpoint = analytics_endpoint(module)
+    for (method, path), route in module.router.routes():
+        router.add_api_route(path, endpoint, methods=[method], name=route.name)
@@ -0,0 +1,174 @@
+import os
+import math
+import time
+import logging
+import itertools
+import threading
+import contextlib
+
+logger = logging.getLogger()
+
+# Priority classes, highest first
+INTERACTIVE = 0
+DASHBOARD = 1
+BACKGROUND = 2
+CLASS_NAMES = {INTERACTIVE: "interactive", DASHBOARD: "dashboard", BACKGROUND: "background"}
+
+# Queries this process may have running in Athena at once, and the rate at
+# which it may start them (StartQueryExecution is throttled per account)
+ATHENA_MAX_CONCURRENT = int(os.environ.get('ATHENA_MAX_CONCURRENT', '20'))
+ATHENA_START_RATE = float(os.environ.get('ATHENA_START_RATE', '20'))
+ATHENA_START_BURST = int(os.environ.get('ATHENA_START_BURST', '40'))
+ATHENA_MAX_QUEUED = int(os.environ.get('ATHENA_MAX_QUEUED', '200'))
+
+# How long each class may wait for a slot, and the share of the slots it may
+# hold, so long dashboard scans always leave room for quick lookups
+QUEUE_TIMEOUTS = {INTERACTIVE: 5.0, DASHBOARD: 10.0, BACKGROUND: 30.0}
+SLOT_SHARES = {INTERACTIVE: 1.0, DASHBOARD: 0.75, BACKGROUND: 0.25}
+
+
+class AdmissionRejected(Exception):
+    # The request was shed: the queue was full or the wait ran out
+    def __init__(self, priority, retry_after, reason):
+        self.priority = priority
+        self.retry_after = retry_after
+        super().__init__(f"Athena is busy ({reason}), retry in {retry_after} s")
+
+
+class AdmissionController:
+    # Admits batches of Athena queries by priority class. A batch of n
+    # queries needs n free slots (running queries) within its class's share
+    # and n start tokens; the bucket refills at `rate` tokens per second up
+    # to `burst`. Waiting batches are served highest class first, then in
+    # arrival order. `report(priority, waited, depth, admitted)` is told
+    # how every request for slots went.
+    def __init__(self, limit=ATHENA_MAX_CONCURRENT, rate=ATHENA_START_RATE, burst=ATHENA_START_BURST,
+                 max_queued=ATHENA_MAX_QUEUED, timeouts=None, shares=None, clock=time.monotonic):
+        self.limit = limit
+        self.rate = rate
+        self.burst = burst
+        self.max_queued = max_queued
+        self.timeouts = timeouts or QUEUE_TIMEOUTS
+        self.shares = shares or SLOT_SHARES
+        self.clock = clock
+        self.running = {priority: 0 for priority in CLASS_NAMES}
+        self._tokens = float(burst)
+        self._refilled_at = clock()
+        self._waiting = []
+        self._order = itertools.count()
+        self._hold_time = 1.0
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _cap(self, priority):
+        return max(1, int(self.limit * self.shares.get(priority, 1.0)))
+
+    def _fits(self, priority, count):
+        if sum(self.running.values()) + count > self.limit:
+            return False
+        return self.running[priority] + count <= self._cap(priority)
+
+    def _turn(self, waiter):
+        # 0 when `waiter` may start now, else how long to wait at most
+        # (None: until another batch finishes)
+        self._refill()
+        for other in sorted(self._waiting):
+            priority, _, count = other
+            if not self._fits(priority, count):
+                if sum(self.running.values()) + count > self.limit:
+                    return None
+                continue
+            if other is not waiter:
+                return None
+            if self._tokens < count:
+                return (count - self._tokens) / self.rate if self.rate > 0 else None
+            return 0
+        return None
+
+    def retry_after(self):
+        # Roughly how long the batches already waiting need to get through
+        ahead = sum(count for _, _, count in self._waiting) + sum(self.running.values())
+        return max(1, math.ceil(self._hold_time * ahead / max(1, self.limit)))
+
+    def _reject(self, priority, started, reason, report):
+        if report is not None:
+            report(priority, self.clock() - started, len(self._waiting), False)
+        return AdmissionRejected(priority, self.retry_after(), reason)
+
+    def batch_size(self, priority=INTERACTIVE):
+        # The most queries one acquire of this class can hold
+        return max(1, min(self._cap(priority), int(self.burst)))
+
+    def batches(self, priority, queries):
+        # `queries` in runs small enough to be admitted one after another
+        size = self.batch_size(priority)
+        return [queries[start:start + size] for start in range(0, len(queries), size)]
+
+    def acquire(self, priority=INTERACTIVE, count=1, report=None):
+        # A batch holds exactly as many slots as it runs queries; larger
+        # ones could never be admitted and must be split with `batches`
+        if count > self.batch_size(priority):
+            raise ValueError(f"Cannot admit {count} queries at once, at most {self.batch_size(priority)}")
+        count = max(1, count)
+        waiter = [priority, next(self._order), count]
+        with self._condition:
+            started = self.clock()
+            if len(self._waiting) >= self.max_queued:
+                raise self._reject(priority, started, "queue full", report)
+            deadline = started + self.timeouts.get(priority, QUEUE_TIMEOUTS[INTERACTIVE])
+            self._waiting.append(waiter)
+            try:
+                while True:
+                    wait = self._turn(waiter)
+                    if wait == 0:
+                        break
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        raise self._reject(priority, started, "queue timeout", report)
+                    self._condition.wait(remaining if wait is None else min(wait, remaining))
+            finally:
+                self._waiting.remove(waiter)
+                self._condition.notify_all()
+            self._tokens -= count
+            self.running[priority] += count
+            depth = len(self._waiting)
+        if report is not None:
+            report(priority, self.clock() - started, depth, True)
+        return count
+
+    def release(self, priority, count, held=None):
+        with self._condition:
+            self.running[priority] -= count
+            if held is not None:
+                self._hold_time += 0.2 * (held - self._hold_time)
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def admit(self, priority=INTERACTIVE, count=1, report=None):
+        count = self.acquire(priority, count, report)
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self.release(priority, count, self.clock() - started)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_controller():
+    # One controller per process: the course and user routes served by one
+    # app draw on the same Athena limits. Separate Lambda containers each
+    # have their own, so this does not enforce the account-wide Athena
+    # limit; size ATHENA_MAX_CONCURRENT as that limit divided by the
+    # function's reserved concurrency.
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = AdmissionController()
+        return _shared
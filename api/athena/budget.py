@@ -0,0 +1,90 @@
+import json
+import time
+import logging
+import threading
+from api.athena.executor import ScanBudgetExceeded
+
+logger = logging.getLogger()
+
+MB = 1024 * 1024
+
+
+class ScanCatalog:
+    # Bytes scanned by recent runs of each query, by name and parameters.
+    # Kept as an exponentially weighted average, so one unusual run only
+    # moves the estimate part of the way. Estimates not refreshed for
+    # `max_age` seconds are dropped: a query refused on its estimate never
+    # runs to lower it, so it gets another (budget-capped) run instead.
+    def __init__(self, weight=0.3, max_age=300, clock=time.monotonic):
+        self.weight = weight
+        self.max_age = max_age
+        self.clock = clock
+        self._estimates = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, scanned):
+        with self._lock:
+            previous = self._estimates.get(key)
+            if previous is None or self.clock() - previous[1] > self.max_age:
+                estimate = float(scanned)
+            else:
+                estimate = previous[0] + self.weight * (scanned - previous[0])
+            self._estimates[key] = (estimate, self.clock())
+
+    def estimate(self, key):
+        with self._lock:
+            entry = self._estimates.get(key)
+            if entry is None:
+                return None
+            if self.clock() - entry[1] > self.max_age:
+                del self._estimates[key]
+                return None
+            return int(entry[0])
+
+    def snapshot(self):
+        with self._lock:
+            return {key: int(estimate) for key, (estimate, _) in self._estimates.items()}
+
+
+def scan_key(query):
+    # One large course must not get the template refused for every course
+    return (getattr(query, "name", None) or "sql", tuple(getattr(query, "parameters", None) or ()))
+
+
+def parse_budgets(text):
+    # SCAN_BUDGETS_MB: {"GET /api/course-users": 2048, ...}
+    if not text:
+        return {}
+    return {route: int(float(megabytes) * MB) for route, megabytes in json.loads(text).items()}
+
+
+class ScanGuard:
+    # Per-route limits on the bytes Athena may scan for one request.
+    # `check` rejects queries whose catalogued scans already exceed the
+    # route's budget before they start; `budget` is handed to the executor,
+    # which cancels the queries once they scan more than that. `route`
+    # returns the route being handled (Metrics.current_route).
+    def __init__(self, default_budget=None, budgets=None, route=lambda: None, catalog=None):
+        self.default_budget = default_budget
+        self.budgets = budgets or {}
+        self.route = route
+        self.catalog = catalog or ScanCatalog()
+
+    def budget(self):
+        budget = self.budgets.get(self.route(), self.default_budget)
+        return budget if budget is not None and budget > 0 else None
+
+    def check(self, queries):
+        budget = self.budget()
+        if budget is None:
+            return
+        estimates = [self.catalog.estimate(scan_key(query)) for query in queries]
+        estimate = sum(estimate for estimate in estimates if estimate is not None)
+        if estimate > budget:
+            raise ScanBudgetExceeded(estimate, budget, estimated=True)
+
+    def record(self, query, execution):
+        # An executor on_complete callback; also sees cancelled queries
+        statistics = execution.get("Statistics") or {}
+        if "DataScannedInBytes" in statistics:
+            self.catalog.record(scan_key(query), statistics["DataScannedInBytes"])
@@ -0,0 +1,250 @@
+"""Publishes a new dataset version, invalidating every cached query result.
+
+    python -m api.athena.cache publish --bucket mooccubex-datalake
+    python -m api.athena.cache publish --bucket mooccubex-datalake --version 2026-10-18
+
+Run it after every refresh of the lake (and after compaction jobs). Lambda
+containers pick the new version up within a minute and stop using results
+cached under the old one, in memory and in S3.
+"""
+import re
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from api.athena.reader import ResultSet
+
+logger = logging.getLogger()
+
+MISSING = object()
+
+# Whitespace outside of string literals does not change the meaning of a
+# query, so it is collapsed before hashing. Literals are kept verbatim.
+_SQL_TOKEN = re.compile(r"'(?:[^']|'')*'|\s+")
+
+
+def normalize_sql(query: str) -> str:
+    normalized = _SQL_TOKEN.sub(lambda m: m.group(0) if m.group(0).startswith("'") else " ", query)
+    return normalized.strip().rstrip(";").strip()
+
+
+def cache_key(query, version: str) -> str:
+    # `query` is plain SQL or a BoundQuery; its parameters are part of the key
+    text = normalize_sql(getattr(query, "sql", query))
+    parameters = getattr(query, "parameters", None)
+    if parameters:
+        text += "\0" + json.dumps(parameters)
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{version}/{digest}"
+
+
+class LRUCache:
+    def __init__(self, maxsize=256, ttl=300, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return MISSING
+            expires_at, value = item
+            if expires_at <= self.clock():
+                del self._items[key]
+                return MISSING
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (self.clock() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class S3Cache:
+    def __init__(self, client, bucket, prefix, ttl=86400):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{key}.json")
+        except self.client.exceptions.NoSuchKey:
+            return MISSING
+        payload = json.loads(obj["Body"].read())
+        if payload["stored_at"] + self.ttl <= time.time():
+            return MISSING
+        if payload.get("columns") is not None:
+            return ResultSet(payload["value"], [tuple(column) for column in payload["columns"]])
+        return payload["value"]
+
+    def set(self, key, value):
+        payload = {"stored_at": time.time(), "value": value}
+        if getattr(value, "columns", None) is not None:
+            payload["columns"] = value.columns
+        body = json.dumps(payload)
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{key}.json",
+            Body=body.encode("utf-8"),
+            ContentType="application/json",
+        )
+
+
+class DatasetVersion:
+    # The current dataset version lives in a single S3 object. Publishing a
+    # new version changes every cache key, which invalidates both tiers.
+    def __init__(self, client, bucket, key, default="v0", refresh_interval=60, clock=time.monotonic):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.default = default
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self._value = None
+        self._checked_at = None
+
+    def get(self):
+        now = self.clock()
+        if self._checked_at is None or now - self._checked_at >= self.refresh_interval:
+            try:
+                obj = self.client.get_object(Bucket=self.bucket, Key=self.key)
+                self._value = obj["Body"].read().decode("utf-8").strip() or self.default
+            except self.client.exceptions.NoSuchKey:
+                self._value = self.default
+            except Exception as e:
+                logger.warning(f"Could not read dataset version: {e}")
+                self._value = self._value or self.default
+            self._checked_at = now
+        return self._value
+
+    def publish(self, version: str):
+        self.client.put_object(Bucket=self.bucket, Key=self.key, Body=version.encode("utf-8"))
+        self._value = version
+        self._checked_at = self.clock()
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def shared_dataset_version(client, bucket, key):
+    # Modules served by the same process agree on the version and read it
+    # once per refresh interval between them
+    with _versions_lock:
+        version = _versions.get((bucket, key))
+        if version is None:
+            version = _versions[(bucket, key)] = DatasetVersion(client, bucket, key)
+        return version
+
+
+class QueryCache:
+    def __init__(self, local, shared=None, version=None):
+        self.local = local
+        self.shared = shared
+        self.version = version
+        self.stats = {"local_hits": 0, "shared_hits": 0, "misses": 0}
+        self._current_version = None
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        # Requests share the cache across threads
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def current_version(self):
+        version = self.version.get() if self.version is not None else "v0"
+        if version != self._current_version:
+            if self._current_version is not None:
+                logger.info(f"Dataset version changed to {version}, clearing query cache")
+            self.local.clear()
+            self._current_version = version
+        return version
+
+    def get(self, query):
+        key = cache_key(query, self.current_version())
+        value = self.local.get(key)
+        if value is not MISSING:
+            self._count("local_hits")
+            return value
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                logger.warning(f"Shared cache read failed: {e}")
+                value = MISSING
+            if value is not MISSING:
+                self._count("shared_hits")
+                self.local.set(key, value)
+                return value
+        self._count("misses")
+        return MISSING
+
+    def set(self, query, value):
+        key = cache_key(query, self.current_version())
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except Exception as e:
+                logger.warning(f"Shared cache write failed: {e}")
+
+    def run(self, queries, runner):
+        # Serve what we can from the cache and send only the misses to
+        # `runner`, which takes a list of queries and returns their results.
+        results = [self.get(query) for query in queries]
+        missed = [i for i, value in enumerate(results) if value is MISSING]
+        if missed:
+            fresh = runner([queries[i] for i in missed])
+            for i, value in zip(missed, fresh):
+                self.set(queries[i], value)
+                results[i] = value
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Query cache stats: {json.dumps(self.stats)}")
+        return results
+
+    def invalidate(self, version: str):
+        if self.version is not None:
+            self.version.publish(version)
+        self.local.clear()
+        self._current_version = version
+
+
+def default_version():
+    return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["publish"])
+    parser.add_argument("--bucket", default="mooccubex-datalake", help="CACHE_BUCKET of the API")
+    parser.add_argument("--prefix", default="query_cache/", help="CACHE_PREFIX of the API")
+    parser.add_argument("--version", default=None, help="defaults to the current UTC time")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from api.clients import LazyClient
+    version = args.version or default_version()
+    DatasetVersion(LazyClient("s3"), args.bucket, f"{args.prefix}dataset_version").publish(version)
+    logger.info(f"Published dataset version {version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future
+from api.athena.cache import cache_key
+from api.athena.templates import BoundQuery
+from api.athena.reader import ResultSet
+
+logger = logging.getLogger()
+
+
+class SingleFlight:
+    # Concurrent callers asking for the same key share the first caller's
+    # future instead of starting their own work.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def claim(self, key):
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                return future, False
+            future = self._flights[key] = Future()
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future, True
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+
+
+class BatchTemplate:
+    # The multi-key form of a single-key lookup: `sql` filters with
+    # `IN ({keys})` and returns `key_column`, which is used to split the rows
+    # back out per key.
+    def __init__(self, name, sql, key_param, key_column="course_id", drop_key=True, limit_per_key=None):
+        self.name = name
+        self.sql = sql
+        self.key_param = key_param
+        self.key_column = key_column
+        self.drop_key = drop_key
+        self.limit_per_key = limit_per_key
+
+    def bind(self, literals):
+        keys = ", ".join("?" for _ in literals)
+        return BoundQuery(self.name, self.sql.format(keys=keys), literals)
+
+    def key_literal(self, value):
+        return self.key_param.literal(self.key_param.value({self.key_param.name: value}))
+
+    def split(self, rows, literals):
+        columns = getattr(rows, "columns", None)
+        if columns is not None and self.drop_key:
+            columns = [column for column in columns if column[0] != self.key_column]
+        grouped = {literal: ResultSet(columns=columns) for literal in literals}
+        for row in rows:
+            bucket = grouped.get(self.key_literal(row[self.key_column]))
+            if bucket is None:
+                continue
+            if self.limit_per_key is not None and len(bucket) >= self.limit_per_key:
+                continue
+            if self.drop_key:
+                row = {column: value for column, value in row.items() if column != self.key_column}
+            bucket.append(row)
+        return grouped
+
+
+class MicroBatcher:
+    # Keys submitted for the same template within `window` seconds are
+    # looked up together in one query.
+    def __init__(self, run_queries, window=0.02, max_batch=50):
+        self.run_queries = run_queries
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def submit(self, template, literal):
+        with self._lock:
+            batch = self._pending.get(template.name)
+            if batch is None:
+                batch = self._pending[template.name] = {}
+                # Flushed in the context of the first caller, whose route
+                # the batch is then reported and admitted under
+                context = contextvars.copy_context()
+                timer = threading.Timer(self.window, context.run, args=(self._flush, template, batch))
+                timer.daemon = True
+                timer.start()
+            future = batch.get(literal)
+            if future is None:
+                future = batch[literal] = Future()
+            if len(batch) >= self.max_batch:
+                # Full; later keys start a new batch, this one flushes on time
+                del self._pending[template.name]
+        return future
+
+    def _flush(self, template, batch):
+        with self._lock:
+            if self._pending.get(template.name) is batch:
+                del self._pending[template.name]
+            literals = list(batch)
+        logger.info(f"Running {template.name} for {len(literals)} keys in one query")
+        try:
+            rows = self.run_queries([template.bind(literals)])[0]
+            grouped = template.split(rows, literals)
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        for literal, future in batch.items():
+            future.set_result(grouped[literal])
+
+
+def _chain(source, target):
+    def copy(done):
+        error = done.exception()
+        if error is not None:
+            target.set_exception(error)
+        else:
+            target.set_result(done.result())
+    source.add_done_callback(copy)
+
+
+class QueryCoalescer:
+    # Sits in front of `run_queries`: identical in-flight queries run once,
+    # and single-key lookups with a batch form are merged per table.
+    def __init__(self, run_queries, batch_templates=None, window=0.02, max_batch=50):
+        self.run_queries = run_queries
+        self.batch_templates = batch_templates or {}
+        self.flights = SingleFlight()
+        self.batcher = MicroBatcher(run_queries, window, max_batch)
+        self.stats = {"direct": 0, "batched": 0, "shared": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def run(self, queries):
+        futures = []
+        direct = []
+        for query in queries:
+            future, leader = self.flights.claim(cache_key(query, ""))
+            futures.append(future)
+            if not leader:
+                self._count("shared")
+                continue
+            template = self.batch_templates.get(getattr(query, "name", None))
+            if template is not None and len(query.parameters) == 1:
+                self._count("batched")
+                _chain(self.batcher.submit(template, query.parameters[0]), future)
+            else:
+                self._count("direct")
+                direct.append((query, future))
+
+        if direct:
+            try:
+                results = self.run_queries([query for query, _ in direct])
+            except Exception as e:
+                for _, future in direct:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(direct, results):
+                    future.set_result(result)
+
+        return [future.result() for future in futures]
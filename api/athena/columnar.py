@@ -0,0 +1,78 @@
+import math
+from api.athena.reader import ResultSet
+from api.athena.templates import InvalidParameter
+
+# Athena (and DuckDB) type names, lower-cased and without precision
+INTEGER_TYPES = {"tinyint", "smallint", "integer", "int", "bigint", "hugeint"}
+FLOAT_TYPES = {"float", "real", "double", "decimal"}
+
+
+def _float(value):
+    number = float(value)
+    # NaN and Infinity are not valid JSON
+    return number if math.isfinite(number) else None
+
+
+def _timestamp(value):
+    # "2020-01-01 00:00:00.000" -> ISO 8601, which every client parses
+    return value.replace(" ", "T", 1)
+
+
+def converter(type_name):
+    base = type_name.split("(", 1)[0].strip()
+    if base in INTEGER_TYPES:
+        return int
+    if base in FLOAT_TYPES:
+        return _float
+    if base == "boolean":
+        return lambda value: value.lower() == "true"
+    if base.startswith("timestamp"):
+        return _timestamp
+    # varchar, date (already ISO), and anything else stay strings
+    return None
+
+
+def _convert_column(values, convert):
+    if convert is None:
+        return values
+    converted = []
+    for value in values:
+        try:
+            converted.append(None if value is None else convert(value))
+        except (TypeError, ValueError):
+            converted.append(None)
+    return converted
+
+
+def to_columnar(rows):
+    # One array per column, with the names and types sent once:
+    # {"columns": [...], "types": [...], "data": [[...], [...]]}
+    columns = getattr(rows, "columns", None)
+    if columns is None:
+        columns = [(name, "varchar") for name in (rows[0] if rows else {})]
+    names = [name for name, _ in columns]
+    types = [type_name for _, type_name in columns]
+    data = [
+        _convert_column([row.get(name) for row in rows], converter(type_name))
+        for name, type_name in columns
+    ]
+    return {"columns": names, "types": types, "data": data}
+
+
+def columnar(data):
+    # Converts the query results in a route's response; anything else
+    # (handler output, pre-encoded bodies) is returned unchanged.
+    if isinstance(data, ResultSet):
+        return to_columnar(data)
+    if isinstance(data, dict):
+        return {key: columnar(value) if isinstance(value, ResultSet) else value for key, value in data.items()}
+    return data
+
+
+def wants_columnar(params):
+    # `?format=columnar` selects the columnar body; `json` (the default)
+    # keeps the list of row objects. The parameter is removed from `params`.
+    value = params.pop("format", None) or "json"
+    if value not in ("json", "columnar"):
+        raise InvalidParameter("format")
+    return value == "columnar"
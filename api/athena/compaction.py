@@ -0,0 +1,244 @@
+"""Rewrites the raw event tables as Parquet partitioned by course and month.
+
+    python -m api.athena.compaction exercise --source 'raw/exercise/*.parquet' --output /tmp/compacted
+    python -m api.athena.compaction exercise --source ... --output ... --bucket mooccubex-datalake --prefix compacted/ --register
+
+Run it after each lake refresh, once the new dataset version is published
+(python -m api.athena.cache publish). After uploading, it records the dataset
+version it compacted next to the table; until a table's version matches the
+current one, the API reads the raw table instead (see CompactedTables).
+
+The output is a Hive layout, `<table>/course_id=<id>/event_year=<y>/event_month=<m>/*.parquet`,
+with rows sorted by user within each file. It can be read locally with
+QUERY_BACKEND=duckdb (LOCAL_DATA_DIR=<output>) and, once uploaded, is
+registered in Athena with partition projection so course lookups only read
+their own partitions.
+"""
+import os
+import re
+import logging
+import argparse
+from api.athena.cache import DatasetVersion
+from api.athena.templates import BoundQuery
+
+logger = logging.getLogger()
+
+PARTITION_COLUMNS = ("course_id", "event_year", "event_month")
+ROW_GROUP_SIZE = 100000
+# Next to the table's partitions; Athena skips files starting with "_"
+VERSION_FILE = "_dataset_version"
+
+# DuckDB column types and their Athena (Hive) names
+ATHENA_TYPES = {
+    "VARCHAR": "string",
+    "BIGINT": "bigint",
+    "INTEGER": "int",
+    "SMALLINT": "smallint",
+    "TINYINT": "tinyint",
+    "DOUBLE": "double",
+    "FLOAT": "float",
+    "BOOLEAN": "boolean",
+    "DATE": "date",
+    "TIMESTAMP": "timestamp",
+}
+
+
+class CompactedTable:
+    # `timestamp` is the SQL expression the event's year and month are taken
+    # from. Rows where it is NULL go to year/month 0, which the query
+    # templates turn back into NULL.
+    def __init__(self, source, name, timestamp, sort=("user_id",)):
+        self.source = source
+        self.name = name
+        self.timestamp = timestamp
+        self.sort = sort
+
+
+COMPACTED_TABLES = {
+    "exercise": CompactedTable("exercise", "exercise_by_course", "TRY_CAST(exercise_submit_date_max AS DATE)"),
+    "comment": CompactedTable("comment", "comment_by_course", "TRY_CAST(create_time AS TIMESTAMP)"),
+    "reply": CompactedTable("reply", "reply_by_course", "TRY_CAST(create_time AS TIMESTAMP)"),
+}
+
+
+def _quote(path):
+    return "'" + path.replace("'", "''") + "'"
+
+
+def source_relation(path):
+    if path.endswith((".csv", ".csv.gz")):
+        return f"read_csv_auto({_quote(path)})"
+    return f"read_parquet({_quote(path)})"
+
+
+def _event_columns(table):
+    return f"""
+                COALESCE(YEAR({table.timestamp}), 0) AS event_year,
+                COALESCE(MONTH({table.timestamp}), 0) AS event_month"""
+
+
+def compaction_sql(table, source_path, output_dir, columns):
+    sort = [column for column in table.sort if column in columns]
+    order_by = ", ".join(list(PARTITION_COLUMNS) + sort)
+    return f"""
+        COPY (
+            SELECT
+                *,{_event_columns(table)}
+            FROM {source_relation(source_path)}
+            ORDER BY {order_by}
+        ) TO {_quote(os.path.join(output_dir, table.name))} (
+            FORMAT PARQUET,
+            PARTITION_BY ({", ".join(PARTITION_COLUMNS)}),
+            COMPRESSION ZSTD,
+            ROW_GROUP_SIZE {ROW_GROUP_SIZE},
+            OVERWRITE_OR_IGNORE
+        )
+    """
+
+
+def compact_table(table, source_path, output_dir, connection=None):
+    # Returns the data columns `[(name, duckdb type)]` and the event years
+    # written, which the Athena table definition needs.
+    import duckdb
+    connection = connection or duckdb.connect()
+    described = connection.execute(f"DESCRIBE SELECT * FROM {source_relation(source_path)}").fetchall()
+    columns = [(name, column_type) for name, column_type, *_ in described]
+    names = {name for name, _ in columns}
+    if "course_id" not in names:
+        raise ValueError(f"{table.source} has no course_id column")
+
+    os.makedirs(output_dir, exist_ok=True)
+    connection.execute(compaction_sql(table, source_path, output_dir, names))
+    years = connection.execute(f"""
+        SELECT DISTINCT event_year
+        FROM read_parquet({_quote(os.path.join(output_dir, table.name, "**", "*.parquet"))}, hive_partitioning = true)
+        ORDER BY event_year
+    """).fetchall()
+    logger.info(f"Compacted {table.source} into {os.path.join(output_dir, table.name)}")
+    data_columns = [(name, column_type) for name, column_type in columns if name != "course_id"]
+    return data_columns, [year for (year,) in years]
+
+
+def athena_ddl(table, columns, years, location):
+    # Partition projection: course_id is injected from the query's filter,
+    # so Athena never lists partitions and every query must filter on it.
+    location = location.rstrip("/") + "/"
+    column_list = ",\n    ".join(
+        f"`{name}` {ATHENA_TYPES.get(column_type.split('(')[0], 'string')}" for name, column_type in columns
+    )
+    return f"""CREATE EXTERNAL TABLE IF NOT EXISTS {table.name} (
+    {column_list}
+)
+PARTITIONED BY (course_id string, event_year int, event_month int)
+STORED AS PARQUET
+LOCATION '{location}'
+TBLPROPERTIES (
+    'parquet.compression' = 'ZSTD',
+    'projection.enabled' = 'true',
+    'projection.course_id.type' = 'injected',
+    'projection.event_year.type' = 'enum',
+    'projection.event_year.values' = '{",".join(str(year) for year in years)}',
+    'projection.event_month.type' = 'integer',
+    'projection.event_month.range' = '0,12',
+    'storage.location.template' = '{location}course_id=${{course_id}}/event_year=${{event_year}}/event_month=${{event_month}}/'
+)"""
+
+
+def athena_years_update(table, years):
+    # CREATE ... IF NOT EXISTS keeps old properties, so new years are added here
+    values = ",".join(str(year) for year in years)
+    return f"ALTER TABLE {table.name} SET TBLPROPERTIES ('projection.event_year.values' = '{values}')"
+
+
+def upload_directory(s3_client, directory, bucket, prefix):
+    for root, _, files in os.walk(directory):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            key = prefix + os.path.relpath(path, os.path.dirname(directory)).replace(os.sep, "/")
+            s3_client.upload_file(path, bucket, key)
+
+
+def _reads(sql, table):
+    return re.compile(rf"\bFROM\s+{table.name}\b").search(sql) is not None
+
+
+def raw_sql(sql, tables):
+    # The same query reading the raw tables: each compacted table becomes a
+    # subquery adding the partition columns, under the compacted name
+    for table in tables:
+        sql = re.sub(
+            rf"\bFROM\s+{table.name}\b",
+            lambda _: f"FROM (SELECT *,{_event_columns(table)} FROM {table.source}) AS {table.name}",
+            sql,
+        )
+    return sql
+
+
+class CompactedTables:
+    # Which compacted tables are current. The compaction job records the
+    # dataset version it compacted next to each table; queries over a table
+    # that was never compacted, or was compacted from an older version, are
+    # rewritten to read the raw table until the job runs again.
+    def __init__(self, client, bucket, prefix, version, tables=None):
+        self.version = version
+        self.tables = [
+            (table, DatasetVersion(client, bucket, f"{prefix}{table.name}/{VERSION_FILE}", default=None))
+            for table in (tables or COMPACTED_TABLES.values())
+        ]
+
+    def current(self, queries):
+        read = [(table, compacted) for table, compacted in self.tables if any(_reads(q.sql, table) for q in queries)]
+        if not read:
+            return queries
+        version = self.version.get()
+        stale = [table for table, compacted in read if compacted.get() != version]
+        if not stale:
+            return queries
+        logger.info(f"Compacted tables not at version {version}, reading raw: {[table.name for table in stale]}")
+        return [BoundQuery(query.name, raw_sql(query.sql, stale), query.parameters) for query in queries]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("table", choices=sorted(COMPACTED_TABLES))
+    parser.add_argument("--source", required=True, help="Parquet or CSV files of the raw table (globs allowed)")
+    parser.add_argument("--output", required=True, help="local directory the partitioned table is written to")
+    parser.add_argument("--bucket", help="upload the result to this S3 bucket")
+    parser.add_argument("--prefix", default="compacted/")
+    parser.add_argument("--register", action="store_true", help="create the Athena table (needs --bucket)")
+    parser.add_argument("--database", default=os.environ.get("DATABASE", "analyticsworkshopdb"))
+    parser.add_argument("--query-output", default="s3://mooccubex-datalake/query_results/")
+    parser.add_argument("--cache-bucket", default=os.environ.get("CACHE_BUCKET", "mooccubex-datalake"))
+    parser.add_argument("--cache-prefix", default=os.environ.get("CACHE_PREFIX", "query_cache/"))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    table = COMPACTED_TABLES[args.table]
+    if args.bucket is not None:
+        from api.clients import LazyClient
+        from api.athena.executor import run_query
+        s3 = LazyClient("s3")
+        # Read before compacting, so a refresh published meanwhile leaves
+        # the table marked as behind
+        version = DatasetVersion(s3, args.cache_bucket, f"{args.cache_prefix}dataset_version").get()
+    columns, years = compact_table(table, args.source, args.output)
+    if args.bucket is None:
+        return
+
+    upload_directory(s3, os.path.join(args.output, table.name), args.bucket, args.prefix)
+    ddl = athena_ddl(table, columns, years, f"s3://{args.bucket}/{args.prefix}{table.name}/")
+    if args.register:
+        athena = LazyClient("athena")
+        run_query(athena, ddl, args.database, args.query_output)
+        run_query(athena, athena_years_update(table, years), args.database, args.query_output)
+    else:
+        # Queries keep reading the raw table until it is registered and
+        # the job is rerun with --register
+        print(ddl)
+        return
+    DatasetVersion(s3, args.bucket, f"{args.prefix}{table.name}/{VERSION_FILE}").publish(version)
+    logger.info(f"Recorded {table.name} as compacted at dataset version {version}")
+
+
+if __name__ == "__main__":
+    main()
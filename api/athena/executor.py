@@ -0,0 +1,168 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from api.athena.reader import read_result_set, iter_query_rows
+
+logger = logging.getLogger()
+
+TERMINAL_STATES = ("SUCCEEDED", "FAILED", "CANCELLED")
+
+# Most lookups finish in a few hundred milliseconds, so poll fast at first
+# and back off for the long full-table scans.
+POLL_INITIAL_DELAY = 0.1
+POLL_MAX_DELAY = 2.0
+POLL_BACKOFF = 1.5
+
+
+class AthenaQueryError(Exception):
+    pass
+
+
+class ScanBudgetExceeded(AthenaQueryError):
+    # Raised before a query starts when its estimated scan is over budget
+    # (`estimated`), or once running queries have scanned more than it.
+    def __init__(self, scanned, budget, estimated=False, executions=None):
+        self.scanned = scanned
+        self.budget = budget
+        self.estimated = estimated
+        self.executions = executions or {}
+        verb = "would scan about" if estimated else "scanned"
+        super().__init__(f"Query {verb} {scanned} bytes, over its budget of {budget} bytes")
+
+
+def bytes_scanned(executions):
+    return sum((execution.get("Statistics") or {}).get("DataScannedInBytes", 0) for execution in executions)
+
+
+def start_query(client, query, database, output_location):
+    # `query` is plain SQL or a BoundQuery, whose values go to Athena as
+    # execution parameters rather than being spliced into the SQL.
+    kwargs = {}
+    parameters = getattr(query, "parameters", None)
+    if parameters:
+        kwargs["ExecutionParameters"] = parameters
+    response = client.start_query_execution(
+        QueryString=getattr(query, "sql", query),
+        QueryExecutionContext={"Database": database},
+        ResultConfiguration={"OutputLocation": output_location},
+        **kwargs
+    )
+    execution_id = response["QueryExecutionId"]
+    logger.info(f"QueryExecutionId: {execution_id}")
+    return execution_id
+
+
+def poll_delays(initial=POLL_INITIAL_DELAY, maximum=POLL_MAX_DELAY, backoff=POLL_BACKOFF):
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * backoff, maximum)
+
+
+def wait_for_queries(client, execution_ids, scan_budget=None):
+    # Returns the final QueryExecution of every id, or stops early as soon as
+    # one of them ends in FAILED/CANCELLED so the caller can give up quickly.
+    # With a `scan_budget`, the queries still running are cancelled once all
+    # of them together have scanned more bytes than that.
+    pending = list(execution_ids)
+    executions = {}
+    latest = {}
+    delays = poll_delays()
+    while pending:
+        for execution_id in list(pending):
+            execution = client.get_query_execution(QueryExecutionId=execution_id)["QueryExecution"]
+            latest[execution_id] = execution
+            state = execution["Status"]["State"]
+            if state not in TERMINAL_STATES:
+                continue
+            logger.info(f"Athena query {execution_id} state: {state}")
+            executions[execution_id] = execution
+            pending.remove(execution_id)
+            if state != "SUCCEEDED":
+                return executions
+        if scan_budget is not None:
+            scanned = bytes_scanned(latest.values())
+            if scanned > scan_budget:
+                logger.warning(f"Cancelling {len(pending)} queries: {scanned} bytes scanned, budget {scan_budget}")
+                cancel_queries(client, pending)
+                raise ScanBudgetExceeded(scanned, scan_budget, executions=latest)
+        if pending:
+            time.sleep(next(delays))
+    return executions
+
+
+def cancel_queries(client, execution_ids):
+    for execution_id in execution_ids:
+        try:
+            client.stop_query_execution(QueryExecutionId=execution_id)
+        except Exception as e:
+            logger.warning(f"Could not cancel query {execution_id}: {e}")
+
+
+def fetch_results(client, execution_id):
+    return read_result_set(client, execution_id)
+
+
+def raise_for_failures(client, execution_ids, executions):
+    for execution_id in execution_ids:
+        execution = executions.get(execution_id)
+        if execution is None or execution["Status"]["State"] == "SUCCEEDED":
+            continue
+        state = execution["Status"]["State"]
+        reason = execution["Status"].get("StateChangeReason", "Unknown reason")
+        logger.error(f"Query failed. Reason: {reason}")
+        cancel_queries(client, [i for i in execution_ids if i not in executions])
+        raise AthenaQueryError(f"Athena query failed: {state}")
+
+
+def report_executions(on_complete, queries, execution_ids, executions):
+    if on_complete is None:
+        return
+    for query, execution_id in zip(queries, execution_ids):
+        if execution_id not in executions:
+            continue
+        try:
+            on_complete(query, executions[execution_id])
+        except Exception as e:
+            logger.warning(f"Could not report query {execution_id}: {e}")
+
+
+def wait_and_report(client, queries, execution_ids, on_complete, scan_budget):
+    try:
+        executions = wait_for_queries(client, execution_ids, scan_budget)
+    except ScanBudgetExceeded as e:
+        # Cancelled queries still count towards the scan statistics
+        report_executions(on_complete, queries, execution_ids, e.executions)
+        raise
+    raise_for_failures(client, execution_ids, executions)
+    report_executions(on_complete, queries, execution_ids, executions)
+    return executions
+
+
+def run_queries(client, queries, database, output_location, on_complete=None, scan_budget=None):
+    # Start every query at once and wait on all of them together, so the
+    # latency of the batch is that of the slowest query, not the sum.
+    # `on_complete(query, execution)` gets the final QueryExecution of each.
+    queries = list(queries)
+    if not queries:
+        return []
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        execution_ids = list(pool.map(
+            lambda query: start_query(client, query, database, output_location), queries
+        ))
+
+        wait_and_report(client, queries, execution_ids, on_complete, scan_budget)
+
+        return list(pool.map(lambda execution_id: fetch_results(client, execution_id), execution_ids))
+
+
+def run_query(client, query, database, output_location, on_complete=None, scan_budget=None):
+    return run_queries(client, [query], database, output_location, on_complete, scan_budget)[0]
+
+
+def stream_query(client, query, database, output_location, s3_client=None, on_complete=None, scan_budget=None):
+    # Like run_query, but yields rows lazily for results too big to hold.
+    execution_id = start_query(client, query, database, output_location)
+    wait_and_report(client, [query], [execution_id], on_complete, scan_budget)
+    return iter_query_rows(client, execution_id, s3_client)
@@ -0,0 +1,175 @@
+import os
+import re
+import logging
+import threading
+from api.athena.reader import ResultSet
+
+logger = logging.getLogger()
+
+# Tables a query reads, found from its FROM / JOIN clauses
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
+
+
+def referenced_tables(sql):
+    return {table.lower() for table in _TABLE_REF.findall(sql)}
+
+
+def literal_value(literal):
+    # Turns an Athena execution parameter back into a Python value
+    if literal.startswith("'") and literal.endswith("'"):
+        return literal[1:-1].replace("''", "'")
+    return int(literal)
+
+
+def _has_parquet(folder):
+    # Stops at the first file, however many partitions there are
+    for _, _, files in os.walk(folder):
+        if any(name.endswith(".parquet") for name in files):
+            return True
+    return False
+
+
+class ParquetExtracts:
+    # Parquet extracts of the lake tables, as `<directory>/<table>.parquet` or
+    # `<directory>/<table>/*.parquet`. When an S3 prefix is configured, missing
+    # tables are downloaded into `directory` (e.g. /tmp) on first use.
+    def __init__(self, directory, s3_client=None, bucket=None, prefix=None):
+        self.directory = directory
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self._missing = set()
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def _stamp(self, table):
+        # Changes whenever a table is added to or removed from the extracts,
+        # or a table's folder gets new files or partitions
+        stamps = []
+        for folder in (self.directory, os.path.join(self.directory, table)):
+            try:
+                stamps.append(os.stat(folder).st_mtime_ns)
+            except OSError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def path(self, table):
+        # Resolved once per table and reused until its stamp changes, so
+        # routing a query does not walk a partitioned tree on every request
+        stamp = self._stamp(table)
+        cached = self._paths.get(table)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        path = self._resolve(table)
+        self._paths[table] = (stamp, path)
+        return path
+
+    def _resolve(self, table):
+        folder = os.path.join(self.directory, table)
+        if os.path.isdir(folder) and _has_parquet(folder):
+            return os.path.join(folder, "**", "*.parquet")
+        single = os.path.join(self.directory, f"{table}.parquet")
+        if os.path.exists(single):
+            return single
+        if self.s3 is None or self.prefix is None:
+            return None
+        with self._lock:
+            if table in self._missing:
+                return None
+            if not os.path.exists(single):
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self.s3.download_file(self.bucket, f"{self.prefix}{table}.parquet", single)
+                    logger.info(f"Downloaded extract of {table} to {single}")
+                except Exception as e:
+                    logger.info(f"No local extract of {table}: {e}")
+                    self._missing.add(table)
+                    return None
+        return single
+
+
+class DuckDBBackend:
+    # Runs the Athena SQL templates in an embedded DuckDB over the Parquet
+    # extracts. Values come back as strings, like get_query_results returns them.
+    def __init__(self, extracts):
+        self.extracts = extracts
+        self._connection = None
+        self._views = set()
+        self._lock = threading.Lock()
+
+    def can_run(self, query):
+        tables = referenced_tables(getattr(query, "sql", query))
+        return bool(tables) and all(self.extracts.path(table) for table in tables)
+
+    def _cursor(self, tables):
+        with self._lock:
+            if self._connection is None:
+                import duckdb
+                self._connection = duckdb.connect()
+            for table in tables - self._views:
+                path = self.extracts.path(table).replace("'", "''")
+                self._connection.execute(
+                    f"CREATE OR REPLACE VIEW {table} AS SELECT * FROM read_parquet('{path}', hive_partitioning = true)"
+                )
+                self._views.add(table)
+            # Each thread gets its own cursor; the connection is not shared
+            return self._connection.cursor()
+
+    def run_query(self, query):
+        sql = getattr(query, "sql", query)
+        parameters = [literal_value(literal) for literal in getattr(query, "parameters", None) or []]
+        cursor = self._cursor(referenced_tables(sql))
+        try:
+            cursor.execute(sql, parameters)
+            columns = [(column[0], str(column[1]).lower()) for column in cursor.description]
+            headers = [name for name, _ in columns]
+            return ResultSet((
+                dict(zip(headers, [None if value is None else str(value) for value in row]))
+                for row in cursor.fetchall()
+            ), columns)
+        finally:
+            cursor.close()
+
+    def __call__(self, queries):
+        return [self.run_query(query) for query in queries]
+
+
+class TieredBackend:
+    # Sends what the local extracts can answer to DuckDB and everything else,
+    # including local failures, to the remote backend (Athena).
+    def __init__(self, local, remote):
+        self.local = local
+        self.remote = remote
+        self.stats = {"local": 0, "remote": 0}
+
+    def __call__(self, queries):
+        queries = list(queries)
+        results = [None] * len(queries)
+        remote = []
+        for i, query in enumerate(queries):
+            if not self.local.can_run(query):
+                remote.append(i)
+                continue
+            try:
+                results[i] = self.local.run_query(query)
+                self.stats["local"] += 1
+            except Exception as e:
+                logger.warning(f"Local query failed, falling back to Athena: {e}")
+                remote.append(i)
+        if remote:
+            self.stats["remote"] += len(remote)
+            for i, result in zip(remote, self.remote([queries[i] for i in remote])):
+                results[i] = result
+        return results
+
+
+def query_backend(remote, name, directory, s3_client=None, bucket=None, prefix=None):
+    if name != "duckdb":
+        return remote
+    try:
+        import duckdb  # noqa: F401
+    except ImportError:
+        logger.warning("QUERY_BACKEND=duckdb but duckdb is not installed, using Athena")
+        return remote
+    extracts = ParquetExtracts(directory, s3_client, bucket, prefix)
+    return TieredBackend(DuckDBBackend(extracts), remote)
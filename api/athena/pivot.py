@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def _month_label(ordinal):
+    return f"{ordinal // 12}-{ordinal % 12 + 1:02d}"
+
+
+def monthly_matrix(rows, keys, key_of, value_column):
+    # Rows of (key, year, month, value) -> (["YYYY-MM", ...], keys × months
+    # matrix). The months run without gaps from the first to the last one
+    # any key has; missing cells are 0. Rows without a month, or for other
+    # keys, are left out.
+    index = {key: i for i, key in enumerate(keys)}
+    kept = [
+        (index[key_of(row)], int(row["year"]) * 12 + int(row["month"]) - 1, row[value_column])
+        for row in rows
+        if row["year"] is not None and row["month"] is not None and key_of(row) in index
+    ]
+    if not kept:
+        return [], np.zeros((len(keys), 0), dtype=np.int64)
+    key_ids, ordinals, values = (np.array(column) for column in zip(*kept))
+    values = values.astype(np.int64)
+    start = int(ordinals.min())
+    matrix = np.zeros((len(keys), int(ordinals.max()) - start + 1), dtype=np.int64)
+    np.add.at(matrix, (key_ids, ordinals - start), values)
+    return [_month_label(ordinal) for ordinal in range(start, start + matrix.shape[1])], matrix
+
+
+def category_matrix(rows, keys, key_of, category_column, value_column, categories=None):
+    # The same with one column per category, in the order given (or sorted)
+    index = {key: i for i, key in enumerate(keys)}
+    rows = [row for row in rows if key_of(row) in index and row[category_column] is not None]
+    if categories is None:
+        categories = sorted({row[category_column] for row in rows})
+    columns = {category: i for i, category in enumerate(categories)}
+    rows = [row for row in rows if row[category_column] in columns]
+    matrix = np.zeros((len(keys), len(categories)), dtype=np.int64)
+    if rows:
+        key_ids = np.array([index[key_of(row)] for row in rows])
+        column_ids = np.array([columns[row[category_column]] for row in rows])
+        values = np.array([row[value_column] for row in rows]).astype(np.int64)
+        np.add.at(matrix, (key_ids, column_ids), values)
+    return list(categories), matrix
@@ -0,0 +1,88 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+import contextlib
+
+logger = logging.getLogger()
+
+
+class Prefetcher:
+    # Runs speculative query batches on background threads, and only while
+    # no interactive request is being handled, so prefetching never delays
+    # one. Jobs with a lower `priority` run first; a job whose key is already
+    # queued is dropped, and jobs older than `max_age` seconds are skipped
+    # because whoever they were for has moved on.
+    def __init__(self, run, workers=1, max_queued=100, max_age=60, clock=time.monotonic):
+        self.run = run
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_age = max_age
+        self.clock = clock
+        self.stats = {"scheduled": 0, "dropped": 0, "expired": 0, "run": 0, "failed": 0}
+        self._heap = []
+        self._queued = set()
+        self._running = 0
+        self._interactive = 0
+        self._order = itertools.count()
+        self._threads = []
+        self._condition = threading.Condition()
+
+    def schedule(self, key, queries, priority=0):
+        with self._condition:
+            if key in self._queued or len(self._heap) >= self.max_queued:
+                self.stats["dropped"] += 1
+                return False
+            heapq.heappush(self._heap, (priority, next(self._order), self.clock(), key, queries))
+            self._queued.add(key)
+            self.stats["scheduled"] += 1
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"prefetch-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+            return True
+
+    @contextlib.contextmanager
+    def interactive(self):
+        # Wraps the handling of a request; prefetching waits until none is left
+        with self._condition:
+            self._interactive += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._interactive -= 1
+                self._condition.notify_all()
+
+    def _next_job(self):
+        with self._condition:
+            while not self._heap or self._interactive:
+                self._condition.wait()
+            _, _, scheduled_at, key, queries = heapq.heappop(self._heap)
+            self._queued.discard(key)
+            self._running += 1
+            return scheduled_at, key, queries
+
+    def _work(self):
+        while True:
+            scheduled_at, key, queries = self._next_job()
+            try:
+                if self.clock() - scheduled_at > self.max_age:
+                    self.stats["expired"] += 1
+                    continue
+                self.run(queries)
+                self.stats["run"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning(f"Prefetch of {key} failed: {e}")
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    self._condition.notify_all()
+
+    def drain(self, timeout=None):
+        # Waits until every queued job has run; for tests and benchmarks
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._heap and not self._running, timeout)
@@ -0,0 +1,137 @@
+import csv
+import json
+import codecs
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger()
+
+# get_query_results never returns more than 1000 rows per call
+MAX_PAGE_SIZE = 1000
+
+
+def _row_values(row):
+    return [col.get("VarCharValue", None) for col in row["Data"]]
+
+
+def iter_result_pages(client, execution_id, page_size=MAX_PAGE_SIZE):
+    kwargs = {"QueryExecutionId": execution_id, "MaxResults": page_size}
+    while True:
+        page = client.get_query_results(**kwargs)
+        yield page
+        next_token = page.get("NextToken")
+        if not next_token:
+            return
+        kwargs["NextToken"] = next_token
+
+
+class ResultSet(list):
+    # Rows of a query result plus, when the backend reported them, the
+    # `(name, type)` of each column. Types are Athena type names.
+    def __init__(self, rows=(), columns=None):
+        super().__init__(rows)
+        self.columns = columns
+
+
+def column_info(page):
+    info = page["ResultSet"].get("ResultSetMetadata", {}).get("ColumnInfo")
+    if not info:
+        return None
+    return [(column["Name"], column["Type"].lower()) for column in info]
+
+
+def iter_result_rows(client, execution_id, page_size=MAX_PAGE_SIZE):
+    # Follows NextToken until the result set is exhausted. The first row of
+    # the first page holds the column names.
+    headers = None
+    for page in iter_result_pages(client, execution_id, page_size):
+        rows = page["ResultSet"]["Rows"]
+        if headers is None:
+            if not rows:
+                return
+            headers = _row_values(rows[0])
+            rows = rows[1:]
+        for row in rows:
+            yield dict(zip(headers, _row_values(row)))
+
+
+def read_result_set(client, execution_id, page_size=MAX_PAGE_SIZE):
+    # Like iter_result_rows, but keeps the column types of the first page
+    pages = iter_result_pages(client, execution_id, page_size)
+    first = next(pages)
+    result = ResultSet(columns=column_info(first))
+    rows = first["ResultSet"]["Rows"]
+    if not rows:
+        return result
+    headers = _row_values(rows[0])
+    result.extend(dict(zip(headers, _row_values(row))) for row in rows[1:])
+    for page in pages:
+        result.extend(dict(zip(headers, _row_values(row))) for row in page["ResultSet"]["Rows"])
+    return result
+
+
+def split_s3_uri(uri):
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def iter_csv_rows(s3_client, output_location):
+    # Athena writes the full result as CSV next to the query results. Reading
+    # it in one streamed GET beats paging through thousands of API calls.
+    # NULLs and empty strings are indistinguishable in that file; both come
+    # back as None, as get_query_results reports NULLs.
+    bucket, key = split_s3_uri(output_location)
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+    reader = csv.reader(codecs.getreader("utf-8")(body))
+    headers = next(reader, None)
+    if headers is None:
+        return
+    for values in reader:
+        yield dict(zip(headers, [value if value != "" else None for value in values]))
+
+
+def iter_query_rows(client, execution_id, s3_client=None):
+    # Small results are read straight from the first page. When there is more
+    # than one page and an S3 client is available, the CSV is streamed instead.
+    pages = iter_result_pages(client, execution_id)
+    first = next(pages)
+    if s3_client is not None and first.get("NextToken"):
+        execution = client.get_query_execution(QueryExecutionId=execution_id)["QueryExecution"]
+        output_location = execution["ResultConfiguration"]["OutputLocation"]
+        logger.info(f"Streaming large result of {execution_id} from {output_location}")
+        yield from iter_csv_rows(s3_client, output_location)
+        return
+
+    rows = first["ResultSet"]["Rows"]
+    if not rows:
+        return
+    headers = _row_values(rows[0])
+    for row in rows[1:]:
+        yield dict(zip(headers, _row_values(row)))
+    for page in pages:
+        for row in page["ResultSet"]["Rows"]:
+            yield dict(zip(headers, _row_values(row)))
+
+
+class RawJSON(str):
+    # A response body that is already JSON encoded
+    pass
+
+
+def dumps(value):
+    # orjson is several times faster than json; both produce compact output
+    if orjson is not None:
+        try:
+            return orjson.dumps(value).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(value, separators=(",", ":"))
+
+
+def json_array(rows):
+    # Encodes rows one at a time so they never all exist as dicts at once.
+    return RawJSON("[" + ",".join(dumps(row) for row in rows) + "]")
@@ -0,0 +1,164 @@
+import json
+import time
+import logging
+import contextlib
+from api.athena.executor import ScanBudgetExceeded, run_queries, stream_query
+from api.athena.reader import dumps, RawJSON
+from api.athena.columnar import columnar, wants_columnar
+from api.athena.admission import AdmissionRejected, INTERACTIVE, BACKGROUND
+from api.athena.templates import MissingParameter, InvalidParameter
+from api.metrics import log_sampled
+from api.responses import respond, route_etag, etag_matches, request_header
+
+logger = logging.getLogger()
+
+
+class AthenaService:
+    # The Athena pipeline and request handling shared by the Lambda modules
+    # (api/lambda/course.py and user.py). `module` is the Lambda module; its
+    # globals are looked up on every call, so tests and benchmarks can swap
+    # them. It provides:
+    #   athena, s3, DATABASE, S3_OUTPUT    where queries run
+    #   metrics, scan_guard, admission     reporting, scan budgets, admission
+    #   router                             the routes it serves
+    #   current_version()                  the dataset version, for ETags
+    #   query_runner(params)               what a route's queries run with
+    #   LOG_SAMPLE_RATE, LOG_BODY_MAX_CHARS
+    # and optionally a `prefetcher` that waits while requests are handled,
+    # and `compacted` (CompactedTables) for modules that read compacted tables.
+    def __init__(self, module):
+        self.module = module
+
+    def on_query_complete(self, query, execution):
+        self.module.metrics.query(query, execution)
+        self.module.scan_guard.record(query, execution)
+
+    def query_priority(self):
+        # The admission class of the route being handled, or interactive
+        route_name = self.module.metrics.current_route()
+        if route_name == "prefetch":
+            return BACKGROUND
+        route = self.module.router.named.get(route_name)
+        return route.priority if route is not None and route.priority is not None else INTERACTIVE
+
+    def run_remote_queries(self, queries):
+        api = self.module
+        compacted = getattr(api, "compacted", None)
+        if compacted is not None:
+            queries = compacted.current(queries)
+        api.scan_guard.check(queries)
+        # Batches larger than the class may hold run in turn, each holding
+        # a slot per query
+        priority = self.query_priority()
+        results = []
+        for batch in api.admission.batches(priority, queries):
+            with api.admission.admit(priority, len(batch), report=api.metrics.admission):
+                results += run_queries(
+                    api.athena, batch, api.DATABASE, api.S3_OUTPUT,
+                    on_complete=self.on_query_complete, scan_budget=api.scan_guard.budget(),
+                )
+        return results
+
+    def stream_remote_query(self, query):
+        # Rows of one query, read lazily for results too big to hold
+        api = self.module
+        api.scan_guard.check([query])
+        with api.admission.admit(self.query_priority(), 1, report=api.metrics.admission):
+            return stream_query(
+                api.athena, query, api.DATABASE, api.S3_OUTPUT, s3_client=api.s3,
+                on_complete=self.on_query_complete, scan_budget=api.scan_guard.budget(),
+            )
+
+    def handle_request(self, event, route, path_params):
+        api = self.module
+        path = event.get("path", "")
+        params = {**(event.get("queryStringParameters") or {}), **path_params}
+        headers = {"Access-Control-Allow-Origin": "*"}
+        try:
+            as_columns = wants_columnar(params)
+            if as_columns and not route.columnar:
+                raise InvalidParameter("format")
+            if route.cache_control is not None:
+                # The ETag only depends on the request and the dataset version
+                # (and the sketches' for sketch-backed routes), so a matching
+                # If-None-Match never reaches Athena.
+                extra = [route.version()] if route.version is not None else []
+                etag = route_etag(route, path, params, api.current_version(), as_columns, *extra)
+                headers.update({"ETag": etag, "Cache-Control": route.cache_control})
+                if etag_matches(request_header(event, "If-None-Match"), etag):
+                    return {"statusCode": 304, "headers": headers, "body": ""}
+            data = route.run(params, api.query_runner(params))
+        except (MissingParameter, InvalidParameter) as e:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": str(e)})
+            }
+
+        if route.prefetch is not None:
+            try:
+                route.prefetch(data)
+            except Exception as e:
+                logger.warning(f"Could not schedule prefetch: {e}")
+
+        if as_columns:
+            data = columnar(data)
+        body = data if isinstance(data, RawJSON) else dumps(data)
+        log_sampled("Response body", body, api.LOG_SAMPLE_RATE, api.LOG_BODY_MAX_CHARS)
+
+        headers["Content-Type"] = "application/json"
+        return respond(event, 200, body, headers)
+
+    def lambda_handler(self, event, context):
+        api = self.module
+        started = time.perf_counter()
+        path = event.get("path", "")
+        method = event.get("httpMethod", "")
+        logger.info(f"Processing request: {method} {path}")
+        log_sampled("Event", event, api.LOG_SAMPLE_RATE, api.LOG_BODY_MAX_CHARS)
+
+        route, path_params = api.router.resolve(method, path)
+        if route is None:
+            logger.warning("404 Not Found: Path or method mismatch.")
+            return {
+                "statusCode": 404,
+                "body": json.dumps({"error": "Not Found"})
+            }
+
+        # Athena queries run while handling are tagged with the route
+        token = api.metrics.set_route(route.name)
+        prefetcher = getattr(api, "prefetcher", None)
+        try:
+            with prefetcher.interactive() if prefetcher is not None else contextlib.nullcontext():
+                response = api.handle_request(event, route, path_params)
+        except Exception as e:
+            response = self.error_response(route, e)
+        finally:
+            api.metrics.reset_route(token)
+
+        api.metrics.request(route.name, response["statusCode"], (time.perf_counter() - started) * 1000)
+        return response
+
+    def error_response(self, route, error):
+        if isinstance(error, AdmissionRejected):
+            logger.warning(f"Request shed: {str(error)}")
+            return {
+                "statusCode": 503,
+                "headers": {
+                    "Retry-After": str(error.retry_after),
+                    "Access-Control-Allow-Origin": "*",
+                    "Access-Control-Expose-Headers": "Retry-After",
+                },
+                "body": json.dumps({"error": str(error)})
+            }
+        if isinstance(error, ScanBudgetExceeded):
+            logger.warning(f"Scan budget exceeded: {str(error)}")
+            self.module.metrics.budget_exceeded(route.name, error)
+            return {
+                "statusCode": 422,
+                "body": json.dumps({"error": str(error)})
+            }
+        logger.error(f"Error: {str(error)}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(error)})
+        }
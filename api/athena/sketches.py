@@ -0,0 +1,275 @@
+"""HyperLogLog sketches of distinct users per month and per course.
+
+    python -m api.athena.sketches --bucket mooccubex-datalake --key sketches/distinct_users.bin
+    python -m api.athena.sketches --bucket mooccubex-datalake --key sketches/distinct_users.bin --since 2021-06
+
+Each run reads (year, month, course, user) tuples from full_phase1 and merges
+them into the stored sketches. Merging is idempotent, so re-reading months
+that were already added (e.g. the last one, still filling up) is harmless.
+With the default precision of 12 a count has a standard error of 1.6%
+(about 3.3% at 95% confidence).
+"""
+import io
+import json
+import math
+import time
+import zlib
+import base64
+import hashlib
+import logging
+import argparse
+import threading
+from api.athena.reader import ResultSet
+
+logger = logging.getLogger()
+
+DEFAULT_PRECISION = 12
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    __slots__ = ("p", "registers", "_count")
+
+    def __init__(self, p=DEFAULT_PRECISION, registers=None):
+        self.p = p
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << p)
+        self._count = None
+
+    def add(self, value):
+        hashed = _hash64(str(value))
+        index = hashed >> (64 - self.p)
+        rest = hashed & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            self._count = None
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("Cannot merge sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        self._count = None
+        return self
+
+    @classmethod
+    def union(cls, sketches, p=DEFAULT_PRECISION):
+        result = cls(p)
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
+
+    def count(self):
+        if self._count is None:
+            m = len(self.registers)
+            alpha = 0.7213 / (1 + 1.079 / m)
+            estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+            zeros = self.registers.count(0)
+            if estimate <= 2.5 * m and zeros:
+                # Linear counting is more accurate for small cardinalities
+                estimate = m * math.log(m / zeros)
+            self._count = int(round(estimate))
+        return self._count
+
+    @property
+    def standard_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+class SketchStore:
+    # Per (year, month): a sketch of its users and one of its courses.
+    # Per course: a sketch of its users.
+    def __init__(self, p=DEFAULT_PRECISION):
+        self.p = p
+        self.months = {}
+        self.courses = {}
+        self._answers = {}
+        self._lock = threading.Lock()
+
+    def add(self, year, month, course_id, user_id):
+        key = (int(year), int(month))
+        sketches = self.months.get(key)
+        if sketches is None:
+            sketches = self.months[key] = {"users": HyperLogLog(self.p), "courses": HyperLogLog(self.p)}
+        sketches["users"].add(user_id)
+        sketches["courses"].add(course_id)
+        course = self.courses.get(course_id)
+        if course is None:
+            course = self.courses[course_id] = HyperLogLog(self.p)
+        course.add(user_id)
+        self._answers.clear()
+
+    def update(self, rows):
+        count = 0
+        for row in rows:
+            if row["user_year"] is None or row["user_month"] is None:
+                continue
+            self.add(row["user_year"], row["user_month"], row["course_id"], row["user_id"])
+            count += 1
+        return count
+
+    def _answer(self, key, compute):
+        # Answers are computed once per loaded store
+        with self._lock:
+            if key not in self._answers:
+                self._answers[key] = compute()
+            return self._answers[key]
+
+    def _users(self, months):
+        return HyperLogLog.union((self.months[key]["users"] for key in months), self.p).count()
+
+    def monthly_users(self, since_year=2019):
+        # Same rows as the monthly_users query, with estimated counts
+        def compute():
+            rows = [
+                {"year": str(year), "month": str(month), "num_users": str(sketches["users"].count())}
+                for (year, month), sketches in sorted(self.months.items()) if year >= since_year
+            ]
+            return ResultSet(rows, [("year", "integer"), ("month", "integer"), ("num_users", "bigint")])
+        return self._answer(("monthly", since_year), compute)
+
+    def yearly_users(self, since_year=2019):
+        def compute():
+            years = sorted({year for year, _ in self.months if year >= since_year})
+            rows = [
+                {"year": str(year), "num_users": str(self._users(key for key in self.months if key[0] == year))}
+                for year in years
+            ]
+            return ResultSet(rows, [("year", "integer"), ("num_users", "bigint")])
+        return self._answer(("yearly", since_year), compute)
+
+    def summary_stats(self):
+        def compute():
+            since_july_2020 = [key for key in self.months if key >= (2020, 7)]
+            row = {
+                "total_users": str(self._users(self.months)),
+                # Every course has its own sketch, so this one is exact
+                "total_courses": str(len(self.courses)),
+                "courses_since_july_2020": str(HyperLogLog.union(
+                    (self.months[key]["courses"] for key in since_july_2020), self.p
+                ).count()),
+                "users_in_2020": str(self._users(key for key in self.months if key[0] == 2020)),
+            }
+            return ResultSet([row], [(name, "bigint") for name in row])
+        return self._answer(("summary",), compute)
+
+    def course_users(self, course_id):
+        sketch = self.courses.get(course_id)
+        return sketch.count() if sketch is not None else 0
+
+    def merge(self, other):
+        for key, sketches in other.months.items():
+            mine = self.months.setdefault(key, {"users": HyperLogLog(self.p), "courses": HyperLogLog(self.p)})
+            mine["users"].merge(sketches["users"])
+            mine["courses"].merge(sketches["courses"])
+        for course_id, sketch in other.courses.items():
+            self.courses.setdefault(course_id, HyperLogLog(self.p)).merge(sketch)
+        self._answers.clear()
+        return self
+
+    def to_bytes(self):
+        def encode(sketch):
+            return base64.b64encode(bytes(sketch.registers)).decode("ascii")
+        payload = {
+            "p": self.p,
+            "months": {
+                f"{year}-{month}": {name: encode(sketch) for name, sketch in sketches.items()}
+                for (year, month), sketches in self.months.items()
+            },
+            "courses": {course_id: encode(sketch) for course_id, sketch in self.courses.items()},
+        }
+        return zlib.compress(json.dumps(payload).encode("utf-8"))
+
+    @classmethod
+    def from_bytes(cls, data):
+        payload = json.loads(zlib.decompress(data))
+        store = cls(payload["p"])
+
+        def decode(text):
+            return HyperLogLog(store.p, base64.b64decode(text))
+        for key, sketches in payload["months"].items():
+            year, month = key.split("-")
+            store.months[(int(year), int(month))] = {name: decode(text) for name, text in sketches.items()}
+        store.courses = {course_id: decode(text) for course_id, text in payload["courses"].items()}
+        return store
+
+
+class SketchSource:
+    # The current SketchStore in S3, re-read when its ETag changes. Checks
+    # happen at most every `refresh_interval` seconds; None until one exists.
+    def __init__(self, client, bucket, key, refresh_interval=300, clock=time.monotonic):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self._store = None
+        self._etag = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            now = self.clock()
+            if self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+                return self._store
+            self._checked_at = now
+            try:
+                etag = self.client.head_object(Bucket=self.bucket, Key=self.key)["ETag"]
+                if etag != self._etag:
+                    body = self.client.get_object(Bucket=self.bucket, Key=self.key)["Body"].read()
+                    self._store = SketchStore.from_bytes(body)
+                    self._etag = etag
+                    logger.info(f"Loaded distinct-user sketches {self.key} ({etag})")
+            except Exception as e:
+                if self._store is None:
+                    logger.info(f"No distinct-user sketches at {self.key}: {e}")
+                else:
+                    logger.warning(f"Could not refresh distinct-user sketches: {e}")
+            return self._store
+
+    def version(self):
+        # The ETag of the sketches in use, for response ETags: incremental
+        # refreshes change the counts without a new dataset version
+        self.get()
+        return self._etag
+
+
+SOURCE_SQL = """
+    SELECT DISTINCT user_year, user_month, course_id, user_id
+    FROM full_phase1
+    WHERE user_year > {year} OR (user_year = {year} AND user_month >= {month})
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--key", default="sketches/distinct_users.bin")
+    parser.add_argument("--since", default="0-0", help="only read months from YEAR-MONTH on")
+    parser.add_argument("--precision", type=int, default=DEFAULT_PRECISION)
+    parser.add_argument("--database", default="analyticsworkshopdb")
+    parser.add_argument("--query-output", default="s3://mooccubex-datalake/query_results/")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from api.clients import LazyClient
+    from api.athena.executor import stream_query
+    athena, s3 = LazyClient("athena"), LazyClient("s3")
+
+    try:
+        store = SketchStore.from_bytes(s3.get_object(Bucket=args.bucket, Key=args.key)["Body"].read())
+    except s3.exceptions.NoSuchKey:
+        store = SketchStore(args.precision)
+
+    year, month = (int(part) for part in args.since.split("-"))
+    rows = stream_query(athena, SOURCE_SQL.format(year=year, month=month), args.database, args.query_output, s3_client=s3)
+    added = store.update(rows)
+    s3.upload_fileobj(io.BytesIO(store.to_bytes()), args.bucket, args.key)
+    logger.info(f"Merged {added} rows into {len(store.months)} months and {len(store.courses)} courses")
+
+
+if __name__ == "__main__":
+    main()
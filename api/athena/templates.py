@@ -0,0 +1,157 @@
+class MissingParameter(ValueError):
+    def __init__(self, name):
+        super().__init__(f"Missing {name}")
+        self.name = name
+
+
+class InvalidParameter(ValueError):
+    def __init__(self, name):
+        super().__init__(f"Invalid {name}")
+        self.name = name
+
+
+class Param:
+    # A typed template parameter. Values are sent to Athena as execution
+    # parameters, so they never become part of the SQL text. `inline`
+    # parameters (integers only, e.g. LIMIT) are validated and formatted in.
+    def __init__(self, name, type="varchar", convert=None, default=None, inline=False):
+        if inline and type != "integer":
+            raise ValueError("Only integer parameters can be inlined")
+        self.name = name
+        self.type = type
+        self.convert = convert
+        self.default = default
+        self.inline = inline
+
+    def value(self, params):
+        raw = params.get(self.name) if params else None
+        if raw is None or raw == "":
+            if self.default is None:
+                raise MissingParameter(self.name)
+            raw = self.default
+        try:
+            if self.convert is not None:
+                raw = self.convert(raw)
+            if self.type == "integer":
+                return int(raw)
+        except (TypeError, ValueError):
+            raise InvalidParameter(self.name)
+        return str(raw)
+
+    def literal(self, value):
+        if self.type == "integer":
+            return str(value)
+        return "'" + value.replace("'", "''") + "'"
+
+
+class BoundQuery:
+    __slots__ = ("name", "sql", "parameters")
+
+    def __init__(self, name, sql, parameters=()):
+        self.name = name
+        self.sql = sql
+        self.parameters = list(parameters)
+
+    def __repr__(self):
+        return f"BoundQuery({self.name!r}, parameters={self.parameters!r})"
+
+
+class QueryTemplate:
+    # SQL with `?` placeholders, filled in order from `params`
+    def __init__(self, name, sql, params=()):
+        self.name = name
+        self.sql = sql
+        self.params = list(params)
+
+    def bind(self, params):
+        values = {param.name: param.value(params) for param in self.params}
+        sql = self.sql
+        inline = {param.name: values[param.name] for param in self.params if param.inline}
+        if inline:
+            sql = sql.format(**inline)
+        parameters = [param.literal(values[param.name]) for param in self.params if not param.inline]
+        return BoundQuery(self.name, sql, parameters)
+
+
+class Route:
+    # A route runs one template, several templates at once (returned as a
+    # dict keyed like `queries`), or a custom handler taking the parameters.
+    # `cache_control` is sent with its responses; routes without one get no
+    # ETag either. `prefetch`, if set, is called with the route's result to
+    # schedule the queries a user is likely to need next. `priority` is the
+    # admission class of its Athena queries (api/athena/admission.py).
+    # `version`, if set, returns the version of any other data the result
+    # depends on, which goes into the ETag alongside the dataset version.
+    # Routes whose handler streams a pre-encoded body set `columnar=False`
+    # and refuse `?format=columnar`.
+    def __init__(self, query=None, queries=None, handler=None, cache_control=None, prefetch=None, priority=None,
+                 version=None, columnar=True):
+        self.name = None
+        self.query = query
+        self.queries = queries
+        self.handler = handler
+        self.cache_control = cache_control
+        self.prefetch = prefetch
+        self.priority = priority
+        self.version = version
+        self.columnar = columnar
+
+    def bind(self, params):
+        # The queries the route would run, or None for handler routes
+        if self.handler is not None:
+            return None
+        if self.query is not None:
+            return [self.query.bind(params)]
+        return [self.queries[name].bind(params) for name in self.queries]
+
+    def run(self, params, run_queries):
+        if self.handler is not None:
+            return self.handler(params)
+        if self.query is not None:
+            return run_queries([self.query.bind(params)])[0]
+        names = list(self.queries)
+        bound = [self.queries[name].bind(params) for name in names]
+        return dict(zip(names, run_queries(bound)))
+
+
+class Router:
+    # Exact paths and paths ending in one `{param}` segment are both
+    # resolved with a single dict lookup.
+    def __init__(self):
+        self.static = {}
+        self.dynamic = {}
+        self.named = {}
+
+    def add(self, method, path, route):
+        # Routes are named after their path pattern, e.g. in metrics
+        route.name = route.name or f"{method} {path}"
+        self.named[route.name] = route
+        if path.endswith("}"):
+            prefix, _, name = path.rpartition("/")
+            self.dynamic[(method, prefix)] = (name.strip("{}"), route)
+        else:
+            self.static[(method, path)] = route
+
+    def resolve(self, method, path):
+        route = self.static.get((method, path))
+        if route is not None:
+            return route, {}
+        prefix, _, value = path.rpartition("/")
+        match = self.dynamic.get((method, prefix))
+        if match is not None and value:
+            name, route = match
+            return route, {name: value}
+        return None, {}
+
+    def routes(self):
+        return list(self.static.items()) + [
+            ((method, f"{prefix}/{{{name}}}"), route)
+            for (method, prefix), (name, route) in self.dynamic.items()
+        ]
+
+
+def course_number(course_id):
+    # The video table keys courses by the numeric part of "C_<n>"
+    if isinstance(course_id, str) and course_id.startswith("C_"):
+        return course_id[2:]
+    return course_id
@@ -0,0 +1,63 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class SessionCache:
+    # Tokens that verified, and the profile they resolved to. An entry is
+    # dropped at the token's `exp` claim or after `ttl` seconds, whichever
+    # comes first, or as soon as the user it belongs to is invalidated.
+    def __init__(self, maxsize=10000, ttl=300, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = {"hits": 0, "misses": 0}
+        self._items = OrderedDict()
+        self._tokens_by_email = {}
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            item = self._items.get(token)
+            if item is not None and item[0] <= self.clock():
+                self._remove(token)
+                item = None
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+            self._items.move_to_end(token)
+            self.stats["hits"] += 1
+            return item[2]
+
+    def set(self, token, email, profile, expires_at=None):
+        deadline = self.clock() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            if token in self._items:
+                self._remove(token)
+            self._items[token] = (deadline, email, profile)
+            self._tokens_by_email.setdefault(email, set()).add(token)
+            while len(self._items) > self.maxsize:
+                self._remove(next(iter(self._items)))
+
+    def invalidate(self, email):
+        with self._lock:
+            for token in list(self._tokens_by_email.get(email, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._tokens_by_email.clear()
+
+    def _remove(self, token):
+        _, email, _ = self._items.pop(token)
+        tokens = self._tokens_by_email.get(email)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_email[email]
+
+    def __len__(self):
+        return len(self._items)
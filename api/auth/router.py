@@ -1,24 +1,32 @@
 from fastapi import APIRouter, HTTPException,  Header, Depends
 from api.models.user import UserCreate, UserLogin, UserInDB
-from api.auth.utils import hash_password, verify_password, create_access_token, decode_token
-from api.db.dynamodb import create_user, get_user_by_email
+from api.auth.utils import hash_password_async, verify_password_async, create_access_token, decode_token
+from api.auth.cache import SessionCache
+from api.db.dynamodb import get_user_by_email, create_user_async, get_user_by_email_async, EmailAlreadyRegistered
+import os
 
 router = APIRouter()
 
+# The frontend checks its token on every navigation; repeat checks of a
+# token that already verified are answered without a DynamoDB read.
+sessions = SessionCache(
+    maxsize=int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000")),
+    ttl=int(os.getenv("SESSION_CACHE_TTL_SECONDS", "300")),
+)
+
 @router.post("/signup")
 async def signup(user: UserCreate):
     try:
-        # Check if user already exists
-        existing = get_user_by_email(user.email)
-        if existing:
-            raise HTTPException(status_code=400, detail="Email already registered")
+        # Hash the password off the event loop
+        hashed = await hash_password_async(user.password)
         
-        # Hash the password
-        hashed = hash_password(user.password)
-        
-        # Create user in DB
+        # Create user in DB; the write itself rejects a registered email
         user_in_db = UserInDB(username=user.username, email=user.email, hashed_password=hashed)
-        create_user(user_in_db)
+        try:
+            await create_user_async(user_in_db)
+        except EmailAlreadyRegistered:
+            raise HTTPException(status_code=400, detail="Email already registered")
+        sessions.invalidate(user_in_db.email)
         
         # Create JWT token
         access_token = create_access_token(data={"sub": user.email})
@@ -32,14 +40,16 @@ async def signup(user: UserCreate):
             }
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @router.post("/signin")
 async def signin(user_data: UserLogin):
     try:
-        user = get_user_by_email(user_data.email)
-        if not user or not verify_password(user_data.password, user.hashed_password):
+        user = await get_user_by_email_async(user_data.email)
+        if not user or not await verify_password_async(user_data.password, user.hashed_password):
             raise HTTPException(status_code=401, detail="Invalid email or password")
 
         access_token = create_access_token(data={"sub": user.email})
@@ -53,6 +63,8 @@ async def signin(user_data: UserLogin):
             }
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         # Log error to console (will appear in CloudWatch logs)
         print("Error during /signin:", e)
@@ -61,11 +73,16 @@ async def signin(user_data: UserLogin):
 @router.get("/token")
 def get_user_info(authorization: str = Header(...)):
     token = authorization.split(" ")[1] if " " in authorization else authorization
+    profile = sessions.get(token)
+    if profile is not None:
+        return profile
     try:
         token_data = decode_token(token)
         user = get_user_by_email(token_data.email)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        return {"id": str(user.id), "username": user.username, "email": user.email}
+        profile = {"id": str(user.id), "username": user.username, "email": user.email}
+        sessions.set(token, user.email, profile, token_data.exp)
+        return profile
     except Exception as e:
         raise HTTPException(status_code=401, detail=str(e))
\ No newline at end of file
@@ -4,6 +4,8 @@ from api.models.user import TokenData
 from typing import Optional
 from passlib.context import CryptContext
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecret")
@@ -12,12 +14,26 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt releases the GIL, so hashes run in parallel on this pool. Its size
+# caps how many hashes run at once; extra requests wait in its queue
+# instead of piling up CPU work.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain_password, hashed_password) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, hash_password, password)
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(
+        _hash_pool, verify_password, plain_password, hashed_password
+    )
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
@@ -30,6 +46,6 @@ def decode_token(token: str) -> TokenData:
         email = payload.get("sub")
         if email is None:
             raise ValueError("Invalid token")
-        return TokenData(email=email)
+        return TokenData(email=email, exp=payload.get("exp"))
     except JWTError:
         raise ValueError("Invalid token")
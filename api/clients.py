@@ -0,0 +1,90 @@
+import os
+import threading
+
+# Shared by every boto3 client and resource. Lambda containers and the API
+# server reuse connections across requests, so the pool is sized for the
+# threads that fan out queries, and idle connections are kept alive.
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '50'))
+AWS_CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', '2'))
+AWS_READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', '10'))
+AWS_MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '3'))
+
+
+def client_config(**overrides):
+    # botocore.config is slow to import, so it is only loaded here
+    from botocore.config import Config
+    options = {
+        "max_pool_connections": AWS_MAX_POOL_CONNECTIONS,
+        "connect_timeout": AWS_CONNECT_TIMEOUT,
+        "read_timeout": AWS_READ_TIMEOUT,
+        "tcp_keepalive": True,
+        "retries": {"max_attempts": AWS_MAX_ATTEMPTS, "mode": "adaptive"},
+    }
+    options.update(overrides)
+    return Config(**options)
+
+
+class LazyClient:
+    # Stands in for a boto3 client and only imports boto3 and builds the
+    # client on first use, so routes that never touch a service don't pay
+    # for it on a cold start. Safe to share between threads.
+    def __init__(self, service, **kwargs):
+        self._service = service
+        self._kwargs = kwargs
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _create(self):
+        import boto3
+        kwargs = dict(self._kwargs)
+        kwargs.setdefault("config", client_config())
+        return boto3.client(self._service, **kwargs)
+
+    def _get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create()
+        return self._client
+
+    @property
+    def loaded(self):
+        return self._client is not None
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"LazyClient({self._service!r}, {state})"
+
+
+class LazyTable(LazyClient):
+    # The same for a DynamoDB Table resource
+    def __init__(self, name, **kwargs):
+        super().__init__("dynamodb", **kwargs)
+        self._name = name
+
+    def _create(self):
+        import boto3
+        kwargs = dict(self._kwargs)
+        kwargs.setdefault("config", client_config())
+        return boto3.resource("dynamodb", **kwargs).Table(self._name)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"LazyTable({self._name!r}, {state})"
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_client(service):
+    # One client per service for every module in the process, so the course
+    # and user routes served by one app share their connection pools
+    with _shared_lock:
+        client = _shared.get(service)
+        if client is None:
+            client = _shared[service] = LazyClient(service)
+        return client
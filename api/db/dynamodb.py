@@ -1,13 +1,31 @@
-import boto3
 from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from api.clients import LazyTable
 from api.models.user import UserInDB
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
-dynamodb = boto3.resource("dynamodb", 
-                          region_name= "us-east-1"
-                          )
+# Created on first use with the shared pooled client config
+# (see api/clients.py), so importing the app does not build it.
+user_table = LazyTable("user", region_name="us-east-1")
 
-user_table = dynamodb.Table("user")
+# boto3 calls block, so the async routes run them on this pool instead of
+# the event loop
+DYNAMODB_WORKERS = int(os.getenv("DYNAMODB_WORKERS", "16"))
+_db_pool = ThreadPoolExecutor(max_workers=DYNAMODB_WORKERS, thread_name_prefix="dynamodb")
+
+# Every email owns one guard item in the user table, keyed by this prefix.
+# Guard items have no `email` attribute, so they stay out of email-index.
+EMAIL_GUARD_PREFIX = "email#"
+
+
+class EmailAlreadyRegistered(Exception):
+    pass
+
+
+async def _run(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(_db_pool, function, *args)
 
 def get_user_by_email(email: str):
     response = user_table.query(
@@ -19,7 +37,57 @@ def get_user_by_email(email: str):
         return UserInDB(**items[0])
     return None
 
+def email_guard(email: str, user_id: str):
+    return {"id": f"{EMAIL_GUARD_PREFIX}{email.lower()}", "user_id": user_id}
+
 def create_user(user: UserInDB):
-    user_dict = user.dict()
+    # The user and its email guard are written in one transaction that
+    # fails if the guard exists, so an email can only be registered once,
+    # even by concurrent signups, in a single round trip.
+    user_dict = user.model_dump()
     user_dict['id'] = str(user_dict['id'])  # Convert UUID to string
-    user_table.put_item(Item=user_dict)
\ No newline at end of file
+    try:
+        user_table.meta.client.transact_write_items(TransactItems=[
+            {"Put": {
+                "TableName": user_table.name,
+                "Item": email_guard(user.email, user_dict['id']),
+                "ConditionExpression": "attribute_not_exists(id)",
+            }},
+            {"Put": {
+                "TableName": user_table.name,
+                "Item": user_dict,
+                "ConditionExpression": "attribute_not_exists(id)",
+            }},
+        ])
+    except ClientError as e:
+        reasons = e.response.get("CancellationReasons") or []
+        if reasons and reasons[0].get("Code") == "ConditionalCheckFailed":
+            raise EmailAlreadyRegistered(user.email)
+        raise
+
+def backfill_email_guards():
+    # Adds guard items for users created before guards existed. Safe to
+    # run more than once.
+    kwargs = {"ProjectionExpression": "id, email"}
+    while True:
+        page = user_table.scan(**kwargs)
+        for item in page.get("Items", []):
+            if "email" not in item:
+                continue
+            try:
+                user_table.put_item(
+                    Item=email_guard(item["email"], item["id"]),
+                    ConditionExpression="attribute_not_exists(id)",
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+        if "LastEvaluatedKey" not in page:
+            return
+        kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+async def get_user_by_email_async(email: str):
+    return await _run(get_user_by_email, email)
+
+async def create_user_async(user: UserInDB):
+    return await _run(create_user, user)
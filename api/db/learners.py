@@ -0,0 +1,186 @@
+"""Per-learner store: the results of every per-learner query, precomputed.
+
+    python -m api.db.learners --course C_1 --course C_2
+    python -m api.db.learners --all-courses --store sqlite --path /tmp/learners.db
+
+For each course the job runs one per-course query per template (see
+LEARNER_QUERIES in api/lambda/user.py), splits the rows by learner and
+writes one compressed item per (course_id, user_id). The user endpoints then
+read a single item instead of scanning the tables.
+"""
+import json
+import zlib
+import sqlite3
+import logging
+import argparse
+import importlib
+import threading
+from api.athena.reader import ResultSet
+
+logger = logging.getLogger()
+
+
+class LearnerTemplate:
+    # The per-course form of a per-learner query. The template only takes
+    # course_id and returns a user_id column; rows are split per learner,
+    # cut to `limit` rows, and learners without rows get `empty`.
+    def __init__(self, template, keep_user_id=False, limit=None, empty=(), columns=None):
+        self.template = template
+        self.keep_user_id = keep_user_id
+        self.limit = limit
+        self.empty = list(empty)
+        self.columns = columns
+
+    @property
+    def name(self):
+        return self.template.name
+
+    def result_columns(self, rows):
+        columns = getattr(rows, "columns", None)
+        if columns is not None and not self.keep_user_id:
+            columns = [column for column in columns if column[0] != "user_id"]
+        return columns
+
+    def split(self, rows):
+        columns = self.result_columns(rows)
+        learners = {}
+        for row in rows:
+            result = learners.get(row["user_id"])
+            if result is None:
+                result = learners[row["user_id"]] = ResultSet(columns=columns)
+            if self.limit is not None and len(result) >= self.limit:
+                continue
+            if not self.keep_user_id:
+                row = {column: value for column, value in row.items() if column != "user_id"}
+            result.append(row)
+        return learners
+
+    def default(self, columns=None):
+        return ResultSet([dict(row) for row in self.empty], self.columns or columns)
+
+
+def encode_record(results):
+    # {query name: rows} -> compressed bytes. Column names are stored once
+    # per result and rows as arrays, which shrinks the JSON several times.
+    payload = {}
+    for name, rows in results.items():
+        columns = getattr(rows, "columns", None)
+        names = [column for column, _ in columns] if columns else list(rows[0]) if rows else []
+        payload[name] = {
+            "columns": [list(column) for column in columns] if columns else None,
+            "names": names,
+            "rows": [[row.get(column) for column in names] for row in rows],
+        }
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_record(data):
+    payload = json.loads(zlib.decompress(data))
+    results = {}
+    for name, result in payload.items():
+        columns = [tuple(column) for column in result["columns"]] if result["columns"] else None
+        results[name] = ResultSet(
+            (dict(zip(result["names"], values)) for values in result["rows"]), columns
+        )
+    return results
+
+
+def build_course(course_id, templates, run_queries):
+    # Returns {user_id: {query name: rows}} for every learner of the course
+    bound = [template.template.bind({"course_id": course_id}) for template in templates]
+    results = run_queries(bound)
+    per_template = [template.split(rows) for template, rows in zip(templates, results)]
+    defaults = [template.default(template.result_columns(rows)) for template, rows in zip(templates, results)]
+    users = set().union(*per_template)
+    return {
+        user_id: {
+            template.name: learners.get(user_id) or default
+            for template, learners, default in zip(templates, per_template, defaults)
+        }
+        for user_id in users
+    }
+
+
+class DynamoDBLearnerStore:
+    # Items keyed by course_id (partition) and user_id (sort)
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, course_id, user_id):
+        item = self.table.get_item(Key={"course_id": course_id, "user_id": user_id}).get("Item")
+        if item is None:
+            return None
+        return decode_record(bytes(item["data"]))
+
+    def put_many(self, course_id, records):
+        with self.table.batch_writer(overwrite_by_pkeys=["course_id", "user_id"]) as batch:
+            for user_id, results in records.items():
+                batch.put_item(Item={"course_id": course_id, "user_id": user_id, "data": encode_record(results)})
+
+
+class SQLiteLearnerStore:
+    # The same in a local SQLite file, e.g. shipped in /tmp or a layer
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS learners ("
+                "course_id TEXT, user_id TEXT, data BLOB, PRIMARY KEY (course_id, user_id))"
+            )
+        return self._connection
+
+    def get(self, course_id, user_id):
+        with self._lock:
+            row = self._db().execute(
+                "SELECT data FROM learners WHERE course_id = ? AND user_id = ?", (course_id, user_id)
+            ).fetchone()
+        return decode_record(row[0]) if row else None
+
+    def put_many(self, course_id, records):
+        with self._lock:
+            db = self._db()
+            db.executemany(
+                "INSERT OR REPLACE INTO learners (course_id, user_id, data) VALUES (?, ?, ?)",
+                [(course_id, user_id, encode_record(results)) for user_id, results in records.items()],
+            )
+            db.commit()
+
+
+def learner_store(name, table_name=None, path=None, **table_kwargs):
+    if name == "dynamodb":
+        from api.clients import LazyTable
+        return DynamoDBLearnerStore(LazyTable(table_name, **table_kwargs))
+    if name == "sqlite":
+        return SQLiteLearnerStore(path)
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--course", action="append", default=[], help="course to build (repeatable)")
+    parser.add_argument("--all-courses", action="store_true", help="build every course in full_phase1")
+    parser.add_argument("--store", choices=["dynamodb", "sqlite"], default="dynamodb")
+    parser.add_argument("--table", default="learner_features")
+    parser.add_argument("--path", default="learners.db", help="SQLite file for --store sqlite")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    user = importlib.import_module("api.lambda.user")
+    store = learner_store(args.store, args.table, args.path, region_name="us-east-1")
+
+    courses = list(args.course)
+    if args.all_courses:
+        courses += [row["course_id"] for row in user.run_athena_query("SELECT DISTINCT course_id FROM full_phase1")]
+    for course_id in courses:
+        records = build_course(course_id, list(user.LEARNER_QUERIES.values()), user.run_athena_queries)
+        store.put_many(course_id, records)
+        logger.info(f"Stored {len(records)} learners of {course_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,25 @@
-import boto3
 import time
-import json
+
+_INIT_STARTED = time.perf_counter()
+
 import os
+import sys
 import logging
+from api.clients import shared_client
+from api.athena.reader import json_array
+from api.athena.cache import QueryCache, LRUCache, S3Cache, shared_dataset_version
+from api.athena.coalesce import QueryCoalescer, BatchTemplate
+from api.athena.local import query_backend
+from api.athena.sketches import SketchSource, SketchStore
+from api.athena.prefetch import Prefetcher
+from api.athena.budget import ScanGuard, parse_budgets, MB
+from api.athena.admission import DASHBOARD, shared_controller
+from api.athena.service import AthenaService
+from api.athena.compaction import CompactedTables
+from api.metrics import Metrics
+from api.athena.templates import (
+    QueryTemplate, Param, Route, Router, MissingParameter, InvalidParameter, course_number
+)
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -10,324 +27,513 @@ logger.setLevel(logging.INFO)
 # Environment Variables
 DATABASE = os.environ.get('DATABASE', 'analyticsworkshopdb')
 S3_OUTPUT = "s3://mooccubex-datalake/query_results/"
-
-athena = boto3.client("athena")
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'athena')
+LOCAL_DATA_DIR = os.environ.get('LOCAL_DATA_DIR', '/tmp/mooccubex')
+LOCAL_DATA_BUCKET = os.environ.get('LOCAL_DATA_BUCKET', 'mooccubex-datalake')
+LOCAL_DATA_PREFIX = os.environ.get('LOCAL_DATA_PREFIX')
+CACHE_BUCKET = os.environ.get('CACHE_BUCKET', 'mooccubex-datalake')
+CACHE_PREFIX = os.environ.get('CACHE_PREFIX', 'query_cache/')
+COMPACTED_BUCKET = os.environ.get('COMPACTED_BUCKET', 'mooccubex-datalake')
+COMPACTED_PREFIX = os.environ.get('COMPACTED_PREFIX', 'compacted/')
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', '900'))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '512'))
+BATCH_WINDOW_MS = int(os.environ.get('BATCH_WINDOW_MS', '20'))
+SKETCH_BUCKET = os.environ.get('SKETCH_BUCKET', 'mooccubex-datalake')
+SKETCH_KEY = os.environ.get('SKETCH_KEY', 'sketches/distinct_users.bin')
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Mooccubex/Api')
+# Detail queries of this many courses from the top of a course list are
+# run in the background and cached; 0 disables prefetching. Only useful
+# under uvicorn: Lambda freezes the sandbox as soon as the handler returns,
+# which is exactly when prefetching would start, so it is off there.
+ON_LAMBDA = bool(os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
+PREFETCH_COURSES = int(os.environ.get('PREFETCH_COURSES', '0' if ON_LAMBDA else '5'))
+PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', '1'))
+# Most courses /api/course-compare takes at once
+COMPARE_MAX_COURSES = int(os.environ.get('COMPARE_MAX_COURSES', '50'))
+# Bytes Athena may scan for one request, per route ("GET /api/...") in
+# SCAN_BUDGETS_MB as JSON, and SCAN_BUDGET_MB for the others; 0 disables
+SCAN_BUDGET_MB = float(os.environ.get('SCAN_BUDGET_MB', '10240'))
+SCAN_BUDGETS_MB = os.environ.get('SCAN_BUDGETS_MB')
+# Share of requests whose full event and response body are logged
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+LOG_BODY_MAX_CHARS = int(os.environ.get('LOG_BODY_MAX_CHARS', '2000'))
+
+# Browsers revalidate with If-None-Match once max-age runs out
+AGGREGATE_CACHE_CONTROL = os.environ.get('AGGREGATE_CACHE_CONTROL', 'public, max-age=3600')
+COURSE_CACHE_CONTROL = os.environ.get('COURSE_CACHE_CONTROL', 'public, max-age=900')
+USER_LIST_CACHE_CONTROL = os.environ.get('USER_LIST_CACHE_CONTROL', 'private, max-age=300')
+
+# Created on first use and shared with the other API module when both are
+# served by one process; see api/clients.py
+athena = shared_client("athena")
+s3 = shared_client("s3")
+
+# Handler time per route, and queue/engine time and bytes scanned per query
+metrics = Metrics(METRICS_NAMESPACE, "course")
+
+# Queries over their route's scan budget are refused or cancelled; the
+# estimates come from the bytes earlier runs of each query scanned
+scan_guard = ScanGuard(int(SCAN_BUDGET_MB * MB), parse_budgets(SCAN_BUDGETS_MB), route=lambda: metrics.current_route())
+
+# Athena queries wait for a slot by priority class (the route's, or
+# interactive); shared with the other API module in one process
+admission = shared_controller()
+
+# Part of every cache key; shared with the user API's ETags
+dataset_version = shared_dataset_version(s3, CACHE_BUCKET, f"{CACHE_PREFIX}dataset_version")
+
+# Queries over a compacted table read the raw one until it has been
+# compacted at the current dataset version
+compacted = CompactedTables(s3, COMPACTED_BUCKET, COMPACTED_PREFIX, dataset_version)
+
+# Runs queries and requests the same way as api/lambda/user.py
+service = AthenaService(sys.modules[__name__])
+
+def run_remote_queries(queries):
+    return service.run_remote_queries(queries)
+
+# With QUERY_BACKEND=duckdb, queries over tables with a local Parquet
+# extract run in DuckDB; the rest still go to Athena.
+backend = query_backend(run_remote_queries, QUERY_BACKEND, LOCAL_DATA_DIR, s3, LOCAL_DATA_BUCKET, LOCAL_DATA_PREFIX)
+
+# Results only change when the lake is refreshed, so they are cached per
+# dataset version: in memory for warm invocations, and in S3 across them.
+query_cache = QueryCache(
+    local=LRUCache(maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS),
+    shared=S3Cache(s3, CACHE_BUCKET, CACHE_PREFIX),
+    version=dataset_version,
+)
+
+# Distinct-user counts are estimated from HyperLogLog sketches built by
+# api/athena/sketches.py; see distinct_users below.
+sketches = SketchSource(s3, SKETCH_BUCKET, SKETCH_KEY)
 
 def run_athena_query(query):
-    response = athena.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={"Database": DATABASE},
-        ResultConfiguration={"OutputLocation": S3_OUTPUT}
-    )
-    execution_id = response["QueryExecutionId"]
-    logger.info(f"QueryExecutionId: {execution_id}")
-
-    while True:
-        status = athena.get_query_execution(QueryExecutionId=execution_id)
-        state = status["QueryExecution"]["Status"]["State"]
-        logger.info(f"Athena query state: {state}")
-        if state in ["SUCCEEDED", "FAILED", "CANCELLED"]:
-            break
-        time.sleep(1)
-
-    if state != "SUCCEEDED":
-        reason = status["QueryExecution"]["Status"].get("StateChangeReason", "Unknown reason")
-        logger.error(f"Query failed. Reason: {reason}")
-        raise Exception(f"Athena query failed: {state}")
-
-    results = athena.get_query_results(QueryExecutionId=execution_id)
-    headers = [col["VarCharValue"] for col in results["ResultSet"]["Rows"][0]["Data"]]
-    rows = results["ResultSet"]["Rows"][1:]
-
-    data = []
-    for row in rows:
-        values = [col.get("VarCharValue", None) for col in row["Data"]]
-        data.append(dict(zip(headers, values)))
-    return data
+    return run_athena_queries([query])[0]
+
+def prefetch_queries(queries):
+    token = metrics.set_route("prefetch")
+    try:
+        run_athena_queries(queries)
+    finally:
+        metrics.reset_route(token)
+
+# Only runs while no request is being handled (see lambda_handler). In
+# Lambda it continues on the next invocation of a warm container.
+prefetcher = Prefetcher(prefetch_queries, workers=PREFETCH_WORKERS)
+
+def run_athena_queries(queries):
+    return query_cache.run(queries, coalescer.run)
+
+COURSE_ID = Param("course_id")
+VIDEO_COURSE_ID = Param("course_id", "integer", convert=course_number)
+
+QUERIES = {
+    "top_courses": QueryTemplate("top_courses", """
+        SELECT
+            f.course_id,
+            c.name,
+            COUNT(*) AS user_count
+        FROM
+            full_phase1 f
+        JOIN
+            course_info c ON f.course_id = c.course_id
+        GROUP BY
+            f.course_id, c.name
+        ORDER BY
+            user_count DESC
+        LIMIT 5
+    """),
+
+    "monthly_users": QueryTemplate("monthly_users", """
+        SELECT
+          user_year AS year,
+          user_month AS month,
+          COUNT(DISTINCT user_id) AS num_users
+        FROM full_phase1
+        WHERE user_year >= 2019
+        GROUP BY user_year, user_month
+        ORDER BY user_year, user_month
+    """),
+
+    "yearly_users": QueryTemplate("yearly_users", """
+        SELECT
+          user_year AS year,
+          COUNT(DISTINCT user_id) AS num_users
+        FROM full_phase1
+        WHERE user_year >= 2019
+        GROUP BY user_year
+        ORDER BY user_year
+    """),
+
+    "summary_stats": QueryTemplate("summary_stats", """
+        SELECT
+          (SELECT COUNT(DISTINCT user_id) FROM full_phase1) AS total_users,
+          (SELECT COUNT(DISTINCT course_id) FROM full_phase1) AS total_courses,
+          (SELECT COUNT(DISTINCT course_id)
+           FROM full_phase1
+           WHERE (user_year > 2020 OR (user_year = 2020 AND user_month >= 7))
+          ) AS courses_since_july_2020,
+          (SELECT COUNT(DISTINCT user_id)
+           FROM full_phase1
+           WHERE user_year = 2020
+          ) AS users_in_2020
+    """),
+
+    "label_distribution": QueryTemplate("label_distribution", """
+        SELECT
+          label,
+          COUNT(*) AS num_users
+        FROM full_phase1
+        WHERE label IN ('A', 'B', 'C', 'D','E')
+          AND (
+            end_year = 2019
+            OR (end_year = 2021 AND end_month < 7)
+          )
+        GROUP BY label
+        ORDER BY num_users DESC
+    """),
+
+    "course_enrollments": QueryTemplate("course_enrollments", """
+        SELECT
+            p.course_id,
+            c.name,
+            p.school,
+            c.start_date,
+            c.end_date,
+            COUNT(DISTINCT p.user_id) AS user_count
+        FROM
+            phase1 p
+        JOIN
+            course_info c ON p.course_id = c.course_id
+        GROUP BY
+            p.course_id, c.name, p.school, c.start_date, c.end_date
+        ORDER BY
+            user_count DESC
+        LIMIT 100
+    """),
+
+    "course_info": QueryTemplate("course_info", """
+        SELECT
+            c.course_id,
+            c.name,
+            c.start_date,
+            c.end_date,
+            c.duration_days,
+            c.certificate,
+            c.assignment,
+            c.exam,
+            c.video,
+            c.video_count,
+            c.exercise_count,
+            c.chapter_count
+        FROM course_info c
+        WHERE c.course_id = ?
+        LIMIT 1
+    """, [COURSE_ID]),
+
+    "search_labels": QueryTemplate("search_labels", """
+        SELECT
+            label,
+            COUNT(*) AS count
+        FROM phase1
+        WHERE course_id = ?
+          AND label IN ('A', 'B', 'C', 'D', 'E')
+        GROUP BY label
+        ORDER BY count DESC
+    """, [COURSE_ID]),
+
+    "course_video_count": QueryTemplate("course_video_count", """
+        SELECT
+        year,
+        month,
+        COUNT(*) AS video_count
+        FROM video
+        WHERE year >= 2019 AND course_id = ?
+        GROUP BY year, month
+        ORDER BY year, month
+    """, [VIDEO_COURSE_ID]),
+
+    # exercise, comment and reply are read from their compacted copies
+    # (api/athena/compaction.py), partitioned by course_id and event
+    # year/month, so each lookup only reads the course's own partitions.
+    # Month 0 holds rows without a valid date and reads back as NULL.
+    "course_exercise_count": QueryTemplate("course_exercise_count", """
+        SELECT
+        NULLIF(event_year, 0) AS year,
+        NULLIF(event_month, 0) AS month,
+        COUNT(*) AS exercise_count
+        FROM exercise_by_course
+        WHERE exercise_submit_date_max IS NOT NULL AND course_id = ?
+        GROUP BY event_year, event_month
+        ORDER BY year, month
+    """, [COURSE_ID]),
+
+    "course_comment_sentiment": QueryTemplate("course_comment_sentiment", """
+        SELECT
+            sentiment_label,
+            NULLIF(event_year, 0) AS year,
+            NULLIF(event_month, 0) AS month,
+            COUNT(*) AS comment_count
+        FROM comment_by_course
+        WHERE course_id = ?
+        GROUP BY
+            sentiment_label,
+            event_year,
+            event_month
+        ORDER BY
+            sentiment_label,
+            year,
+            month
+    """, [COURSE_ID]),
+
+    "course_reply_sentiment": QueryTemplate("course_reply_sentiment", """
+        SELECT
+            sentiment_label,
+            NULLIF(event_year, 0) AS year,
+            NULLIF(event_month, 0) AS month,
+            COUNT(*) AS reply_count
+        FROM reply_by_course
+        WHERE course_id = ?
+        GROUP BY
+            sentiment_label,
+            event_year,
+            event_month
+        ORDER BY
+            sentiment_label,
+            year,
+            month
+    """, [COURSE_ID]),
+
+    "course_users": QueryTemplate("course_users", """
+        SELECT DISTINCT user_id, school, user_month, user_year
+        FROM full_phase1
+        WHERE course_id = ?
+        LIMIT {limit}
+    """, [COURSE_ID, Param("limit", "integer", default=100, inline=True)]),
+}
+
+# Batched forms of the per-course lookups the course list fires at once.
+# Concurrent lookups against the same table become one IN (...) query.
+BATCH_QUERIES = {
+    "course_info": BatchTemplate("course_info_batch", """
+        SELECT
+            c.course_id,
+            c.name,
+            c.start_date,
+            c.end_date,
+            c.duration_days,
+            c.certificate,
+            c.assignment,
+            c.exam,
+            c.video,
+            c.video_count,
+            c.exercise_count,
+            c.chapter_count
+        FROM course_info c
+        WHERE c.course_id IN ({keys})
+    """, COURSE_ID, drop_key=False, limit_per_key=1),
+
+    "search_labels": BatchTemplate("search_labels_batch", """
+        SELECT
+            course_id,
+            label,
+            COUNT(*) AS count
+        FROM phase1
+        WHERE course_id IN ({keys})
+          AND label IN ('A', 'B', 'C', 'D', 'E')
+        GROUP BY course_id, label
+        ORDER BY course_id, count DESC
+    """, COURSE_ID),
+
+    "course_video_count": BatchTemplate("course_video_count_batch", """
+        SELECT
+        course_id,
+        year,
+        month,
+        COUNT(*) AS video_count
+        FROM video
+        WHERE year >= 2019 AND course_id IN ({keys})
+        GROUP BY course_id, year, month
+        ORDER BY course_id, year, month
+    """, VIDEO_COURSE_ID),
+
+    "course_exercise_count": BatchTemplate("course_exercise_count_batch", """
+        SELECT
+        course_id,
+        NULLIF(event_year, 0) AS year,
+        NULLIF(event_month, 0) AS month,
+        COUNT(*) AS exercise_count
+        FROM exercise_by_course
+        WHERE exercise_submit_date_max IS NOT NULL AND course_id IN ({keys})
+        GROUP BY course_id, event_year, event_month
+        ORDER BY course_id, year, month
+    """, COURSE_ID),
+}
+
+# /api/course-compare runs one of these for all the courses it compares:
+# metric -> (batch template, value column, category column or None for
+# a monthly series)
+COMPARE_METRICS = {
+    "videos": (BATCH_QUERIES["course_video_count"], "video_count", None),
+    "exercises": (BATCH_QUERIES["course_exercise_count"], "exercise_count", None),
+    "labels": (BATCH_QUERIES["search_labels"], "count", "label"),
+    "comments": (BatchTemplate("compare_comments", """
+        SELECT
+        course_id,
+        event_year AS year,
+        event_month AS month,
+        COUNT(*) AS comment_count
+        FROM comment_by_course
+        WHERE course_id IN ({keys}) AND event_year > 0
+        GROUP BY course_id, event_year, event_month
+    """, COURSE_ID), "comment_count", None),
+    "replies": (BatchTemplate("compare_replies", """
+        SELECT
+        course_id,
+        event_year AS year,
+        event_month AS month,
+        COUNT(*) AS reply_count
+        FROM reply_by_course
+        WHERE course_id IN ({keys}) AND event_year > 0
+        GROUP BY course_id, event_year, event_month
+    """, COURSE_ID), "reply_count", None),
+}
+
+coalescer = QueryCoalescer(
+    lambda queries: backend(queries),
+    BATCH_QUERIES,
+    window=BATCH_WINDOW_MS / 1000,
+)
+
+def course_users(params):
+    query = QUERIES["course_users"].bind(params)
+    if int(params.get("limit") or 100) <= 0:
+        raise InvalidParameter("limit")
+
+    local = getattr(backend, "local", None)
+    if local is not None and local.can_run(query):
+        return json_array(local.run_query(query))
+
+    # User lists can be large, so rows are streamed into the body
+    # instead of going through the cache as a list of dicts.
+    return json_array(service.stream_remote_query(query))
+
+def course_compare(params):
+    # One grouped query for every course, pivoted into a dense courses ×
+    # months (or × labels) matrix
+    # numpy is only needed here, so it is not imported on a cold start
+    from api.athena.pivot import monthly_matrix, category_matrix
+
+    metric = params.get("metric") or "videos"
+    if metric not in COMPARE_METRICS:
+        raise InvalidParameter("metric")
+    course_ids = list(dict.fromkeys(
+        course_id.strip() for course_id in (params.get("course_ids") or "").split(",") if course_id.strip()
+    ))
+    if not course_ids:
+        raise MissingParameter("course_ids")
+    if len(course_ids) > COMPARE_MAX_COURSES:
+        raise InvalidParameter("course_ids")
+
+    template, value_column, category_column = COMPARE_METRICS[metric]
+    literals = [template.key_literal(course_id) for course_id in course_ids]
+    rows = run_athena_query(template.bind(literals))
+
+    def key_of(row):
+        return template.key_literal(row["course_id"])
+    if category_column is None:
+        columns, matrix = monthly_matrix(rows, literals, key_of, value_column)
+    else:
+        categories = ["A", "B", "C", "D", "E"] if metric == "labels" else None
+        columns, matrix = category_matrix(rows, literals, key_of, category_column, value_column, categories)
+    return {"metric": metric, "course_ids": course_ids, "columns": columns, "values": matrix.tolist()}
+
+def exact_requested(params):
+    value = (params.get("exact") or "false").lower()
+    if value not in ("true", "false", "1", "0"):
+        raise InvalidParameter("exact")
+    return value in ("true", "1")
+
+def distinct_users(name, estimate):
+    # Answered from the sketches (standard error 1.6%) when they exist.
+    # `exact=true`, or having no sketches, runs the COUNT(DISTINCT) query.
+    def handler(params):
+        store = None if exact_requested(params) else sketches.get()
+        if store is None:
+            return run_athena_query(QUERIES[name].bind(params))
+        return estimate(store)
+    return handler
+
+# What a user opening one course from a list loads next
+COURSE_DETAIL_PATHS = [
+    "/api/course/{course_id}",
+    "/api/search-labels",
+    "/api/course-video-count",
+    "/api/course-exercise-count",
+    "/api/course-comment-reply-sentiment",
+]
+
+def prefetch_course_details(rows):
+    # One job for all the courses, so the coalescer merges each detail
+    # query into a single IN (...) batch instead of one query per course
+    course_ids = list(dict.fromkeys(row["course_id"] for row in rows if row.get("course_id")))[:PREFETCH_COURSES]
+    if not course_ids:
+        return
+    queries = []
+    for course_id in course_ids:
+        for path in COURSE_DETAIL_PATHS:
+            route, path_params = router.resolve("GET", path.format(course_id=course_id))
+            queries += route.bind({"course_id": course_id, **path_params})
+    prefetcher.schedule("courses:" + ",".join(course_ids), queries)
+
+router = Router()
+router.add("GET", "/api/top-courses", Route(
+    QUERIES["top_courses"], cache_control=AGGREGATE_CACHE_CONTROL, prefetch=prefetch_course_details, priority=DASHBOARD
+))
+router.add("GET", "/api/monthly-users", Route(
+    handler=distinct_users("monthly_users", SketchStore.monthly_users), cache_control=AGGREGATE_CACHE_CONTROL,
+    priority=DASHBOARD, version=lambda: sketches.version(),
+))
+router.add("GET", "/api/yearly-users", Route(
+    handler=distinct_users("yearly_users", SketchStore.yearly_users), cache_control=AGGREGATE_CACHE_CONTROL,
+    priority=DASHBOARD, version=lambda: sketches.version(),
+))
+router.add("GET", "/api/summary-stats", Route(
+    handler=distinct_users("summary_stats", SketchStore.summary_stats), cache_control=AGGREGATE_CACHE_CONTROL,
+    priority=DASHBOARD, version=lambda: sketches.version(),
+))
+router.add("GET", "/api/label-distribution", Route(
+    QUERIES["label_distribution"], cache_control=AGGREGATE_CACHE_CONTROL, priority=DASHBOARD
+))
+router.add("GET", "/api/course-enrollments", Route(
+    QUERIES["course_enrollments"], cache_control=AGGREGATE_CACHE_CONTROL, prefetch=prefetch_course_details,
+    priority=DASHBOARD,
+))
+router.add("GET", "/api/course/{course_id}", Route(QUERIES["course_info"], cache_control=COURSE_CACHE_CONTROL))
+router.add("GET", "/api/search-labels", Route(QUERIES["search_labels"], cache_control=COURSE_CACHE_CONTROL))
+router.add("GET", "/api/course-video-count", Route(QUERIES["course_video_count"], cache_control=COURSE_CACHE_CONTROL))
+router.add("GET", "/api/course-exercise-count", Route(QUERIES["course_exercise_count"], cache_control=COURSE_CACHE_CONTROL))
+router.add("GET", "/api/course-comment-reply-sentiment", Route(queries={
+    "comments": QUERIES["course_comment_sentiment"],
+    "replies": QUERIES["course_reply_sentiment"],
+}, cache_control=COURSE_CACHE_CONTROL))
+# Streamed as pre-encoded JSON, so only the row format is available
+router.add("GET", "/api/course-users", Route(handler=course_users, cache_control=USER_LIST_CACHE_CONTROL, columnar=False))
+router.add("GET", "/api/course-compare", Route(
+    handler=course_compare, cache_control=COURSE_CACHE_CONTROL, priority=DASHBOARD
+))
+
+def current_version():
+    return query_cache.current_version()
+
+def query_runner(params):
+    return run_athena_queries
+
+def handle_request(event, route, path_params):
+    return service.handle_request(event, route, path_params)
 
 def lambda_handler(event, context):
-    logger.info(json.dumps(event))
-    path = event.get("path", "")
-    method = event.get("httpMethod", "")
-    logger.info(f"Processing request: {method} {path}")
+    return service.lambda_handler(event, context)
 
-    try:
-        if path == "/api/top-courses" and method == "GET":
-            query = """
-                SELECT 
-                    f.course_id, 
-                    c.name, 
-                    COUNT(*) AS user_count
-                FROM 
-                    full_phase1 f
-                JOIN 
-                    course_info c ON f.course_id = c.course_id
-                GROUP BY 
-                    f.course_id, c.name
-                ORDER BY 
-                    user_count DESC
-                LIMIT 5;
-            """
-            data = run_athena_query(query)
-
-        elif path == "/api/monthly-users" and method == "GET":
-            query = """
-                SELECT 
-                  user_year AS year,
-                  user_month AS month,
-                  COUNT(DISTINCT user_id) AS num_users
-                FROM full_phase1
-                WHERE user_year >= 2019
-                GROUP BY user_year, user_month
-                ORDER BY user_year, user_month;
-            """
-            data = run_athena_query(query)
-
-        elif path == "/api/yearly-users" and method == "GET":
-            query = """
-                SELECT 
-                  user_year AS year,
-                  COUNT(DISTINCT user_id) AS num_users
-                FROM full_phase1
-                WHERE user_year >= 2019
-                GROUP BY user_year
-                ORDER BY user_year;
-            """
-            data = run_athena_query(query)
-
-        elif path == "/api/summary-stats" and method == "GET":
-            query = """
-                SELECT
-                  (SELECT COUNT(DISTINCT user_id) FROM full_phase1) AS total_users,
-                  (SELECT COUNT(DISTINCT course_id) FROM full_phase1) AS total_courses,
-                  (SELECT COUNT(DISTINCT course_id) 
-                   FROM full_phase1
-                   WHERE (user_year > 2020 OR (user_year = 2020 AND user_month >= 7))
-                  ) AS courses_since_july_2020,
-                  (SELECT COUNT(DISTINCT user_id) 
-                   FROM full_phase1
-                   WHERE user_year = 2020
-                  ) AS users_in_2020;
-            """
-            data = run_athena_query(query)
-
-        elif path == "/api/label-distribution" and method == "GET":
-            query = """
-                SELECT 
-                  label,
-                  COUNT(*) AS num_users
-                FROM full_phase1
-                WHERE label IN ('A', 'B', 'C', 'D','E')
-                  AND (
-                    end_year = 2019 
-                    OR (end_year = 2021 AND end_month < 7)
-                  )
-                GROUP BY label
-                ORDER BY num_users DESC;
-            """
-            data = run_athena_query(query)
-            
-        elif path == "/api/course-enrollments" and method == "GET":
-            query = """
-                SELECT 
-                    p.course_id,
-                    c.name,
-                    p.school,
-                    c.start_date,
-                    c.end_date,
-                    COUNT(DISTINCT p.user_id) AS user_count
-                FROM 
-                    phase1 p
-                JOIN 
-                    course_info c ON p.course_id = c.course_id
-                GROUP BY 
-                    p.course_id, c.name, p.school, c.start_date, c.end_date
-                ORDER BY 
-                    user_count DESC
-                LIMIT 100;
-            """
-            data = run_athena_query(query)
-
-        elif path.startswith("/api/course/") and method == "GET":
-            course_id = path.split("/")[-1]
-            query = query = f"""
-                SELECT 
-                    c.course_id,
-                    c.name,
-                    c.start_date,
-                    c.end_date,
-                    c.duration_days,
-                    c.certificate,
-                    c.assignment,
-                    c.exam,
-                    c.video,
-                    c.video_count,
-                    c.exercise_count,
-                    c.chapter_count
-                FROM course_info c
-                WHERE c.course_id = '{course_id}'
-                LIMIT 1
-            """
-            data = run_athena_query(query)
-        elif path == "/api/search-labels" and method == "GET":
-            course_id = event.get("queryStringParameters", {}).get("course_id")
-            if not course_id:
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"error": "Missing course_id"})
-                }
-
-            query = f"""
-                SELECT 
-                    label,
-                    COUNT(*) AS count
-                FROM phase1
-                WHERE course_id = '{course_id}'
-                  AND label IN ('A', 'B', 'C', 'D', 'E')
-                GROUP BY label
-                ORDER BY count DESC;
-            """
-            data = run_athena_query(query)
-        elif path == "/api/course-video-count" and method == "GET":
-            course_id = event.get("queryStringParameters", {}).get("course_id")
-            if not course_id:
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"error": "Missing course_id"})
-                }
-            if course_id.startswith("C_"):
-                course_id = int(course_id[2:])
-
-            query = f"""
-                SELECT 
-                year,
-                month,
-                COUNT(*) AS video_count
-                FROM video
-                WHERE year >= 2019 AND course_id = {course_id}
-                GROUP BY year, month
-                ORDER BY year, month;
-            """
-            data = run_athena_query(query)
-        elif path == "/api/course-exercise-count" and method == "GET":
-            course_id = event.get("queryStringParameters", {}).get("course_id")
-            if not course_id:
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"error": "Missing course_id"})
-                }
-
-            query = f"""
-                SELECT 
-                YEAR(TRY_CAST(exercise_submit_date_max AS DATE)) AS year,
-                MONTH(TRY_CAST(exercise_submit_date_max AS DATE)) AS month,
-                COUNT(*) AS exercise_count
-                FROM exercise
-                WHERE exercise_submit_date_max IS NOT NULL AND course_id = '{course_id}'
-                GROUP BY 
-                YEAR(TRY_CAST(exercise_submit_date_max AS DATE)),
-                MONTH(TRY_CAST(exercise_submit_date_max AS DATE))
-                ORDER BY 
-                YEAR(TRY_CAST(exercise_submit_date_max AS DATE)),
-                MONTH(TRY_CAST(exercise_submit_date_max AS DATE));
-            """
-            data = run_athena_query(query)
-        
-        elif path == "/api/course-comment-reply-sentiment" and method == "GET":
-            course_id = event.get("queryStringParameters", {}).get("course_id")
-            if not course_id:
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"error": "Missing course_id"})
-                }
-
-            # Query comments sentiment (no course_id filter as per your SQL)
-            comment_query = f"""
-                SELECT
-                    sentiment_label,
-                    YEAR(TRY_CAST(create_time AS TIMESTAMP)) AS year,
-                    MONTH(TRY_CAST(create_time AS TIMESTAMP)) AS month,
-                    COUNT(*) AS comment_count
-                FROM comment
-                WHERE course_id = '{course_id}'
-                GROUP BY
-                    sentiment_label,
-                    YEAR(TRY_CAST(create_time AS TIMESTAMP)),
-                    MONTH(TRY_CAST(create_time AS TIMESTAMP))
-                ORDER BY
-                    sentiment_label,
-                    year,
-                    month;
-
-            """
-            comment_data = run_athena_query(comment_query)
-
-            # Query replies sentiment filtered by course_id
-            reply_query = f"""
-                SELECT
-                    sentiment_label,
-                    YEAR(TRY_CAST(create_time AS TIMESTAMP)) AS year,
-                    MONTH(TRY_CAST(create_time AS TIMESTAMP)) AS month,
-                    COUNT(*) AS reply_count
-                FROM reply
-                WHERE course_id = '{course_id}'
-                GROUP BY
-                    sentiment_label,
-                    YEAR(TRY_CAST(create_time AS TIMESTAMP)),
-                    MONTH(TRY_CAST(create_time AS TIMESTAMP))
-                ORDER BY
-                    sentiment_label,
-                    year,
-                    month
-            """
-            reply_data = run_athena_query(reply_query)
-
-            data = {
-                "comments": comment_data,
-                "replies": reply_data
-            }
-
-        elif path == "/api/course-users" and method == "GET":
-            course_id = event.get("queryStringParameters", {}).get("course_id")
-            if not course_id:
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"error": "Missing course_id"})
-                }
-
-            query = f"""
-                SELECT DISTINCT user_id, school, user_month, user_year
-                FROM full_phase1
-                WHERE course_id = '{course_id}'
-                limit 100
-            """
-
-            data = run_athena_query(query)
-
-        
-
-
-
-        else:
-            logger.warning("404 Not Found: Path or method mismatch.")
-            return {
-                "statusCode": 404,
-                "body": json.dumps({"error": "Not Found"})
-            }
-
-        logger.info(f"Returning successful response: {json.dumps(data)}")
-        return {
-            "statusCode": 200,
-            "headers": {"Access-Control-Allow-Origin": "*"},
-            "body": json.dumps(data)
-        }
-
-    
-    
-
-    except Exception as e:
-        logger.error(f"Error: {str(e)}")
-        return {
-            "statusCode": 500,
-            "body": json.dumps({"error": str(e)})
-        }
+logger.info(f"Cold start: {__name__} initialised in {(time.perf_counter() - _INIT_STARTED) * 1000:.1f} ms")
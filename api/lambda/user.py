@@ -1,9 +1,21 @@
-import boto3
 import time
-import json
+
+_INIT_STARTED = time.perf_counter()
+
 import os
+import sys
 import logging
-import pandas as pd
+from api.clients import shared_client
+from api.athena.local import query_backend
+from api.athena.cache import shared_dataset_version
+from api.athena.templates import QueryTemplate, BoundQuery, Param, Route, Router, course_number
+from api.ml.registry import ModelRegistry
+from api.db.learners import LearnerTemplate, learner_store
+from api.athena.budget import ScanGuard, parse_budgets, MB
+from api.athena.admission import DASHBOARD, shared_controller
+from api.athena.service import AthenaService
+from api.athena.compaction import CompactedTables
+from api.metrics import Metrics
 
 
 logger = logging.getLogger()
@@ -12,247 +24,350 @@ logger.setLevel(logging.INFO)
 # Environment Variables
 DATABASE = os.environ.get('DATABASE', 'analyticsworkshopdb')
 S3_OUTPUT = "s3://mooccubex-datalake/query_results/"
-
-athena = boto3.client("athena")
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'athena')
+LOCAL_DATA_DIR = os.environ.get('LOCAL_DATA_DIR', '/tmp/mooccubex')
+LOCAL_DATA_BUCKET = os.environ.get('LOCAL_DATA_BUCKET', 'mooccubex-datalake')
+LOCAL_DATA_PREFIX = os.environ.get('LOCAL_DATA_PREFIX')
+
+MODEL_BUCKET = os.environ.get('MODEL_BUCKET', 'mooccubex-datalake')
+MODEL_PREFIX = os.environ.get('MODEL_PREFIX', 'tools/random-forest/')
+MODEL_CACHE_MAX_MB = int(os.environ.get('MODEL_CACHE_MAX_MB', '512'))
+# pickle, or compact for the arrays exported by api/ml/forest.py
+MODEL_FORMAT = os.environ.get('MODEL_FORMAT', 'pickle')
+CACHE_BUCKET = os.environ.get('CACHE_BUCKET', 'mooccubex-datalake')
+CACHE_PREFIX = os.environ.get('CACHE_PREFIX', 'query_cache/')
+COMPACTED_BUCKET = os.environ.get('COMPACTED_BUCKET', 'mooccubex-datalake')
+COMPACTED_PREFIX = os.environ.get('COMPACTED_PREFIX', 'compacted/')
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Mooccubex/Api')
+# Precomputed per-learner results (api/db/learners.py): dynamodb, sqlite or
+# none. Off by default; turn it on once the job has filled the store.
+LEARNER_STORE = os.environ.get('LEARNER_STORE', 'none')
+LEARNER_TABLE = os.environ.get('LEARNER_TABLE', 'learner_features')
+LEARNER_STORE_PATH = os.environ.get('LEARNER_STORE_PATH', '/tmp/learners.db')
+# Bytes Athena may scan for one request, per route ("GET /api/...") in
+# SCAN_BUDGETS_MB as JSON, and SCAN_BUDGET_MB for the others; 0 disables
+SCAN_BUDGET_MB = float(os.environ.get('SCAN_BUDGET_MB', '10240'))
+SCAN_BUDGETS_MB = os.environ.get('SCAN_BUDGETS_MB')
+# Share of requests whose full event and response body are logged
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+LOG_BODY_MAX_CHARS = int(os.environ.get('LOG_BODY_MAX_CHARS', '2000'))
+
+# Learner data is per user, so only the browser may cache it. Predictions
+# also depend on the models, which change without a new dataset version,
+# so those routes send no caching headers.
+USER_CACHE_CONTROL = os.environ.get('USER_CACHE_CONTROL', 'private, max-age=300')
+
+# Created on first use and shared with the other API module when both are
+# served by one process; see api/clients.py
+athena = shared_client("athena")
+s3 = shared_client("s3")
+
+# Part of every ETag; shared with the course API's query cache
+dataset_version = shared_dataset_version(s3, CACHE_BUCKET, f"{CACHE_PREFIX}dataset_version")
+
+# Loaded lazily and kept across warm invocations
+models = ModelRegistry(
+    s3, MODEL_BUCKET, MODEL_PREFIX, max_bytes=MODEL_CACHE_MAX_MB * 1024 * 1024, model_format=MODEL_FORMAT
+)
+
+# One item per (course_id, user_id); learners it lacks fall back to Athena
+learners = learner_store(LEARNER_STORE, LEARNER_TABLE, LEARNER_STORE_PATH, region_name="us-east-1")
+
+# Handler time per route, and queue/engine time and bytes scanned per query
+metrics = Metrics(METRICS_NAMESPACE, "user")
+
+# Queries over their route's scan budget are refused or cancelled; the
+# estimates come from the bytes earlier runs of each query scanned
+scan_guard = ScanGuard(int(SCAN_BUDGET_MB * MB), parse_budgets(SCAN_BUDGETS_MB), route=lambda: metrics.current_route())
+
+# Athena queries wait for a slot by priority class (the route's, or
+# interactive); shared with the other API module in one process
+admission = shared_controller()
+
+# Queries over a compacted table read the raw one until it has been
+# compacted at the current dataset version
+compacted = CompactedTables(s3, COMPACTED_BUCKET, COMPACTED_PREFIX, dataset_version)
+
+# Runs queries and requests the same way as api/lambda/course.py
+service = AthenaService(sys.modules[__name__])
+
+def run_remote_queries(queries):
+    return service.run_remote_queries(queries)
+
+# With QUERY_BACKEND=duckdb, queries over tables with a local Parquet
+# extract run in DuckDB; the rest still go to Athena.
+backend = query_backend(run_remote_queries, QUERY_BACKEND, LOCAL_DATA_DIR, s3, LOCAL_DATA_BUCKET, LOCAL_DATA_PREFIX)
 
 def run_athena_query(query):
-    response = athena.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={"Database": DATABASE},
-        ResultConfiguration={"OutputLocation": S3_OUTPUT}
-    )
-    execution_id = response["QueryExecutionId"]
-    logger.info(f"QueryExecutionId: {execution_id}")
-
-    while True:
-        status = athena.get_query_execution(QueryExecutionId=execution_id)
-        state = status["QueryExecution"]["Status"]["State"]
-        logger.info(f"Athena query state: {state}")
-        if state in ["SUCCEEDED", "FAILED", "CANCELLED"]:
-            break
-        time.sleep(1)
-
-    if state != "SUCCEEDED":
-        reason = status["QueryExecution"]["Status"].get("StateChangeReason", "Unknown reason")
-        logger.error(f"Query failed. Reason: {reason}")
-        raise Exception(f"Athena query failed: {state}")
-
-    results = athena.get_query_results(QueryExecutionId=execution_id)
-    headers = [col["VarCharValue"] for col in results["ResultSet"]["Rows"][0]["Data"]]
-    rows = results["ResultSet"]["Rows"][1:]
-
-    data = []
-    for row in rows:
-        values = [col.get("VarCharValue", None) for col in row["Data"]]
-        data.append(dict(zip(headers, values)))
-    return data
+    return run_athena_queries([query])[0]
+
+def run_athena_queries(queries):
+    return backend(queries)
+
+COURSE_ID = Param("course_id")
+USER_ID = Param("user_id")
+VIDEO_COURSE_ID = Param("course_id", "integer", convert=course_number)
+
+PHASES = range(1, 5)
+
+QUERIES = {
+    "user_info": QueryTemplate("user_info", """
+        SELECT DISTINCT user_id, school, user_month, user_year, end_month, end_year
+        FROM full_phase1
+        WHERE course_id = ? AND user_id = ?
+        ORDER BY user_year, user_month
+        LIMIT 1
+    """, [COURSE_ID, USER_ID]),
+
+    # exercise_by_course is the compacted exercise table, partitioned by
+    # course and sorted by user (api/athena/compaction.py)
+    "user_exercise_count": QueryTemplate("user_exercise_count", """
+        SELECT COUNT(*) AS exercise_count
+        FROM exercise_by_course
+        WHERE exercise_submit_date_max IS NOT NULL AND course_id = ? AND user_id = ?
+    """, [COURSE_ID, USER_ID]),
+
+    "user_video_count": QueryTemplate("user_video_count", """
+        SELECT COUNT(*) AS video_count
+        FROM video
+        WHERE year >= 2019 AND course_id = ? AND user_id = ?
+    """, [VIDEO_COURSE_ID, USER_ID]),
+
+    "user_score_proportion": QueryTemplate("user_score_proportion", """
+        SELECT DISTINCT user_id, course_id, assignment_score, final_exam_score, video_score, total_score
+        FROM score_proportion
+        WHERE course_id = ? AND user_id = ?
+        LIMIT 1
+    """, [COURSE_ID, USER_ID]),
+
+    "user_monthly_exercises": QueryTemplate("user_monthly_exercises", """
+        SELECT
+        NULLIF(event_year, 0) AS year,
+        NULLIF(event_month, 0) AS month,
+        COUNT(*) AS exercise_count
+        FROM exercise_by_course
+        WHERE exercise_submit_date_max IS NOT NULL AND course_id = ? AND user_id = ?
+        GROUP BY event_year, event_month
+        ORDER BY year, month
+    """, [COURSE_ID, USER_ID]),
+
+    "user_monthly_videos": QueryTemplate("user_monthly_videos", """
+        SELECT
+        year,
+        month,
+        COUNT(*) AS video_count
+        FROM video
+        WHERE year >= 2019 AND course_id = ? AND user_id = ?
+        GROUP BY year, month
+        ORDER BY year, month
+    """, [VIDEO_COURSE_ID, USER_ID]),
+}
+
+# Table names cannot be parameters, so there is one template per phase table
+for phase in PHASES:
+    QUERIES[f"user_phase{phase}"] = QueryTemplate(f"user_phase{phase}", f"""
+        SELECT *
+        FROM phase{phase}
+        WHERE user_id = ? AND course_id = ?
+        LIMIT 1
+    """, [USER_ID, COURSE_ID])
+    QUERIES[f"course_phase{phase}"] = QueryTemplate(f"course_phase{phase}", f"""
+        SELECT *
+        FROM phase{phase}
+        WHERE course_id = ?
+    """, [COURSE_ID])
+
+# The same queries for a whole course, split per learner by the batch job
+# that fills the learner store. They must return the same rows and columns
+# as the per-learner templates above, plus user_id.
+LEARNER_QUERIES = {
+    "user_info": LearnerTemplate(QueryTemplate("user_info", """
+        SELECT DISTINCT user_id, school, user_month, user_year, end_month, end_year
+        FROM full_phase1
+        WHERE course_id = ?
+        ORDER BY user_id, user_year, user_month
+    """, [COURSE_ID]), keep_user_id=True, limit=1),
+
+    "user_exercise_count": LearnerTemplate(QueryTemplate("user_exercise_count", """
+        SELECT user_id, COUNT(*) AS exercise_count
+        FROM exercise_by_course
+        WHERE exercise_submit_date_max IS NOT NULL AND course_id = ?
+        GROUP BY user_id
+    """, [COURSE_ID]), empty=[{"exercise_count": "0"}], columns=[("exercise_count", "bigint")]),
+
+    "user_video_count": LearnerTemplate(QueryTemplate("user_video_count", """
+        SELECT user_id, COUNT(*) AS video_count
+        FROM video
+        WHERE year >= 2019 AND course_id = ?
+        GROUP BY user_id
+    """, [VIDEO_COURSE_ID]), empty=[{"video_count": "0"}], columns=[("video_count", "bigint")]),
+
+    "user_score_proportion": LearnerTemplate(QueryTemplate("user_score_proportion", """
+        SELECT DISTINCT user_id, course_id, assignment_score, final_exam_score, video_score, total_score
+        FROM score_proportion
+        WHERE course_id = ?
+    """, [COURSE_ID]), keep_user_id=True, limit=1),
+
+    "user_monthly_exercises": LearnerTemplate(QueryTemplate("user_monthly_exercises", """
+        SELECT
+        user_id,
+        NULLIF(event_year, 0) AS year,
+        NULLIF(event_month, 0) AS month,
+        COUNT(*) AS exercise_count
+        FROM exercise_by_course
+        WHERE exercise_submit_date_max IS NOT NULL AND course_id = ?
+        GROUP BY user_id, event_year, event_month
+        ORDER BY user_id, year, month
+    """, [COURSE_ID])),
+
+    "user_monthly_videos": LearnerTemplate(QueryTemplate("user_monthly_videos", """
+        SELECT
+        user_id,
+        year,
+        month,
+        COUNT(*) AS video_count
+        FROM video
+        WHERE year >= 2019 AND course_id = ?
+        GROUP BY user_id, year, month
+        ORDER BY user_id, year, month
+    """, [VIDEO_COURSE_ID])),
+}
+
+for phase in PHASES:
+    LEARNER_QUERIES[f"user_phase{phase}"] = LearnerTemplate(QueryTemplate(f"user_phase{phase}", f"""
+        SELECT *
+        FROM phase{phase}
+        WHERE course_id = ?
+    """, [COURSE_ID]), keep_user_id=True, limit=1)
+
+def learner_queries(params):
+    # Per-learner queries are answered from the learner store when it has
+    # the (course, user) pair; anything else goes to run_athena_queries.
+    # The store is only read once queries are run, so handler routes that
+    # never use it do not pay for the lookup.
+    course_id, user_id = params.get("course_id"), params.get("user_id")
+    if learners is None or not course_id or not user_id:
+        return run_athena_queries
+
+    def run(queries):
+        try:
+            record = learners.get(course_id, user_id)
+        except Exception as e:
+            logger.warning(f"Learner store lookup failed: {e}")
+            record = None
+        if record is None:
+            return run_athena_queries(queries)
+        results = [record.get(query.name) for query in queries]
+        missing = [index for index, rows in enumerate(results) if rows is None]
+        if missing:
+            for index, rows in zip(missing, run_athena_queries([queries[index] for index in missing])):
+                results[index] = rows
+        return results
+    return run
+
+def user_course_predict(params):
+    # pandas is only needed here, so it is not imported on a cold start
+    from api.ml.features import predict_phase
+
+    phase_queries = [QUERIES[f"user_phase{phase}"].bind(params) for phase in PHASES]
+    school_map = models.school_map()
+
+    # Store all phase results
+    results = []
+    phase_rows = learner_queries(params)(phase_queries)
+
+    for phase, rows in zip(PHASES, phase_rows):
+        if not rows:
+            continue  # Skip if no data for this phase
+
+        df, features, y_pred = predict_phase(models, phase, rows, school_map)
+        y_true = df.get('label_encoded', [None])[0]
+
+        output = features.copy()
+        output['predicted_label'] = y_pred[0]
+        output['true_label'] = y_true
+
+        results.append({
+            "phase": phase,
+            "data": output.to_dict(orient="records")[0]
+        })
+
+    return results
+
+def course_predict(params):
+    # pandas is only needed here, so it is not imported on a cold start
+    from api.ml.features import predict_phase
+
+    phase_queries = [QUERIES[f"course_phase{phase}"].bind(params) for phase in PHASES]
+    course_id = COURSE_ID.value(params)
+
+    # An optional comma separated list of users narrows each scan with one
+    # execution parameter per user.
+    user_ids = [user_id.strip() for user_id in (params.get("user_ids") or "").split(",") if user_id.strip()]
+    if user_ids:
+        placeholders = ", ".join("?" for _ in user_ids)
+        phase_queries = [
+            BoundQuery(
+                query.name,
+                f"{query.sql} AND user_id IN ({placeholders})",
+                query.parameters + [USER_ID.literal(user_id) for user_id in user_ids],
+            )
+            for query in phase_queries
+        ]
+
+    school_map = models.school_map()
+
+    # One scan per phase table for the whole course, then one
+    # vectorized predict per phase instead of one call per learner.
+    phase_rows = run_athena_queries(phase_queries)
+
+    results = []
+    for phase, rows in zip(PHASES, phase_rows):
+        if not rows:
+            continue
+
+        df, features, y_pred = predict_phase(models, phase, rows, school_map)
+        true_labels = df['label_encoded'] if 'label_encoded' in df else [None] * len(df)
+
+        results.append({
+            "phase": phase,
+            "predictions": [
+                {"user_id": user_id, "predicted_label": label.item(), "true_label": true_label}
+                for user_id, label, true_label in zip(df['user_id'], y_pred, true_labels)
+            ]
+        })
+
+    return {
+        "course_id": course_id,
+        "phases": results
+    }
+
+router = Router()
+router.add("GET", "/api/user-course-info", Route(queries={
+    "user_info": QUERIES["user_info"],
+    "user_exercises": QUERIES["user_exercise_count"],
+    "user_video": QUERIES["user_video_count"],
+    "user_comments": QUERIES["user_score_proportion"],
+}, cache_control=USER_CACHE_CONTROL))
+router.add("GET", "/api/user-course-score-proportion", Route(QUERIES["user_score_proportion"], cache_control=USER_CACHE_CONTROL))
+router.add("GET", "/api/user-course-behaviour", Route(queries={
+    "user_video": QUERIES["user_monthly_videos"],
+    "user_exercises": QUERIES["user_monthly_exercises"],
+}, cache_control=USER_CACHE_CONTROL))
+router.add("GET", "/api/user-course-predict", Route(handler=user_course_predict))
+# Scans whole phase tables, so it queues behind the per-learner lookups
+router.add("GET", "/api/course-predict", Route(handler=course_predict, priority=DASHBOARD))
+
+def current_version():
+    return dataset_version.get()
+
+def query_runner(params):
+    return learner_queries(params)
+
+def handle_request(event, route, path_params):
+    return service.handle_request(event, route, path_params)
 
 def lambda_handler(event, context):
-    logger.info(json.dumps(event))
-    path = event.get("path", "")
-    method = event.get("httpMethod", "")
-    logger.info(f"Processing request: {method} {path}")
-
-    try:
-        if path == "/api/user-course-info" and method == "GET":
-            course_id = event.get("queryStringParameters", {}).get("course_id")
-            user_id = event.get("queryStringParameters", {}).get("user_id")
-            query = f"""
-                SELECT DISTINCT user_id, school, user_month, user_year, end_month, end_year
-                FROM full_phase1
-                WHERE course_id = '{course_id}' AND user_id = '{user_id}'
-                ORDER BY user_year, user_month
-                limit 1
-            """
-            user_info = run_athena_query(query)
-
-            query = f"""
-                SELECT COUNT(*) AS exercise_count
-                FROM exercise
-                WHERE exercise_submit_date_max IS NOT NULL AND course_id = '{course_id}' AND user_id = '{user_id}'
-            """
-            user_exercises = run_athena_query(query)
-            
-            if course_id.startswith("C_"):
-                course = int(course_id[2:])
-
-            query = f"""
-                SELECT COUNT(*) AS video_count
-                FROM video
-                WHERE year >= 2019 AND course_id = {course} AND user_id = '{user_id}'
-            """
-
-            user_video = run_athena_query(query)
-
-            query = f"""
-                SELECT DISTINCT user_id, course_id, assignment_score, final_exam_score, video_score, total_score
-                FROM score_proportion
-                WHERE course_id = '{course_id}' AND user_id = '{user_id}'
-                LIMIT 1
-            """
-            user_comments = run_athena_query(query)
-
-            data = {
-                "user_info": user_info,
-                "user_exercises": user_exercises,
-                "user_video": user_video,
-                "user_comments": user_comments
-            }
-
-        elif path == "/api/user-course-score-proportion" and method == "GET":
-            course_id = event.get("queryStringParameters", {}).get("course_id")
-            user_id = event.get("queryStringParameters", {}).get("user_id")
-            query = f"""
-                SELECT DISTINCT user_id, course_id, assignment_score, final_exam_score, video_score, total_score
-                FROM score_proportion
-                WHERE course_id = '{course_id}' AND user_id = '{user_id}'
-                LIMIT 1
-            """
-            data = run_athena_query(query)
-
-        elif path == "/api/user-course-behaviour" and method == "GET":
-            course_id = event.get("queryStringParameters", {}).get("course_id")
-            user_id = event.get("queryStringParameters", {}).get("user_id")
-            query = f"""
-                SELECT 
-                YEAR(TRY_CAST(exercise_submit_date_max AS DATE)) AS year,
-                MONTH(TRY_CAST(exercise_submit_date_max AS DATE)) AS month,
-                COUNT(*) AS exercise_count
-                FROM exercise
-                WHERE exercise_submit_date_max IS NOT NULL AND course_id = '{course_id}' AND user_id = '{user_id}'
-                GROUP BY 
-                YEAR(TRY_CAST(exercise_submit_date_max AS DATE)),
-                MONTH(TRY_CAST(exercise_submit_date_max AS DATE))
-                ORDER BY 
-                YEAR(TRY_CAST(exercise_submit_date_max AS DATE)),
-                MONTH(TRY_CAST(exercise_submit_date_max AS DATE));
-            """
-            user_exercises = run_athena_query(query)
-            
-            if course_id.startswith("C_"):
-                course = int(course_id[2:])
-
-            query = f"""
-                SELECT 
-                year,
-                month,
-                COUNT(*) AS video_count
-                FROM video
-                WHERE year >= 2019 AND course_id = {course} AND user_id = '{user_id}'
-                GROUP BY year, month
-                ORDER BY year, month;
-            """
-
-            user_video = run_athena_query(query)
-
-            data = {
-                "user_video": user_video,
-                "user_exercises": user_exercises
-            }
-
-        elif path == "/api/user-course-predict" and method == "GET":
-            course_id = event.get("queryStringParameters", {}).get("course_id")
-            user_id = event.get("queryStringParameters", {}).get("user_id")
-
-            import pandas as pd
-            import pickle
-            import io
-            import os
-
-            s3 = boto3.client("s3")
-            s3_bucket = 'mooccubex-datalake'
-            s3_prefix = 'tools/random-forest/'
-
-            # Load school_mapping.pkl from S3
-            school_map_obj = s3.get_object(Bucket=s3_bucket, Key=f"tools/school_mapping.pkl")
-            school_map = pickle.loads(school_map_obj['Body'].read())
-
-            # Store all phase results
-            results = []
-
-            for phase in range(1, 5):
-                query = f"""
-                    SELECT *
-                    FROM phase{phase}
-                    WHERE user_id = '{user_id}' AND course_id = '{course_id}'
-                    LIMIT 1
-                """
-                rows = run_athena_query(query)
-                if not rows:
-                    continue  # Skip if no data for this phase
-
-                df = pd.DataFrame(rows)
-                if df.empty:
-                    continue
-
-                # --- PREPROCESS ---
-                df['school'] = df['school'].map(school_map).fillna(0).astype(int)
-
-                # Drop non-feature columns
-                non_features = ['total_score', 'label', 'label_encoded']
-                feature_columns = [col for col in df.columns if col not in non_features]
-                features = df[feature_columns]
-
-                # Handle potential string-type numeric fields (example for phase 2)
-                for col in features.columns:
-                    if features[col].dtype == 'object':
-                        try:
-                            features[col] = pd.to_numeric(features[col], errors='coerce')
-                        except Exception:
-                            pass
-                features.fillna(0, inplace=True)
-
-                # --- LOAD SCALER ---
-                scaler_key = f"{s3_prefix}best_scaler_no_sample_phase{phase}.pkl"
-                scaler_obj = s3.get_object(Bucket=s3_bucket, Key=scaler_key)
-                scaler = pickle.loads(scaler_obj['Body'].read())
-
-                X_scaled = scaler.transform(features)
-
-                # --- LOAD MODEL ---
-                model_key = f"{s3_prefix}best_model_no_sample_phase{phase}.pkl"
-                model_obj = s3.get_object(Bucket=s3_bucket, Key=model_key)
-                model = pickle.loads(model_obj['Body'].read())
-
-                # --- PREDICT ---
-                y_pred = model.predict(X_scaled)
-                y_true = df.get('label_encoded', [None])[0]
-
-                output = features.copy()
-                output['predicted_label'] = y_pred[0]
-                output['true_label'] = y_true
-
-                results.append({
-                    "phase": phase,
-                    "data": output.to_dict(orient="records")[0]
-                })
-
-            
-
-
-
-        
-            
-
-        else:
-            logger.warning("404 Not Found: Path or method mismatch.")
-            return {
-                "statusCode": 404,
-                "body": json.dumps({"error": "Not Found"})
-            }
-
-        logger.info(f"Returning successful response: {json.dumps(data)}")
-
-        return {
-            "statusCode": 200,
-            "headers": {"Access-Control-Allow-Origin": "*"},
-            "body": json.dumps(data)
-        }
-
-
-    except Exception as e:
-        logger.error(f"Error: {str(e)}")
-        return {
-            "statusCode": 500,
-            "body": json.dumps({"error": str(e)})
-        }
\ No newline at end of file
+    return service.lambda_handler(event, context)
+
+logger.info(f"Cold start: {__name__} initialised in {(time.perf_counter() - _INIT_STARTED) * 1000:.1f} ms")
@@ -2,6 +2,7 @@ from fastapi import FastAPI, Depends
 from mangum import Mangum
 from fastapi.middleware.cors import CORSMiddleware
 from api.auth.router import router as auth_router
+from api.analytics.router import router as analytics_router
 
 app = FastAPI(
     title="bi-mooccubex-backend",
@@ -15,9 +16,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 # Include routers
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
+app.include_router(analytics_router, tags=["analytics"])
 
 @app.get("/")
 async def root():
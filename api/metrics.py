@@ -0,0 +1,103 @@
+import sys
+import time
+import random
+import logging
+import contextvars
+from api.athena.reader import dumps
+from api.athena.admission import CLASS_NAMES
+
+logger = logging.getLogger()
+
+QUERY_METRICS = {
+    "QueueTime": ("QueryQueueTimeInMillis", "Milliseconds"),
+    "EngineTime": ("EngineExecutionTimeInMillis", "Milliseconds"),
+    "TotalTime": ("TotalExecutionTimeInMillis", "Milliseconds"),
+    "BytesScanned": ("DataScannedInBytes", "Bytes"),
+}
+
+
+def _write_line(line):
+    sys.stdout.write(line + "\n")
+
+
+class Metrics:
+    # Writes CloudWatch embedded metric format records: one JSON line per
+    # record on stdout, turned into metrics by CloudWatch Logs without any
+    # API calls. Query records are tagged with the route being handled.
+    def __init__(self, namespace, service, write=_write_line, clock=time.time):
+        self.namespace = namespace
+        self.service = service
+        self.write = write
+        self.clock = clock
+        self._route = contextvars.ContextVar("metrics_route", default="-")
+
+    def emit(self, dimensions, values, units, properties=None):
+        dimensions = {"Service": self.service, **dimensions}
+        record = {
+            "_aws": {
+                "Timestamp": int(self.clock() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": units[name]} for name in values],
+                }],
+            },
+            **dimensions,
+            **values,
+            **(properties or {}),
+        }
+        self.write(dumps(record))
+
+    def set_route(self, route):
+        return self._route.set(route)
+
+    def reset_route(self, token):
+        self._route.reset(token)
+
+    def current_route(self):
+        return self._route.get()
+
+    def query(self, query, execution):
+        # Called by the executor with the final QueryExecution of each query
+        statistics = execution.get("Statistics") or {}
+        self.emit(
+            {"Route": self._route.get(), "Query": getattr(query, "name", None) or "sql"},
+            {name: statistics.get(key, 0) for name, (key, _) in QUERY_METRICS.items()},
+            {name: unit for name, (_, unit) in QUERY_METRICS.items()},
+            {"QueryExecutionId": execution.get("QueryExecutionId")},
+        )
+
+    def budget_exceeded(self, route, error):
+        self.emit(
+            {"Route": route},
+            {"ScanBudgetExceeded": 1},
+            {"ScanBudgetExceeded": "Count"},
+            {"BytesScanned": error.scanned, "ScanBudget": error.budget, "Estimated": error.estimated},
+        )
+
+    def admission(self, priority, waited, depth, admitted):
+        # Reported by the admission controller for every batch of queries
+        self.emit(
+            {"Route": self._route.get(), "Priority": CLASS_NAMES.get(priority, str(priority))},
+            {"QueueWait": round(waited * 1000, 3), "QueueDepth": depth, "Shed": 0 if admitted else 1},
+            {"QueueWait": "Milliseconds", "QueueDepth": "Count", "Shed": "Count"},
+        )
+
+    def request(self, route, status, elapsed_ms):
+        self.emit(
+            {"Route": route},
+            {"HandlerTime": round(elapsed_ms, 3)},
+            {"HandlerTime": "Milliseconds"},
+            {"StatusCode": status},
+        )
+
+
+def log_sampled(message, value, rate, max_chars, sample=random.random):
+    # Full events and bodies are only logged for a sample of requests, and
+    # cut to `max_chars`. Values are only encoded when they are logged.
+    if rate <= 0 or sample() >= rate:
+        return
+    text = value if isinstance(value, str) else dumps(value)
+    if len(text) > max_chars:
+        text = f"{text[:max_chars]}... ({len(text)} chars)"
+    logger.info(f"{message}: {text}")
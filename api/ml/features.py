@@ -0,0 +1,28 @@
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+# Columns of the phase tables that are labels, not model inputs
+NON_FEATURES = ['total_score', 'label', 'label_encoded']
+
+
+def phase_features(rows, school_map):
+    # Builds the model input for any number of phase rows at once: encode the
+    # school, drop the label columns and coerce Athena's strings to numbers.
+    df = pd.DataFrame(rows)
+    df['school'] = df['school'].map(school_map).fillna(0).astype(int)
+
+    feature_columns = [col for col in df.columns if col not in NON_FEATURES]
+    features = df[feature_columns].copy()
+
+    text_columns = [col for col in features.columns if not is_numeric_dtype(features[col])]
+    if text_columns:
+        features[text_columns] = features[text_columns].apply(pd.to_numeric, errors='coerce')
+    features = features.fillna(0)
+    return df, features
+
+
+def predict_phase(models, phase, rows, school_map):
+    # One scaler.transform and one model.predict for the whole batch
+    df, features = phase_features(rows, school_map)
+    y_pred = models.predictor(phase).predict(features)
+    return df, features, y_pred
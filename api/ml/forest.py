@@ -0,0 +1,217 @@
+"""Exports the pickled phase models to flat arrays and predicts from those.
+
+    python -m api.ml.forest --bucket mooccubex-datalake --prefix tools/random-forest/
+    python -m api.ml.forest --bucket mooccubex-datalake --prefix tools/random-forest/ --phase 2 --check-rows 20000
+
+For each phase the scaler and random forest pickles are read (this needs
+scikit-learn, the API does not) and written as one `forest_phase{n}.rfa` file:
+a JSON header followed by the node arrays of all trees. The API memory-maps
+that file and walks every tree for a whole batch with NumPy. Before upload the
+export is checked against the pickled model on rows drawn around the scaler's
+mean; any differing prediction aborts it.
+"""
+import io
+import json
+import pickle
+import struct
+import logging
+import argparse
+import numpy as np
+
+logger = logging.getLogger()
+
+MAGIC = b"RFA1"
+ALIGNMENT = 64
+
+
+class CompactForest:
+    # Trees are concatenated: node i of every array describes the same node,
+    # children hold absolute node indices, and leaves point at themselves so
+    # a batch can take `depth` steps without checking for leaves. `values`
+    # holds each node's class probabilities.
+    def __init__(self, arrays, classes, scaler, feature_names=None, depth=None):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.values = arrays["values"]
+        self.roots = arrays["roots"]
+        self.scaler_offset = arrays.get("scaler_offset")
+        self.scaler_scale = arrays.get("scaler_scale")
+        self.classes = classes
+        self.scaler = scaler
+        self.feature_names = feature_names
+        self.depth = depth
+
+    def transform(self, features):
+        # Same operations, in the same order, as the fitted scaler
+        if self.feature_names is not None and hasattr(features, "columns"):
+            features = features[self.feature_names]
+        X = np.array(features, dtype=np.float64)
+        if self.scaler == "standard":
+            if self.scaler_offset is not None:
+                X -= self.scaler_offset
+            if self.scaler_scale is not None:
+                X /= self.scaler_scale
+        elif self.scaler == "minmax":
+            X *= self.scaler_scale
+            X += self.scaler_offset
+        return X
+
+    def predict_proba(self, X):
+        # Trees compare float32 features, like scikit-learn's
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))
+        nodes = np.repeat(self.roots[:, None], len(X), axis=1)
+        for _ in range(self.depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        leaf_values = self.values[nodes]
+        # Summed tree by tree, as RandomForestClassifier does, so ties
+        # between classes resolve the same way
+        proba = np.zeros((len(X), len(self.classes)))
+        for tree_values in leaf_values:
+            proba += tree_values
+        proba /= len(self.roots)
+        return proba
+
+    def predict(self, features):
+        return self.classes.take(np.argmax(self.predict_proba(self.transform(features)), axis=1))
+
+    @classmethod
+    def from_bytes(cls, data):
+        # `data` may be bytes or a memory map; arrays are views into it
+        if bytes(data[:4]) != MAGIC:
+            raise ValueError("Not a compact forest file")
+        (header_size,) = struct.unpack("<I", bytes(data[4:8]))
+        header = json.loads(bytes(data[8:8 + header_size]))
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        arrays = {
+            name: buffer[offset:offset + np.dtype(dtype).itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+            for name, (dtype, shape, offset) in header["arrays"].items()
+        }
+        return cls(arrays, np.array(header["classes"]), header["scaler"], header["feature_names"], header["depth"])
+
+    @classmethod
+    def from_file(cls, path):
+        return cls.from_bytes(np.memmap(path, dtype=np.uint8, mode="r"))
+
+
+def _scaler_arrays(scaler):
+    if scaler is None:
+        return None, {}
+    if hasattr(scaler, "data_min_"):
+        return "minmax", {"scaler_scale": scaler.scale_, "scaler_offset": scaler.min_}
+    if hasattr(scaler, "mean_") or hasattr(scaler, "scale_"):
+        arrays = {}
+        if getattr(scaler, "mean_", None) is not None and getattr(scaler, "with_mean", True):
+            arrays["scaler_offset"] = scaler.mean_
+        if getattr(scaler, "scale_", None) is not None and getattr(scaler, "with_std", True):
+            arrays["scaler_scale"] = scaler.scale_
+        return "standard", arrays
+    raise ValueError(f"Unsupported scaler {type(scaler).__name__}")
+
+
+def export_forest(model, scaler=None):
+    # Returns the compact file contents for a fitted forest classifier
+    if not hasattr(model, "estimators_") or not hasattr(model, "classes_"):
+        raise ValueError(f"Unsupported model {type(model).__name__}")
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    depth = 0
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        count = tree.node_count
+        own = np.arange(count)
+        leaf = tree.children_left[:count] == -1
+        features.append(np.where(leaf, 0, tree.feature[:count]))
+        thresholds.append(tree.threshold[:count])
+        lefts.append(np.where(leaf, own, tree.children_left[:count]) + offset)
+        rights.append(np.where(leaf, own, tree.children_right[:count]) + offset)
+        value = np.asarray(tree.value[:count, 0, :], dtype=np.float64)
+        normalizer = value.sum(axis=1)[:, None]
+        normalizer[normalizer == 0.0] = 1.0
+        values.append(value / normalizer)
+        roots.append(offset)
+        depth = max(depth, tree.max_depth)
+        offset += count
+
+    scaler_kind, arrays = _scaler_arrays(scaler)
+    arrays.update({
+        "feature": np.concatenate(features).astype(np.int32),
+        "threshold": np.concatenate(thresholds).astype(np.float64),
+        "left": np.concatenate(lefts).astype(np.int32),
+        "right": np.concatenate(rights).astype(np.int32),
+        "values": np.concatenate(values),
+        "roots": np.array(roots, dtype=np.int32),
+    })
+    feature_names = getattr(scaler, "feature_names_in_", getattr(model, "feature_names_in_", None))
+    header = {
+        "classes": np.asarray(model.classes_).tolist(),
+        "scaler": scaler_kind,
+        "feature_names": list(feature_names) if feature_names is not None else None,
+        "depth": int(depth),
+        "arrays": {},
+    }
+    # Offsets depend on the header size, which depends on the offsets, so
+    # the header is padded to a fixed size before the arrays are placed.
+    reserved = len(json.dumps({**header, "arrays": {
+        name: [array.dtype.str, list(array.shape), 10 ** 12] for name, array in arrays.items()
+    }})) + ALIGNMENT
+    position = -(-(8 + reserved) // ALIGNMENT) * ALIGNMENT
+    for name, array in arrays.items():
+        header["arrays"][name] = [array.dtype.str, list(array.shape), position]
+        position += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    out = io.BytesIO()
+    encoded = json.dumps(header).encode("utf-8").ljust(reserved)
+    out.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+    for name, array in arrays.items():
+        out.write(b"\0" * (header["arrays"][name][2] - out.tell()))
+        out.write(np.ascontiguousarray(array).tobytes())
+    return out.getvalue()
+
+
+def check_export(model, scaler, forest, rows=10000, seed=0):
+    # Rows drawn around the training distribution the scaler remembers
+    n_features = model.n_features_in_
+    rng = np.random.default_rng(seed)
+    center = getattr(scaler, "mean_", None)
+    spread = getattr(scaler, "scale_", None) if center is not None else None
+    X = rng.normal(size=(rows, n_features)) * 3
+    if center is not None:
+        X = X * (spread if spread is not None else 1) + center
+    expected = model.predict(scaler.transform(X) if scaler is not None else X)
+    actual = forest.predict(X)
+    mismatches = int(np.sum(expected != actual))
+    if mismatches:
+        raise ValueError(f"Compact forest differs from the model on {mismatches} of {rows} rows")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bucket", default="mooccubex-datalake")
+    parser.add_argument("--prefix", default="tools/random-forest/")
+    parser.add_argument("--phase", type=int, action="append", help="phase to export (repeatable, default all)")
+    parser.add_argument("--check-rows", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from api.clients import LazyClient
+    s3 = LazyClient("s3")
+
+    def load(key):
+        return pickle.loads(s3.get_object(Bucket=args.bucket, Key=key)["Body"].read())
+
+    for phase in args.phase or range(1, 5):
+        model = load(f"{args.prefix}best_model_no_sample_phase{phase}.pkl")
+        scaler = load(f"{args.prefix}best_scaler_no_sample_phase{phase}.pkl")
+        data = export_forest(model, scaler)
+        check_export(model, scaler, CompactForest.from_bytes(data), args.check_rows)
+        key = f"{args.prefix}forest_phase{phase}.rfa"
+        s3.upload_fileobj(io.BytesIO(data), args.bucket, key)
+        logger.info(f"Exported phase {phase} to {key} ({len(data)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
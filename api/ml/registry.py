@@ -0,0 +1,145 @@
+import os
+import time
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+
+class Artifact:
+    def __init__(self, value, etag, size, checked_at):
+        self.value = value
+        self.etag = etag
+        self.size = size
+        self.checked_at = checked_at
+
+
+class ModelRegistry:
+    # Keeps unpickled artifacts for the lifetime of a warm container. An
+    # artifact is revalidated against its S3 ETag at most once every
+    # `revalidate_after` seconds and only downloaded again when it changed.
+    # The least recently used artifacts are dropped once the pickled size of
+    # everything loaded goes over `max_bytes`.
+    #
+    # With model_format="compact" predictions use the arrays exported by
+    # api/ml/forest.py, memory-mapped from a copy under `local_dir`, instead
+    # of the pickled scaler and model.
+    def __init__(self, s3_client, bucket, prefix, max_bytes=512 * 1024 * 1024,
+                 revalidate_after=300, clock=time.monotonic, model_format="pickle", local_dir=None):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.model_format = model_format
+        self.local_dir = local_dir or os.path.join(tempfile.gettempdir(), "models")
+        self.revalidate_after = revalidate_after
+        self.clock = clock
+        self.stats = {"hits": 0, "loads": 0, "revalidations": 0, "evictions": 0}
+        self._artifacts = OrderedDict()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def _fresh(self, key):
+        # The artifact if it needs no check against S3; call with _lock held
+        artifact = self._artifacts.get(key)
+        if artifact is None or self.clock() - artifact.checked_at >= self.revalidate_after:
+            return None
+        self.stats["hits"] += 1
+        self._artifacts.move_to_end(key)
+        return artifact
+
+    def get(self, key, loader=pickle.loads):
+        # S3 requests and unpickling run under a lock for `key` only, so
+        # predictions using other artifacts never wait for them; the shared
+        # lock is only held to read and swap cache entries.
+        with self._lock:
+            artifact = self._fresh(key)
+            if artifact is not None:
+                return artifact.value
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                # Another thread may have loaded it while this one waited
+                artifact = self._fresh(key)
+                if artifact is not None:
+                    return artifact.value
+                stale = self._artifacts.get(key)
+            artifact = self._refresh(key, stale, loader)
+            with self._lock:
+                self._artifacts[key] = artifact
+                self._artifacts.move_to_end(key)
+                self._evict()
+            return artifact.value
+
+    def _refresh(self, key, stale, loader):
+        now = self.clock()
+        if stale is not None:
+            with self._lock:
+                self.stats["revalidations"] += 1
+            etag = self.s3.head_object(Bucket=self.bucket, Key=key)["ETag"]
+            if etag == stale.etag:
+                stale.checked_at = now
+                return stale
+            logger.info(f"Artifact {key} changed in S3, reloading")
+        return self._load(key, now, loader)
+
+    def _load(self, key, now, loader):
+        obj = self.s3.get_object(Bucket=self.bucket, Key=key)
+        body = obj["Body"].read()
+        with self._lock:
+            self.stats["loads"] += 1
+        logger.info(f"Loaded artifact {key} ({len(body)} bytes)")
+        return Artifact(loader(body), obj["ETag"], len(body), now)
+
+    def _load_mapped(self, key, body):
+        # Written under a new name and moved into place, so maps of the
+        # previous version stay valid until they are dropped
+        from api.ml.forest import CompactForest
+        os.makedirs(self.local_dir, exist_ok=True)
+        path = os.path.join(self.local_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()[:16] + ".rfa")
+        fd, temporary = tempfile.mkstemp(dir=self.local_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        os.replace(temporary, path)
+        return CompactForest.from_file(path)
+
+    def _evict(self):
+        while len(self._artifacts) > 1 and self.memory_used() > self.max_bytes:
+            key, _ = self._artifacts.popitem(last=False)
+            self.stats["evictions"] += 1
+            logger.info(f"Evicted artifact {key}")
+
+    def memory_used(self):
+        return sum(artifact.size for artifact in self._artifacts.values())
+
+    def school_map(self):
+        return self.get("tools/school_mapping.pkl")
+
+    def scaler(self, phase):
+        return self.get(f"{self.prefix}best_scaler_no_sample_phase{phase}.pkl")
+
+    def model(self, phase):
+        return self.get(f"{self.prefix}best_model_no_sample_phase{phase}.pkl")
+
+    def forest(self, phase):
+        key = f"{self.prefix}forest_phase{phase}.rfa"
+        return self.get(key, lambda body: self._load_mapped(key, body))
+
+    def predictor(self, phase):
+        # Something with predict(features) that scales and classifies
+        if self.model_format == "compact":
+            return self.forest(phase)
+        return PickledPredictor(self.scaler(phase), self.model(phase))
+
+
+class PickledPredictor:
+    def __init__(self, scaler, model):
+        self.scaler = scaler
+        self.model = model
+
+    def predict(self, features):
+        return self.model.predict(self.scaler.transform(features))
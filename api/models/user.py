@@ -1,4 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
+from typing import Optional
 from uuid import UUID, uuid4
 
 class UserCreate(BaseModel):
@@ -21,4 +22,5 @@ class Token(BaseModel):
     token_type: str
 
 class TokenData(BaseModel):
-    email: EmailStr
\ No newline at end of file
+    email: EmailStr
+    exp: Optional[int] = None
\ No newline at end of file
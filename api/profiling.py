@@ -0,0 +1,66 @@
+"""Per-module import cost of an entry point, to track cold-start time.
+
+    python -m api.profiling api.lambda.user --top 15
+
+The same numbers are written to CloudWatch when a Lambda function runs
+with PYTHONPROFILEIMPORTTIME=1; save that log output to a file and pass
+it with --log to summarise it the same way.
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+# "import time:       123 |       4567 |   package.module"
+_IMPORT_TIME = re.compile(r"import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)")
+
+
+def parse_importtime(lines):
+    # Returns {module: (self_us, cumulative_us, depth)} for every import line
+    modules = {}
+    for line in lines:
+        match = _IMPORT_TIME.search(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        modules[module] = (int(self_us), int(cumulative_us), len(indent) // 2 - 1)
+    return modules
+
+
+def profile_imports(module, python=sys.executable):
+    env = dict(os.environ)
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"__import__({module!r})"],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    return parse_importtime(result.stderr.splitlines())
+
+
+def print_profile(modules, entry=None, top=15):
+    if entry in modules:
+        print(f"{entry} imported in {modules[entry][1] / 1000:.1f} ms")
+    print(f"{'cumulative ms':>14}  {'self ms':>8}  module")
+    ranked = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)
+    for module, (self_us, cumulative_us, _) in ranked[:top]:
+        print(f"{cumulative_us / 1000:>14.1f}  {self_us / 1000:>8.1f}  {module}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("module", nargs="?", default="api.main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--log", help="summarise -X importtime output from a log file instead")
+    args = parser.parse_args(argv)
+
+    if args.log:
+        with open(args.log) as f:
+            modules = parse_importtime(f)
+    else:
+        modules = profile_imports(args.module)
+    print_profile(modules, args.module, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import gzip
+import base64
+import hashlib
+from api.athena.cache import cache_key
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are not worth the CPU to compress
+COMPRESS_MIN_BYTES = 1024
+
+
+def request_header(event, name):
+    # API Gateway keeps the client's header casing
+    name = name.lower()
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def accepted_encodings(header):
+    encodings = set()
+    for part in (header or "").split(","):
+        coding, _, quality = part.partition(";")
+        quality = quality.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        coding = coding.strip().lower()
+        if coding:
+            encodings.add(coding)
+    return encodings
+
+
+def make_etag(*parts):
+    digest = hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def route_etag(route, path, params, version, *extra):
+    # Fingerprints the queries the request would run (or, for handler routes,
+    # its parameters) together with the dataset version, so it can be
+    # computed before anything is run.
+    queries = route.bind(params)
+    if queries is None:
+        fingerprint = sorted(params.items())
+    else:
+        fingerprint = [cache_key(query, "") for query in queries]
+    return make_etag(path, version, fingerprint, *extra)
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def compress(body, accept_encoding, min_bytes=COMPRESS_MIN_BYTES):
+    # Returns (encoding, bytes), or (None, None) when the body is sent as is
+    data = body.encode("utf-8")
+    if len(data) < min_bytes:
+        return None, None
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br", brotli.compress(data, quality=5)
+    if "gzip" in accepted:
+        return "gzip", gzip.compress(data, compresslevel=6, mtime=0)
+    return None, None
+
+
+def respond(event, status, body, headers, min_bytes=COMPRESS_MIN_BYTES):
+    # A Lambda proxy response, compressed when the client accepts it.
+    # Compressed bodies are base64 encoded, as API Gateway expects.
+    headers = dict(headers, Vary="Accept-Encoding")
+    encoding, compressed = compress(body, request_header(event, "Accept-Encoding"), min_bytes)
+    if encoding is None:
+        return {"statusCode": status, "headers": headers, "body": body}
+    headers["Content-Encoding"] = encoding
+    return {
+        "statusCode": status,
+        "headers": headers,
+        "body": base64.b64encode(compressed).decode("ascii"),
+        "isBase64Encoded": True,
+    }
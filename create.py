@@ -36,3 +36,25 @@ else:
     print("Creating table...")
     dynamodb.get_waiter('table_exists').wait(TableName=table_name)
     print("Table created.")
+
+# Precomputed per-learner query results (api/db/learners.py)
+learner_table_name = 'learner_features'
+if learner_table_name in existing_tables:
+    print(f"Table '{learner_table_name}' already exists.")
+else:
+    dynamodb.create_table(
+        TableName=learner_table_name,
+        KeySchema=[
+            {'AttributeName': 'course_id', 'KeyType': 'HASH'},  # Partition key
+            {'AttributeName': 'user_id', 'KeyType': 'RANGE'},  # Sort key
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'course_id', 'AttributeType': 'S'},
+            {'AttributeName': 'user_id', 'AttributeType': 'S'},
+        ],
+        BillingMode='PAY_PER_REQUEST',
+    )
+
+    print("Creating table...")
+    dynamodb.get_waiter('table_exists').wait(TableName=learner_table_name)
+    print("Table created.")
@@ -0,0 +1,277 @@
+"""Endpoint latency and cold-start benchmarks against in-process fakes.
+
+    python -m tests.benchmarks.bench --latency 0.2 --rows 500 --save baseline.json
+    python -m tests.benchmarks.bench --latency 0.2 --rows 500 --compare baseline.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import contextlib
+import importlib
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from tests.benchmarks.fakes import FakeAthena, FakeS3, FakeTable, seed_models
+
+COURSE_ENDPOINTS = [
+    "/api/top-courses",
+    "/api/monthly-users",
+    "/api/yearly-users",
+    "/api/summary-stats",
+    "/api/label-distribution",
+    "/api/course-enrollments",
+    "/api/course/C_1",
+    "/api/search-labels?course_id=C_1",
+    "/api/course-video-count?course_id=C_1",
+    "/api/course-exercise-count?course_id=C_1",
+    "/api/course-comment-reply-sentiment?course_id=C_1",
+    "/api/course-users?course_id=C_1",
+    "/api/course-compare?course_ids=C_1,C_2&metric=videos",
+]
+
+USER_ENDPOINTS = [
+    "/api/user-course-info?course_id=C_1&user_id=U_1",
+    "/api/user-course-score-proportion?course_id=C_1&user_id=U_1",
+    "/api/user-course-behaviour?course_id=C_1&user_id=U_1",
+    "/api/user-course-predict?course_id=C_1&user_id=U_1",
+    "/api/course-predict?course_id=C_1",
+]
+
+COLD_IMPORT_MODULES = ["api.main", "api.lambda.course", "api.lambda.user"]
+
+
+def lambda_event(url):
+    path, _, query = url.partition("?")
+    params = dict(pair.split("=", 1) for pair in query.split("&")) if query else None
+    return {"path": path, "httpMethod": "GET", "queryStringParameters": params}
+
+
+_MISSING = object()
+
+
+@contextlib.contextmanager
+def install_fakes(athena, s3, table, cache=True):
+    # Swaps the clients and caches of the API modules for the fakes, and
+    # puts the originals back on exit so later code sees the real ones
+    from api.athena.cache import QueryCache, LRUCache, S3Cache, DatasetVersion
+    from api.athena.sketches import SketchSource
+    from api.ml.registry import ModelRegistry
+    import api.db.dynamodb as dynamodb
+
+    course = importlib.import_module("api.lambda.course")
+    user = importlib.import_module("api.lambda.user")
+    originals = []
+
+    def swap(target, name, value):
+        originals.append((target, name, vars(target).get(name, _MISSING)))
+        setattr(target, name, value)
+
+    seed_models(s3)
+    for module in (course, user):
+        swap(module, "athena", athena)
+        swap(module, "s3", s3)
+        # Metric records are still built, just not printed over the report
+        swap(module.metrics, "write", lambda line: None)
+    if cache:
+        swap(course, "query_cache", QueryCache(
+            LRUCache(),
+            S3Cache(s3, "mooccubex-datalake", "query_cache/"),
+            DatasetVersion(s3, "mooccubex-datalake", "query_cache/dataset_version"),
+        ))
+    else:
+        swap(course, "query_cache", QueryCache(LRUCache(maxsize=0)))
+    swap(course, "sketches", SketchSource(s3, "mooccubex-datalake", "sketches/distinct_users.bin"))
+    swap(user, "models", ModelRegistry(s3, "mooccubex-datalake", "tools/random-forest/"))
+    swap(user, "dataset_version", DatasetVersion(s3, "mooccubex-datalake", "query_cache/dataset_version"))
+    # Learner routes are measured against Athena, not the learner store
+    swap(user, "learners", None)
+    swap(dynamodb, "user_table", table)
+    try:
+        yield course, user
+    finally:
+        for target, name, value in reversed(originals):
+            if value is _MISSING:
+                delattr(target, name)
+            else:
+                setattr(target, name, value)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def rss_mb():
+    # Current resident set size; ru_maxrss only ever grows, so it cannot be
+    # attributed to one endpoint. None where /proc is unavailable.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+
+def measure(call, requests, concurrency):
+    def one(_):
+        start = time.perf_counter()
+        status = call()
+        return time.perf_counter() - start, status
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed * 1000 for elapsed, _ in results]
+    return {
+        "requests": requests,
+        "errors": sum(1 for _, status in results if status >= 400),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "throughput_rps": round(requests / wall, 2),
+        # Memory the endpoint's requests left resident
+        "rss_growth_mb": None if rss_before is None else round(rss_mb() - rss_before, 1),
+    }
+
+
+def cold_import_ms(module, repeat=3):
+    code = (
+        "import time, importlib; start = time.perf_counter(); "
+        f"importlib.import_module({module!r}); print((time.perf_counter() - start) * 1000)"
+    )
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get("AWS_DEFAULT_REGION", "us-east-1"))
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+        samples.append(float(output.stdout.strip().splitlines()[-1]))
+    return round(min(samples), 1)
+
+
+def app_endpoints(client):
+    emails = (f"bench{i}@example.com" for i in itertools.count())
+    client.post("/auth/signup", json={"username": "bench", "email": "seed@example.com", "password": "secret"})
+    token = client.post("/auth/signin", json={"email": "seed@example.com", "password": "secret"}).json()["access_token"]
+    return {
+        "GET /": lambda: client.get("/").status_code,
+        "POST /auth/signup": lambda: client.post(
+            "/auth/signup", json={"username": "bench", "email": next(emails), "password": "secret"}
+        ).status_code,
+        "POST /auth/signin": lambda: client.post(
+            "/auth/signin", json={"email": "seed@example.com", "password": "secret"}
+        ).status_code,
+        "GET /auth/token": lambda: client.get(
+            "/auth/token", headers={"Authorization": f"Bearer {token}"}
+        ).status_code,
+    }
+
+
+def run_benchmarks(requests=50, concurrency=8, latency=0.0, rows=10, s3_latency=0.0,
+                   dynamodb_latency=0.0, cache=True, app=True, imports=True):
+    from fastapi.testclient import TestClient
+
+    athena = FakeAthena(latency=latency, rows=rows, polls_until_done=1, scanned=rows * 100)
+    s3 = FakeS3(latency=s3_latency)
+    table = FakeTable(latency=dynamodb_latency)
+    with install_fakes(athena, s3, table, cache=cache) as (course, user):
+
+        report = {}
+        for module, urls in ((course, COURSE_ENDPOINTS), (user, USER_ENDPOINTS)):
+            for url in urls:
+                event = lambda_event(url)
+                report[f"lambda GET {url}"] = measure(
+                    lambda: module.lambda_handler(event, None)["statusCode"], requests, concurrency
+                )
+
+        if app:
+            from api.main import app as fastapi_app
+            with TestClient(fastapi_app) as client:
+                for name, call in app_endpoints(client).items():
+                    report[f"app {name}"] = measure(call, requests, concurrency)
+
+        if imports:
+            for module in COLD_IMPORT_MODULES:
+                report[f"import {module}"] = {"cold_import_ms": cold_import_ms(module)}
+
+    return report
+
+
+def compare(report, baseline, tolerance=0.2):
+    # A result regresses when it is more than `tolerance` slower (or has
+    # lower throughput) than the baseline.
+    regressions = []
+    for name, result in report.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ("p95_ms", "cold_import_ms"):
+            if metric in result and metric in base and result[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {base[metric]} -> {result[metric]}")
+        # Small growth is noise (allocator pages, caches warming up)
+        growth, base_growth = result.get("rss_growth_mb"), base.get("rss_growth_mb")
+        if growth is not None and base_growth is not None and growth > max(base_growth, 0) * (1 + tolerance) + 1:
+            regressions.append(f"{name}: rss_growth_mb {base_growth} -> {growth}")
+        if "throughput_rps" in result and "throughput_rps" in base:
+            if result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+                regressions.append(f"{name}: throughput_rps {base['throughput_rps']} -> {result['throughput_rps']}")
+    return regressions
+
+
+def print_report(report):
+    columns = ["p50_ms", "p95_ms", "p99_ms", "throughput_rps", "rss_growth_mb", "errors", "cold_import_ms"]
+    width = max(len(name) for name in report)
+    print(f"{'endpoint':<{width}}  " + "  ".join(f"{column:>14}" for column in columns))
+    for name, result in report.items():
+        print(f"{name:<{width}}  " + "  ".join(f"{str(result.get(column, '')):>14}" for column in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds each Athena query runs")
+    parser.add_argument("--rows", type=int, default=10, help="rows each Athena query returns")
+    parser.add_argument("--s3-latency", type=float, default=0.0)
+    parser.add_argument("--dynamodb-latency", type=float, default=0.0)
+    parser.add_argument("--no-cache", action="store_true", help="disable the query result cache")
+    parser.add_argument("--no-app", action="store_true", help="skip the FastAPI endpoints")
+    parser.add_argument("--no-imports", action="store_true", help="skip cold import timings")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against a saved JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(
+        requests=args.requests,
+        concurrency=args.concurrency,
+        latency=args.latency,
+        rows=args.rows,
+        s3_latency=args.s3_latency,
+        dynamodb_latency=args.dynamodb_latency,
+        cache=not args.no_cache,
+        app=not args.no_app,
+        imports=not args.no_imports,
+    )
+    print_report(report)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import io
+import re
+import time
+import pickle
+import hashlib
+import itertools
+import threading
+import numpy as np
+from types import SimpleNamespace
+from botocore.exceptions import ClientError
+
+# In-process stand-ins for the AWS services the API talks to. Each one
+# injects a configurable latency so the benchmarks measure our own overhead
+# on top of a realistic backend.
+
+
+class FakeScaler:
+    def transform(self, features):
+        return np.asarray(features, dtype=float)
+
+
+class FakeModel:
+    def predict(self, X):
+        return (np.asarray(X).sum(axis=1) > 0).astype(int)
+
+
+_MONTHLY_COUNT = re.compile(r"COUNT\(\*\) AS (\w+_count)\s+FROM")
+
+
+def monthly_count(sql):
+    # The count column of a per-course monthly batch query (the shape
+    # /api/course-compare pivots), or None
+    match = _MONTHLY_COUNT.search(sql)
+    if match is None or not re.search(r"GROUP BY course_id, \w*year", sql):
+        return None
+    return match.group(1)
+
+
+def default_columns(sql):
+    count = monthly_count(sql)
+    if count is not None:
+        return ["course_id", "year", "month", count]
+    return ["course_id", "user_id", "school", "label", "value"]
+
+
+def default_row(i, sql=""):
+    if monthly_count(sql) is not None:
+        return [f"C_{i % 2 + 1}", str(2020 + i // 24), str(i // 2 % 12 + 1), str(i)]
+    return ["C_1", f"U_{i}", "school", "ABCDE"[i % 5], str(i)]
+
+
+class FakeClock:
+    # A clock for `clock=` arguments; tests move it by setting `now`
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeAthena:
+    # Queries report RUNNING for their first `polls_until_done` polls and
+    # until `latency` seconds after they started, then succeed, or fail when
+    # their SQL is in `failing`. A query's result is `results[sql]` (a header
+    # row, then rows) when `results` is given, else `rows` generated rows;
+    # either is paged 1000 rows at a time like the real API.
+    def __init__(self, results=None, polls_until_done=2, failing=(), latency=0.0, rows=10,
+                 columns=default_columns, row=default_row, scanned=1024, engine_ms=80):
+        self.results = results
+        self.polls_until_done = polls_until_done
+        self.failing = set(failing)
+        self.latency = latency
+        self.rows = rows
+        self.columns = columns
+        self.row = row
+        self.scanned = scanned
+        self.engine_ms = engine_ms
+        self.started = 0
+        self.queries = {}
+        self.polls = {}
+        self.stopped = []
+        self.parameters = []
+        self._started_at = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def start_query_execution(self, QueryString, **kwargs):
+        with self._lock:
+            execution_id = f"q{next(self._ids)}"
+            self.started += 1
+            self.parameters.append(kwargs.get("ExecutionParameters"))
+            self.queries[execution_id] = QueryString
+            self.polls[execution_id] = 0
+            self._started_at[execution_id] = time.monotonic()
+        return {"QueryExecutionId": execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        with self._lock:
+            self.polls[QueryExecutionId] += 1
+            polls = self.polls[QueryExecutionId]
+        sql = self.queries[QueryExecutionId]
+        if polls < self.polls_until_done or time.monotonic() - self._started_at[QueryExecutionId] < self.latency:
+            state = "RUNNING"
+        elif sql in self.failing:
+            state = "FAILED"
+        else:
+            state = "SUCCEEDED"
+        return {"QueryExecution": {
+            "QueryExecutionId": QueryExecutionId,
+            "Status": {"State": state},
+            "ResultConfiguration": {"OutputLocation": f"s3://fake/{QueryExecutionId}.csv"},
+            "Statistics": {
+                "EngineExecutionTimeInMillis": self.engine_ms,
+                "QueryQueueTimeInMillis": 0,
+                "DataScannedInBytes": self.scanned,
+            },
+        }}
+
+    def stop_query_execution(self, QueryExecutionId):
+        with self._lock:
+            self.stopped.append(QueryExecutionId)
+
+    def _page(self, sql, start, end):
+        # The header, the total row count and rows[start:end]
+        if self.results is not None:
+            header, *rows = self.results[sql]
+            return header, len(rows), rows[start:end]
+        end = min(end, self.rows)
+        return self.columns(sql), self.rows, [self.row(i, sql) for i in range(start, end)]
+
+    def get_query_results(self, QueryExecutionId, MaxResults=1000, NextToken=None):
+        start = int(NextToken or 0)
+        end = start + MaxResults - (1 if start == 0 else 0)
+        header, total, rows = self._page(self.queries[QueryExecutionId], start, end)
+        if start == 0:
+            rows = [header] + rows
+        page = {"ResultSet": {"Rows": [{"Data": [{"VarCharValue": str(value)} for value in row]} for row in rows]}}
+        if end < total:
+            page["NextToken"] = str(end)
+        return page
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class FakeS3:
+    class exceptions:
+        NoSuchKey = NoSuchKey
+
+    # Objects are keyed by (Bucket, Key); ETags are the MD5 of the body
+    def __init__(self, latency=0.0, objects=None):
+        self.latency = latency
+        self.objects = dict(objects or {})
+        self.gets = 0
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        time.sleep(self.latency)
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        self.objects[(Bucket, Key)] = Body
+        return {"ETag": self._etag(Body)}
+
+    def put_pickle(self, Bucket, Key, value):
+        self.objects[(Bucket, Key)] = pickle.dumps(value)
+
+    def _etag(self, body):
+        return '"' + hashlib.md5(body).hexdigest() + '"'
+
+    def _get(self, Bucket, Key):
+        time.sleep(self.latency)
+        body = self.objects.get((Bucket, Key))
+        if body is None:
+            raise NoSuchKey(Key)
+        return body
+
+    def get_object(self, Bucket, Key, **kwargs):
+        body = self._get(Bucket, Key)
+        self.gets += 1
+        return {"Body": io.BytesIO(body), "ETag": self._etag(body), "ContentLength": len(body)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        body = self._get(Bucket, Key)
+        return {"ETag": self._etag(body), "ContentLength": len(body)}
+
+    def download_file(self, Bucket, Key, Filename):
+        body = self._get(Bucket, Key)
+        with open(Filename, "wb") as f:
+            f.write(body)
+
+
+class FakeTable:
+    # Just enough of a boto3 DynamoDB Table for api.db.dynamodb. Only the
+    # `attribute_not_exists(id)` condition is understood.
+    def __init__(self, latency=0.0, name="user"):
+        self.latency = latency
+        self.name = name
+        self.items = {}
+        self.meta = SimpleNamespace(client=SimpleNamespace(transact_write_items=self.transact_write_items))
+        self._lock = threading.Lock()
+
+    def put_item(self, Item, ConditionExpression=None, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            if ConditionExpression and Item["id"] in self.items:
+                raise ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem")
+            self.items[Item["id"]] = dict(Item)
+        return {}
+
+    def transact_write_items(self, TransactItems):
+        time.sleep(self.latency)
+        puts = [item["Put"] for item in TransactItems]
+        with self._lock:
+            reasons = [
+                {"Code": "ConditionalCheckFailed" if put.get("ConditionExpression") and put["Item"]["id"] in self.items
+                 else "None"}
+                for put in puts
+            ]
+            if any(reason["Code"] != "None" for reason in reasons):
+                raise ClientError({
+                    "Error": {"Code": "TransactionCanceledException"},
+                    "CancellationReasons": reasons,
+                }, "TransactWriteItems")
+            for put in puts:
+                self.items[put["Item"]["id"]] = dict(put["Item"])
+        return {}
+
+    def scan(self, **kwargs):
+        with self._lock:
+            return {"Items": [dict(item) for item in self.items.values()]}
+
+    def query(self, KeyConditionExpression, IndexName=None, **kwargs):
+        time.sleep(self.latency)
+        _, value = KeyConditionExpression.get_expression()["values"]
+        with self._lock:
+            items = [dict(item) for item in self.items.values() if item.get("email") == value]
+        return {"Items": items, "Count": len(items)}
+
+    def get_item(self, Key, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            item = self.items.get(Key["id"])
+        return {"Item": dict(item)} if item else {}
+
+
+def seed_models(s3, bucket="mooccubex-datalake", prefix="tools/random-forest/"):
+    s3.put_pickle(bucket, "tools/school_mapping.pkl", {"school": 1})
+    for phase in range(1, 5):
+        s3.put_pickle(bucket, f"{prefix}best_scaler_no_sample_phase{phase}.pkl", FakeScaler())
+        s3.put_pickle(bucket, f"{prefix}best_model_no_sample_phase{phase}.pkl", FakeModel())
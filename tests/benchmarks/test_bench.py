@@ -0,0 +1,30 @@
+import importlib
+from tests.benchmarks.bench import run_benchmarks, compare, COURSE_ENDPOINTS, USER_ENDPOINTS
+
+
+def test_every_endpoint_succeeds_against_fakes():
+    course = importlib.import_module("api.lambda.course")
+    user = importlib.import_module("api.lambda.user")
+    originals = (course.athena, course.query_cache, course.metrics.write, user.models, user.learners)
+    report = run_benchmarks(requests=2, concurrency=2, rows=5, imports=False)
+    # The fakes do not leak into later tests
+    assert (course.athena, course.query_cache, course.metrics.write, user.models, user.learners) == originals
+    assert len(report) == len(COURSE_ENDPOINTS) + len(USER_ENDPOINTS) + 4
+    for name, result in report.items():
+        assert result["errors"] == 0, name
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+
+
+def test_compare_flags_regressions():
+    baseline = {
+        "a": {"p95_ms": 100.0, "throughput_rps": 50.0, "rss_growth_mb": 0.5},
+        "b": {"p95_ms": 1.0, "rss_growth_mb": 2.0},
+        "import m": {"cold_import_ms": 200.0},
+    }
+    current = {
+        "a": {"p95_ms": 130.0, "throughput_rps": 49.0, "rss_growth_mb": 1.2},
+        "b": {"p95_ms": 1.0, "rss_growth_mb": 8.0},
+        "import m": {"cold_import_ms": 210.0},
+        "new": {"p95_ms": 1.0},
+    }
+    assert compare(current, baseline, tolerance=0.2) == ["a: p95_ms 100.0 -> 130.0", "b: rss_growth_mb 2.0 -> 8.0"]
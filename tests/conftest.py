@@ -0,0 +1,7 @@
+import os
+
+# The Lambda modules create boto3 clients at import time
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+# Background prefetching would outlive the fakes a test installs
+os.environ.setdefault("PREFETCH_COURSES", "0")
@@ -0,0 +1,494 @@
+import gzip
+import json
+import base64
+import importlib
+import itertools
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from api.athena import executor, service
+from api.athena.executor import AthenaQueryError, ScanBudgetExceeded, run_queries
+from api.athena.budget import ScanGuard, ScanCatalog
+from api.athena.prefetch import Prefetcher
+from api.athena.admission import AdmissionController, AdmissionRejected, INTERACTIVE, DASHBOARD, BACKGROUND
+from api.athena.reader import iter_result_rows, iter_query_rows, read_result_set, json_array
+from api.athena.columnar import to_columnar
+from api.athena.templates import (
+    QueryTemplate, BoundQuery, Param, Route, Router, MissingParameter, InvalidParameter, course_number
+)
+from api.athena.coalesce import BatchTemplate, QueryCoalescer
+from api.athena.cache import MISSING, LRUCache, QueryCache, normalize_sql
+from api.responses import accepted_encodings
+from api.metrics import Metrics, log_sampled
+from tests.benchmarks.fakes import FakeAthena, FakeClock, FakeS3
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(executor.time, "sleep", lambda seconds: None)
+
+
+def test_run_queries_returns_results_in_order():
+    client = FakeAthena({
+        "a": [["label", "count"], ["A", 3], ["B", 1]],
+        "b": [["year"], [2020]],
+    })
+    first, second = run_queries(client, ["a", "b"], "db", "s3://out/")
+    assert first == [{"label": "A", "count": "3"}, {"label": "B", "count": "1"}]
+    assert second == [{"year": "2020"}]
+
+
+def test_run_queries_polls_concurrently():
+    client = FakeAthena({q: [["x"], [1]] for q in "abcd"}, polls_until_done=3)
+    run_queries(client, list("abcd"), "db", "s3://out/")
+    # every query finishes on its third poll, so waiting is shared, not summed
+    assert all(polls == 3 for polls in client.polls.values())
+
+
+def test_run_queries_raises_on_failure():
+    client = FakeAthena({"a": [["x"], [1]], "b": [["x"], [1]]}, failing={"a"})
+    with pytest.raises(AthenaQueryError, match="FAILED"):
+        run_queries(client, ["a", "b"], "db", "s3://out/")
+
+
+def test_run_queries_cancels_queries_over_scan_budget():
+    client = FakeAthena({"a": [["x"]], "b": [["x"]]}, polls_until_done=5)
+    reported = []
+    with pytest.raises(ScanBudgetExceeded) as error:
+        run_queries(client, ["a", "b"], "db", "s3://out/", on_complete=lambda q, e: reported.append(q), scan_budget=1500)
+    assert error.value.scanned == 2048 and not error.value.estimated
+    assert sorted(client.stopped) == ["q0", "q1"]
+    assert reported == ["a", "b"]
+
+
+def test_poll_delays_back_off_to_maximum():
+    delays = list(itertools.islice(executor.poll_delays(0.1, 1.0, 2.0), 6))
+    assert delays == [0.1, 0.2, 0.4, 0.8, 1.0, 1.0]
+
+
+class DictTier:
+    def __init__(self):
+        self.items = {}
+
+    def get(self, key):
+        return self.items.get(key, MISSING)
+
+    def set(self, key, value):
+        self.items[key] = value
+
+
+class FixedVersion:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def publish(self, version):
+        self.value = version
+
+
+def test_normalize_sql_keeps_literals():
+    query = """
+        SELECT  label
+        FROM phase1
+        WHERE course_id = 'C_1  2';
+    """
+    assert normalize_sql(query) == "SELECT label FROM phase1 WHERE course_id = 'C_1  2'"
+
+
+def test_lru_cache_expires_and_evicts():
+    clock = FakeClock()
+    cache = LRUCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    clock.now = 11
+    assert cache.get("a") is MISSING
+
+
+def test_query_cache_two_tiers_and_invalidation():
+    shared = DictTier()
+    version = FixedVersion("v1")
+    cache = QueryCache(LRUCache(), shared, version)
+    calls = []
+
+    def runner(queries):
+        calls.append(queries)
+        return [[{"q": q}] for q in queries]
+
+    assert cache.run(["a", "b"], runner) == [[{"q": "a"}], [{"q": "b"}]]
+    assert cache.run(["a ", "b"], runner) == [[{"q": "a"}], [{"q": "b"}]]
+    assert calls == [["a", "b"]]
+
+    # a cold container still hits the shared tier
+    cold = QueryCache(LRUCache(), shared, version)
+    cold.run(["a"], runner)
+    assert cold.stats == {"local_hits": 0, "shared_hits": 1, "misses": 0}
+
+    cache.invalidate("v2")
+    cache.run(["a"], runner)
+    assert calls[-1] == ["a"]
+    assert cache.stats["misses"] == 3
+
+
+
+def test_query_cache_counts_concurrent_lookups():
+    cache = QueryCache(LRUCache())
+    cache.run(["a"], lambda queries: [[] for _ in queries])
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: cache.run(["a"], None), range(2000)))
+    assert cache.stats == {"local_hits": 2000, "shared_hits": 0, "misses": 1}
+
+
+def test_publish_command_changes_the_dataset_version(monkeypatch):
+    import api.clients
+    from api.athena import cache
+    s3 = FakeS3()
+    monkeypatch.setattr(api.clients, "LazyClient", lambda service, **kwargs: s3)
+    cache.main(["publish", "--bucket", "bucket", "--version", "v7"])
+    assert cache.DatasetVersion(s3, "bucket", "query_cache/dataset_version").get() == "v7"
+
+class PagedAthena:
+    def __init__(self, rows, page_size, output_location="s3://bucket/results/q0.csv", types=None):
+        self.pages = [rows[i:i + page_size] for i in range(0, len(rows), page_size)]
+        self.output_location = output_location
+        self.types = types
+
+    def get_query_results(self, QueryExecutionId, MaxResults, NextToken=None):
+        index = int(NextToken or 0)
+        page = {"ResultSet": {"Rows": [
+            {"Data": [{"VarCharValue": value} if value is not None else {} for value in row]}
+            for row in self.pages[index]
+        ]}}
+        if index + 1 < len(self.pages):
+            page["NextToken"] = str(index + 1)
+        if self.types:
+            page["ResultSet"]["ResultSetMetadata"] = {"ColumnInfo": [
+                {"Name": name, "Type": type_name} for name, type_name in zip(self.pages[0][0], self.types)
+            ]}
+        return page
+
+    def get_query_execution(self, QueryExecutionId):
+        return {"QueryExecution": {"ResultConfiguration": {"OutputLocation": self.output_location}}}
+
+
+def test_iter_result_rows_follows_next_token():
+    rows = [["user_id"]] + [[f"U_{i}"] for i in range(2500)]
+    result = list(iter_result_rows(PagedAthena(rows, page_size=1000), "q0"))
+    assert len(result) == 2500
+    assert result[-1] == {"user_id": "U_2499"}
+
+
+def test_iter_query_rows_streams_csv_for_large_results():
+    client = PagedAthena([["user_id", "school"], ["U_1", "x"], ["U_2", None]], page_size=2)
+    s3 = FakeS3(objects={("bucket", "results/q0.csv"): b'"user_id","school"\n"U_1","x"\n"U_2",\n'})
+    rows = iter_query_rows(client, "q0", s3_client=s3)
+    assert json_array(rows) == '[{"user_id":"U_1","school":"x"},{"user_id":"U_2","school":null}]'
+
+
+def test_columnar_result_is_typed_from_metadata():
+    rows = [["year", "month", "share", "start", "name"],
+            ["2020", "1", "0.5", "2020-01-01 10:00:00.000", "a"],
+            ["2020", "2", None, None, "b"]]
+    client = PagedAthena(rows, page_size=2, types=["integer", "bigint", "double", "timestamp", "varchar"])
+    result = read_result_set(client, "q0")
+    assert result == [
+        {"year": "2020", "month": "1", "share": "0.5", "start": "2020-01-01 10:00:00.000", "name": "a"},
+        {"year": "2020", "month": "2", "share": None, "start": None, "name": "b"},
+    ]
+    assert to_columnar(result) == {
+        "columns": ["year", "month", "share", "start", "name"],
+        "types": ["integer", "bigint", "double", "timestamp", "varchar"],
+        "data": [[2020, 2020], [1, 2], [0.5, None], ["2020-01-01T10:00:00.000", None], ["a", "b"]],
+    }
+
+
+def test_template_binds_typed_execution_parameters():
+    template = QueryTemplate("t", "SELECT * FROM video WHERE course_id = ? AND user_id = ? LIMIT {limit}", [
+        Param("course_id", "integer", convert=course_number),
+        Param("user_id"),
+        Param("limit", "integer", default=100, inline=True),
+    ])
+    bound = template.bind({"course_id": "C_42", "user_id": "U_1' OR '1'='1"})
+    assert bound.sql.endswith("LIMIT 100")
+    assert bound.parameters == ["42", "'U_1'' OR ''1''=''1'"]
+
+    with pytest.raises(MissingParameter, match="Missing user_id"):
+        template.bind({"course_id": "C_42"})
+    with pytest.raises(InvalidParameter, match="Invalid limit"):
+        template.bind({"course_id": "C_42", "user_id": "U_1", "limit": "all"})
+
+
+def test_router_resolves_static_and_path_parameter_routes():
+    router = Router()
+    static, dynamic = Route(handler=lambda p: "s"), Route(handler=lambda p: p)
+    router.add("GET", "/api/search-labels", static)
+    router.add("GET", "/api/course/{course_id}", dynamic)
+    assert router.resolve("GET", "/api/search-labels") == (static, {})
+    assert router.resolve("GET", "/api/course/C_1") == (dynamic, {"course_id": "C_1"})
+    assert router.resolve("POST", "/api/search-labels") == (None, {})
+    assert router.resolve("GET", "/api/course/") == (None, {})
+
+
+def test_course_handler_sends_execution_parameters(monkeypatch):
+    course = importlib.import_module("api.lambda.course")
+    # search-labels goes through its batched form, which also returns course_id
+    client = FakeAthena(collections.defaultdict(lambda: [["course_id", "label", "count"], ["C_7", "A", 2]]))
+    monkeypatch.setattr(course, "athena", client)
+    monkeypatch.setattr(course.query_cache, "shared", None)
+    monkeypatch.setattr(course.query_cache, "version", None)
+
+    event = {"path": "/api/search-labels", "httpMethod": "GET", "queryStringParameters": {"course_id": "C_7"}}
+    response = course.lambda_handler(event, None)
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"]) == [{"label": "A", "count": "2"}]
+    assert client.parameters == [["'C_7'"]]
+
+    event["queryStringParameters"]["format"] = "columnar"
+    body = json.loads(course.lambda_handler(event, None)["body"])
+    assert body == {"columns": ["label", "count"], "types": ["varchar", "varchar"], "data": [["A"], ["2"]]}
+
+    event["queryStringParameters"]["format"] = "xml"
+    assert course.lambda_handler(event, None)["statusCode"] == 400
+    event["queryStringParameters"] = None
+    assert course.lambda_handler(event, None)["statusCode"] == 400
+    assert course.lambda_handler({"path": "/api/nope", "httpMethod": "GET"}, None)["statusCode"] == 404
+
+
+def test_course_handler_compresses_and_answers_conditional_requests(monkeypatch):
+    course = importlib.import_module("api.lambda.course")
+    rows = [["label", "num_users"]] + [["A", i] for i in range(200)]
+    monkeypatch.setattr(course, "athena", FakeAthena(collections.defaultdict(lambda: rows)))
+    monkeypatch.setattr(course, "query_cache", QueryCache(LRUCache(), version=FixedVersion("v1")))
+
+    event = {"path": "/api/label-distribution", "httpMethod": "GET", "headers": {"accept-encoding": "br;q=0, gzip"}}
+    response = course.lambda_handler(event, None)
+    assert response["headers"]["Content-Encoding"] == "gzip"
+    assert response["headers"]["Cache-Control"] == course.AGGREGATE_CACHE_CONTROL
+    assert len(json.loads(gzip.decompress(base64.b64decode(response["body"])))) == 200
+
+    def fail(queries):
+        raise AssertionError("query ran for a fresh ETag")
+
+    monkeypatch.setattr(course, "run_athena_queries", fail)
+    event["headers"]["If-None-Match"] = response["headers"]["ETag"]
+    assert course.lambda_handler(event, None)["statusCode"] == 304
+
+    course.query_cache.invalidate("v2")
+    assert course.lambda_handler(event, None)["statusCode"] == 500
+
+
+def test_accepted_encodings_skips_refused_codings():
+    assert accepted_encodings("gzip;q=0.8, br;q=0, deflate") == {"gzip", "deflate"}
+
+
+def test_course_handler_reports_route_and_query_metrics(monkeypatch):
+    course = importlib.import_module("api.lambda.course")
+    lines = []
+    monkeypatch.setattr(course, "metrics", Metrics("Test", "course", write=lines.append))
+    monkeypatch.setattr(course.sketches, "get", lambda: None)
+    monkeypatch.setattr(course, "athena", FakeAthena(collections.defaultdict(lambda: [["year"], [2020]])))
+    monkeypatch.setattr(course, "query_cache", QueryCache(LRUCache()))
+
+    assert course.lambda_handler({"path": "/api/yearly-users", "httpMethod": "GET"}, None)["statusCode"] == 200
+    admission, query, request = [json.loads(line) for line in lines]
+    assert (admission["Priority"], admission["Shed"], admission["QueueDepth"]) == ("dashboard", 0, 0)
+    assert query["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["Service", "Route", "Query"]]
+    assert (query["Route"], query["Query"]) == ("GET /api/yearly-users", "yearly_users")
+    assert (query["BytesScanned"], query["EngineTime"], query["QueueTime"]) == (1024, 80, 0)
+    assert request["Route"] == "GET /api/yearly-users" and request["StatusCode"] == 200
+
+
+def test_course_handler_enforces_route_scan_budgets(monkeypatch):
+    course = importlib.import_module("api.lambda.course")
+    lines = []
+    monkeypatch.setattr(course, "metrics", Metrics("Test", "course", write=lines.append))
+    monkeypatch.setattr(course, "athena", FakeAthena(collections.defaultdict(lambda: [["label"], ["A"]])))
+    monkeypatch.setattr(course, "query_cache", QueryCache(LRUCache(maxsize=0)))
+    monkeypatch.setattr(course, "scan_guard", ScanGuard(
+        4096, {"GET /api/label-distribution": 1000}, route=lambda: course.metrics.current_route()
+    ))
+
+    event = {"path": "/api/label-distribution", "httpMethod": "GET"}
+    # The first run is cancelled once it has scanned 1024 bytes...
+    assert course.lambda_handler(event, None)["statusCode"] == 422
+    assert course.athena.stopped == ["q0"]
+    # ...and later ones are refused before they start
+    response = course.lambda_handler(event, None)
+    assert response["statusCode"] == 422 and "would scan about 1024 bytes" in response["body"]
+    assert len(course.athena.queries) == 1
+    assert course.lambda_handler({"path": "/api/top-courses", "httpMethod": "GET"}, None)["statusCode"] == 200
+
+    exceeded = [json.loads(line) for line in lines if "ScanBudgetExceeded" in line]
+    assert [(record["Route"], record["Estimated"]) for record in exceeded] == [
+        ("GET /api/label-distribution", False), ("GET /api/label-distribution", True),
+    ]
+
+
+
+def test_scan_guard_refuses_per_course_and_recovers():
+    now = [0.0]
+    guard = ScanGuard(1000, catalog=ScanCatalog(max_age=300, clock=lambda: now[0]))
+    template = QueryTemplate("search_labels", "SELECT 1 WHERE course_id = ?", [Param("course_id")])
+    big, small = template.bind({"course_id": "C_1"}), template.bind({"course_id": "C_2"})
+    guard.record(big, {"Statistics": {"DataScannedInBytes": 1200}})
+    with pytest.raises(ScanBudgetExceeded):
+        guard.check([big])
+    guard.check([small])
+    # Once the estimate has aged out the query gets another run
+    now[0] = 301
+    guard.check([big])
+
+def test_course_lists_prefetch_detail_queries_into_the_cache(monkeypatch):
+    course = importlib.import_module("api.lambda.course")
+    athena = FakeAthena(collections.defaultdict(lambda: [["course_id", "name"], ["C_1", "x"], ["C_2", "y"], ["C_3", "z"]]))
+    monkeypatch.setattr(course, "athena", athena)
+    monkeypatch.setattr(course, "query_cache", QueryCache(LRUCache()))
+    monkeypatch.setattr(course, "PREFETCH_COURSES", 2)
+    monkeypatch.setattr(course, "prefetcher", Prefetcher(course.prefetch_queries))
+
+    assert course.lambda_handler({"path": "/api/top-courses", "httpMethod": "GET"}, None)["statusCode"] == 200
+    assert course.prefetcher.drain(timeout=5)
+    assert course.prefetcher.stats["run"] == 1
+    started = len(athena.queries)
+    # Both courses' lookups share one batched query per detail template
+    assert started - 1 < 2 * len(course.COURSE_DETAIL_PATHS)
+
+    for path in ("/api/course/C_2", "/api/search-labels", "/api/course-comment-reply-sentiment"):
+        event = {"path": path, "httpMethod": "GET", "queryStringParameters": {"course_id": "C_2"}}
+        assert course.lambda_handler(event, None)["statusCode"] == 200
+    assert len(athena.queries) == started
+    event = {"path": "/api/search-labels", "httpMethod": "GET", "queryStringParameters": {"course_id": "C_3"}}
+    course.lambda_handler(event, None)
+    assert len(athena.queries) == started + 1
+
+
+def test_prefetcher_waits_for_interactive_requests():
+    ran = []
+    prefetcher = Prefetcher(ran.append)
+    with prefetcher.interactive():
+        prefetcher.schedule("a", ["low"], priority=1)
+        prefetcher.schedule("b", ["high"], priority=0)
+        assert not prefetcher.schedule("a", ["again"])
+        assert not prefetcher.drain(timeout=0.2) and ran == []
+    assert prefetcher.drain(timeout=5)
+    assert ran == [["high"], ["low"]]
+
+
+def test_admission_serves_classes_in_priority_order_within_their_share():
+    timeouts = {INTERACTIVE: 5, DASHBOARD: 0.05, BACKGROUND: 5}
+    controller = AdmissionController(limit=4, rate=1000, burst=1000, timeouts=timeouts)
+    reports = []
+    controller.acquire(DASHBOARD, 3, report=lambda *args: reports.append(args))
+    assert [(priority, depth, admitted) for priority, _, depth, admitted in reports] == [(DASHBOARD, 0, True)]
+    # Dashboards hold at most 3 of the 4 slots; the last is left for lookups
+    with pytest.raises(AdmissionRejected):
+        controller.acquire(DASHBOARD, report=lambda *args: reports.append(args))
+    assert reports[-1][3] is False
+    controller.acquire(INTERACTIVE)
+
+    order = []
+
+    def wait_for(priority):
+        controller.acquire(priority)
+        order.append(priority)
+
+    background = threading.Thread(target=wait_for, args=(BACKGROUND,))
+    background.start()
+    while len(controller._waiting) < 1:
+        pass
+    interactive = threading.Thread(target=wait_for, args=(INTERACTIVE,))
+    interactive.start()
+    while len(controller._waiting) < 2:
+        pass
+    # One free slot goes to the lookup that arrived last
+    controller.release(INTERACTIVE, 1)
+    interactive.join(5)
+    assert order == [INTERACTIVE]
+    controller.release(DASHBOARD, 3)
+    background.join(5)
+    assert order == [INTERACTIVE, BACKGROUND]
+
+
+def test_course_handler_sheds_load_with_retry_after(monkeypatch):
+    course = importlib.import_module("api.lambda.course")
+    monkeypatch.setattr(course, "query_cache", QueryCache(LRUCache(maxsize=0)))
+    monkeypatch.setattr(course, "admission", AdmissionController(limit=1, max_queued=0))
+    response = course.lambda_handler({"path": "/api/label-distribution", "httpMethod": "GET"}, None)
+    assert response["statusCode"] == 503
+    assert int(response["headers"]["Retry-After"]) >= 1
+    # Readable by the cross-origin frontend
+    assert response["headers"]["Access-Control-Allow-Origin"] == "*"
+    assert response["headers"]["Access-Control-Expose-Headers"] == "Retry-After"
+
+
+def test_admission_holds_a_slot_for_every_query(monkeypatch):
+    controller = AdmissionController(limit=4, rate=1000, burst=1000)
+    with pytest.raises(ValueError):
+        controller.acquire(BACKGROUND, 2)
+    assert [len(batch) for batch in controller.batches(DASHBOARD, list(range(7)))] == [3, 3, 1]
+
+    course = importlib.import_module("api.lambda.course")
+    athena = FakeAthena(collections.defaultdict(lambda: [["label"], ["A"]]))
+    held = []
+    monkeypatch.setattr(course, "athena", athena)
+    monkeypatch.setattr(course, "admission", controller)
+    monkeypatch.setattr(service, "run_queries", lambda client, batch, *args, **kwargs: (
+        held.append(controller.running[INTERACTIVE]) or [[] for _ in batch]
+    ))
+    assert course.run_remote_queries([BoundQuery("q", "SELECT 1 FROM video") for _ in range(6)]) == [[]] * 6
+    assert held == [4, 2] and controller.running[INTERACTIVE] == 0
+
+
+
+def test_streamed_route_refuses_columnar_format():
+    course = importlib.import_module("api.lambda.course")
+    event = {"path": "/api/course-users", "httpMethod": "GET",
+             "queryStringParameters": {"course_id": "C_1", "format": "columnar"}}
+    response = course.lambda_handler(event, None)
+    assert response["statusCode"] == 400 and "format" in response["body"]
+
+def test_log_sampled_caps_body(caplog):
+    caplog.set_level("INFO")
+    log_sampled("Body", "x" * 50, rate=0.5, max_chars=10, sample=lambda: 0.9)
+    log_sampled("Body", {"a": "x" * 50}, rate=0.5, max_chars=10, sample=lambda: 0.1)
+    assert [record.getMessage() for record in caplog.records] == ['Body: {"a":"xxxx... (58 chars)']
+
+
+def test_coalescer_shares_identical_queries_and_batches_lookups():
+    calls = []
+    release = threading.Event()
+
+    def runner(queries):
+        calls.append(queries)
+        release.wait(1)
+        results = []
+        for query in queries:
+            if query.name == "labels_batch":
+                results.append([{"course_id": p.strip("'"), "label": "A"} for p in query.parameters])
+            else:
+                results.append([{"sql": query.sql}])
+        return results
+
+    labels = QueryTemplate("labels", "SELECT label FROM phase1 WHERE course_id = ?", [Param("course_id")])
+    totals = QueryTemplate("totals", "SELECT COUNT(*) FROM phase1")
+    batch = BatchTemplate("labels_batch", "SELECT course_id, label FROM phase1 WHERE course_id IN ({keys})",
+                          Param("course_id"))
+    coalescer = QueryCoalescer(runner, {"labels": batch}, window=0.05)
+
+    requests = [totals.bind({}), totals.bind({})] + [labels.bind({"course_id": c}) for c in ("C_1", "C_2", "C_1")]
+    with ThreadPoolExecutor(max_workers=len(requests)) as pool:
+        futures = [pool.submit(coalescer.run, [query]) for query in requests]
+        # time.sleep is patched out for the executor tests
+        threading.Event().wait(0.1)
+        release.set()
+        results = [future.result()[0] for future in futures]
+
+    assert results[2] == results[4] == [{"label": "A"}]
+    assert results[3] == [{"label": "A"}]
+    assert sorted(query.name for queries in calls for query in queries) == ["labels_batch", "totals"]
+    assert coalescer.stats == {"direct": 1, "batched": 2, "shared": 2}
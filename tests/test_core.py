@@ -1,8 +1,154 @@
+import threading
+import pytest
 from fastapi.testclient import TestClient
 from api.main import app
+import api.auth.utils as auth_utils
+import api.auth.router as auth_router
+from api.auth.cache import SessionCache
+from api.models.user import UserInDB
+import api.db.dynamodb as dynamodb
+from tests.benchmarks.fakes import FakeClock, FakeTable
+from api.clients import LazyClient
+from api.profiling import parse_importtime
 
 client = TestClient(app)
 
 def test_root():
     response = client.get("/")
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+def test_lazy_client_is_created_on_first_use(monkeypatch):
+    import boto3
+    created = []
+    monkeypatch.setattr(boto3, "client", lambda service, **kwargs: created.append(service) or service.upper())
+
+    client = LazyClient("athena")
+    assert not client.loaded and created == []
+    assert client.lower() == "athena"
+    client.upper()
+    assert created == ["athena"]
+
+
+def test_parse_importtime():
+    modules = parse_importtime([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       120 |        120 |     pandas._config",
+        "import time:      3000 |       9000 |   pandas",
+    ])
+    assert modules == {"pandas._config": (120, 120, 1), "pandas": (3000, 9000, 0)}
+
+
+def test_auth_routes_hash_and_query_off_the_event_loop(monkeypatch):
+    threads = []
+
+    class RecordingContext:
+        def hash(self, password):
+            threads.append(("hash", threading.current_thread().name))
+            return f"hashed:{password}"
+
+        def verify(self, password, hashed):
+            threads.append(("verify", threading.current_thread().name))
+            return hashed == f"hashed:{password}"
+
+    class RecordingTable(FakeTable):
+        def query(self, **kwargs):
+            threads.append(("query", threading.current_thread().name))
+            return super().query(**kwargs)
+
+    monkeypatch.setattr(auth_utils, "pwd_context", RecordingContext())
+    monkeypatch.setattr(dynamodb, "user_table", RecordingTable())
+
+    user = {"username": "a", "email": "a@example.com", "password": "pw"}
+    assert client.post("/auth/signup", json=user).status_code == 200
+    assert client.post("/auth/signup", json=user).status_code == 400
+    assert client.post("/auth/signin", json={"email": "a@example.com", "password": "pw"}).status_code == 200
+    assert client.post("/auth/signin", json={"email": "a@example.com", "password": "no"}).status_code == 401
+
+    assert {kind for kind, _ in threads} == {"hash", "verify", "query"}
+    for kind, name in threads:
+        assert name.startswith("bcrypt" if kind in ("hash", "verify") else "dynamodb"), (kind, name)
+
+
+def test_session_cache_expires_at_token_exp_and_on_invalidate():
+    clock = FakeClock(1000.0)
+    cache = SessionCache(maxsize=2, ttl=300, clock=clock)
+    cache.set("t1", "a@example.com", {"id": 1}, expires_at=1060)
+    cache.set("t2", "b@example.com", {"id": 2})
+    assert cache.get("t1") == {"id": 1}
+
+    clock.now = 1060
+    assert cache.get("t1") is None
+    assert cache.get("t2") == {"id": 2}
+
+    cache.invalidate("b@example.com")
+    assert cache.get("t2") is None and len(cache) == 0
+
+
+def test_token_check_is_cached_until_user_changes(monkeypatch):
+    table = FakeTable()
+    monkeypatch.setattr(dynamodb, "user_table", table)
+    monkeypatch.setattr(auth_router, "sessions", SessionCache())
+    reads = []
+    query = table.query
+    monkeypatch.setattr(table, "query", lambda **kwargs: reads.append(kwargs) or query(**kwargs))
+
+    user = {"username": "b", "email": "b@example.com", "password": "pw"}
+    token = client.post("/auth/signup", json=user).json()["access_token"]
+    reads.clear()
+    headers = {"Authorization": f"Bearer {token}"}
+    for _ in range(3):
+        assert client.get("/auth/token", headers=headers).json()["email"] == "b@example.com"
+    assert len(reads) == 1
+
+    auth_router.sessions.invalidate("b@example.com")
+    client.get("/auth/token", headers=headers)
+    assert len(reads) == 2
+
+
+def test_signup_guards_email_uniqueness_in_one_write(monkeypatch):
+    table = FakeTable()
+    monkeypatch.setattr(dynamodb, "user_table", table)
+    user = UserInDB(username="c", email="c@example.com", hashed_password="x")
+
+    dynamodb.create_user(user)
+    with pytest.raises(dynamodb.EmailAlreadyRegistered):
+        dynamodb.create_user(UserInDB(username="d", email="c@example.com", hashed_password="y"))
+    assert set(table.items) == {str(user.id), "email#c@example.com"}
+
+    # users written before guards existed get one from the backfill
+    table.items["legacy"] = {"id": "legacy", "email": "old@example.com"}
+    dynamodb.backfill_email_guards()
+    dynamodb.backfill_email_guards()
+    assert table.items["email#old@example.com"] == {"id": "email#old@example.com", "user_id": "legacy"}
+
+
+def test_analytics_routes_are_served_by_the_app_with_shared_state(monkeypatch):
+    import sys
+    import importlib
+    import subprocess
+    # Other tests swap the modules' clients, so sharing is checked in a fresh interpreter
+    subprocess.run([sys.executable, "-c", (
+        "import api.main, importlib; "
+        "course, user = (importlib.import_module(f'api.lambda.{name}') for name in ('course', 'user')); "
+        "assert course.athena is user.athena and course.s3 is user.s3; "
+        "assert course.query_cache.version is user.dataset_version"
+    )], check=True)
+    course = importlib.import_module("api.lambda.course")
+
+    seen = []
+
+    def lambda_handler(event, context):
+        seen.append((event["path"], event["queryStringParameters"], event["headers"].get("if-none-match")))
+        return {
+            "statusCode": 200,
+            "headers": {"Access-Control-Allow-Origin": "*", "ETag": '"v1"', "Content-Type": "application/json"},
+            "body": '{"ok":true}',
+        }
+
+    monkeypatch.setattr(course, "lambda_handler", lambda_handler)
+    response = client.get("/api/course/C_1?format=columnar", headers={"If-None-Match": '"v0"'})
+    assert response.status_code == 200
+    assert response.json() == {"ok": True}
+    assert response.headers["etag"] == '"v1"'
+    assert "access-control-allow-origin" not in response.headers
+    assert seen == [("/api/course/C_1", {"format": "columnar"}, '"v0"')]
@@ -0,0 +1,183 @@
+import json
+import importlib
+import pytest
+import pandas as pd
+from api.athena.local import DuckDBBackend, ParquetExtracts, TieredBackend, referenced_tables
+from api.athena.compaction import COMPACTED_TABLES, CompactedTables, compact_table, athena_ddl
+from api.athena.cache import DatasetVersion
+from api.db.learners import SQLiteLearnerStore, build_course
+from tests.benchmarks.fakes import FakeS3
+
+pytest.importorskip("duckdb")
+
+course = importlib.import_module("api.lambda.course")
+
+
+@pytest.fixture
+def extracts(tmp_path):
+    pd.DataFrame({
+        "course_id": ["C_1", "C_1", "C_1", "C_2"],
+        "user_id": ["U_1", "U_2", "U_3", "U_1"],
+        "label": ["A", "A", "B", "C"],
+        "school": ["x", "y", "x", "x"],
+    }).to_parquet(tmp_path / "phase1.parquet")
+    pd.DataFrame({
+        "course_id": [1, 1, 2],
+        "user_id": ["U_1", "U_2", "U_1"],
+        "year": [2020, 2020, 2021],
+        "month": [3, 3, 4],
+    }).to_parquet(tmp_path / "video.parquet")
+    return ParquetExtracts(str(tmp_path))
+
+
+def test_referenced_tables():
+    sql = course.QUERIES["course_enrollments"].sql
+    assert referenced_tables(sql) == {"phase1", "course_info"}
+
+
+def test_duckdb_runs_course_templates(extracts):
+    local = DuckDBBackend(extracts)
+    labels = course.QUERIES["search_labels"].bind({"course_id": "C_1"})
+    videos = course.QUERIES["course_video_count"].bind({"course_id": "C_1"})
+    assert local([labels, videos]) == [
+        [{"label": "A", "count": "2"}, {"label": "B", "count": "1"}],
+        [{"year": "2020", "month": "3", "video_count": "2"}],
+    ]
+    assert local.run_query(labels).columns == [("label", "varchar"), ("count", "bigint")]
+
+    batch = course.BATCH_QUERIES["search_labels"]
+    rows = local.run_query(batch.bind(["'C_1'", "'C_2'"]))
+    assert batch.split(rows, ["'C_1'", "'C_2'"])["'C_2'"] == [{"label": "C", "count": "1"}]
+
+
+
+def test_extract_paths_are_resolved_once_per_change(tmp_path, monkeypatch):
+    from api.athena import local
+    walks = []
+    has_parquet = local._has_parquet
+    monkeypatch.setattr(local, "_has_parquet", lambda folder: walks.append(folder) or has_parquet(folder))
+    extracts = ParquetExtracts(str(tmp_path))
+    assert extracts.path("exercise_by_course") is None
+    partition = tmp_path / "exercise_by_course" / "course_id=C_1"
+    partition.mkdir(parents=True)
+    pd.DataFrame({"x": [1]}).to_parquet(partition / "part.parquet")
+    assert extracts.path("exercise_by_course").endswith("*.parquet")
+    assert extracts.path("exercise_by_course").endswith("*.parquet")
+    assert len(walks) == 1
+
+def test_tiered_backend_falls_back_for_missing_tables(extracts):
+    remote_calls = []
+
+    def remote(queries):
+        remote_calls.extend(queries)
+        return [[{"from": "athena"}] for _ in queries]
+
+    backend = TieredBackend(DuckDBBackend(extracts), remote)
+    enrollments = course.QUERIES["course_enrollments"].bind({})
+    labels = course.QUERIES["search_labels"].bind({"course_id": "C_2"})
+    assert backend([enrollments, labels]) == [[{"from": "athena"}], [{"label": "C", "count": "1"}]]
+    assert remote_calls == [enrollments]
+    assert backend.stats == {"local": 1, "remote": 1}
+
+
+def test_compacted_exercise_table_is_partitioned_and_queryable(tmp_path):
+    raw = tmp_path / "exercise.parquet"
+    pd.DataFrame({
+        "course_id": ["C_1", "C_1", "C_1", "C_2", "C_1"],
+        "user_id": ["U_2", "U_1", "U_1", "U_1", "U_3"],
+        "exercise_submit_date_max": ["2020-03-02", "2020-03-09", "2020-04-01", "2021-01-01", "not a date"],
+    }).to_parquet(raw)
+
+    table = COMPACTED_TABLES["exercise"]
+    columns, years = compact_table(table, str(raw), str(tmp_path / "out"))
+    assert (tmp_path / "out" / "exercise_by_course" / "course_id=C_1" / "event_year=2020" / "event_month=3").is_dir()
+    assert years == [0, 2020, 2021]
+    assert "projection.course_id.type' = 'injected'" in athena_ddl(table, columns, years, "s3://b/compacted/exercise_by_course")
+
+    local = DuckDBBackend(ParquetExtracts(str(tmp_path / "out")))
+    counts = local.run_query(course.QUERIES["course_exercise_count"].bind({"course_id": "C_1"}))
+    assert counts == [
+        {"year": "2020", "month": "3", "exercise_count": "2"},
+        {"year": "2020", "month": "4", "exercise_count": "1"},
+        {"year": None, "month": None, "exercise_count": "1"},
+    ]
+
+    # Until the table is recorded at the current version, the query reads
+    # the raw table, with the same result
+    s3 = FakeS3()
+    version = DatasetVersion(s3, "b", "query_cache/dataset_version")
+    compacted = CompactedTables(s3, "b", "compacted/", version)
+    query = course.QUERIES["course_exercise_count"].bind({"course_id": "C_1"})
+    [raw] = compacted.current([query])
+    assert "FROM exercise)" in raw.sql and raw.parameters == query.parameters
+    assert DuckDBBackend(ParquetExtracts(str(tmp_path))).run_query(raw) == counts
+
+    version.publish("v2")
+    DatasetVersion(s3, "b", "compacted/exercise_by_course/_dataset_version").publish("v2")
+    compacted = CompactedTables(s3, "b", "compacted/", version)
+    assert compacted.current([query]) == [query]
+    version.publish("v3")
+    assert compacted.current([query])[0].sql == raw.sql
+
+
+def test_learner_store_matches_per_learner_queries(extracts, tmp_path, monkeypatch):
+    user = importlib.import_module("api.lambda.user")
+    local = DuckDBBackend(extracts)
+    names = ["user_video_count", "user_monthly_videos", "user_phase1"]
+    records = build_course("C_1", [user.LEARNER_QUERIES[name] for name in names], local)
+    assert sorted(records) == ["U_1", "U_2", "U_3"]
+
+    store = SQLiteLearnerStore(str(tmp_path / "learners.db"))
+    store.put_many("C_1", records)
+    for user_id in ("U_1", "U_2", "U_3"):
+        params = {"course_id": "C_1", "user_id": user_id}
+        stored = store.get("C_1", user_id)
+        for name in names:
+            expected = local.run_query(user.QUERIES[name].bind(params))
+            assert stored[name] == expected
+            assert stored[name].columns == expected.columns
+    assert store.get("C_2", "U_1") is None
+
+    # Stored learners never reach the query backend; others still do
+    reads = []
+    monkeypatch.setattr(user, "learners", store)
+    monkeypatch.setattr(store, "get", lambda *key: reads.append(key) or SQLiteLearnerStore.get(store, *key))
+    monkeypatch.setattr(user, "run_athena_queries", lambda queries: [[{"from": "athena"}] for _ in queries])
+    behaviour = user.router.resolve("GET", "/api/user-course-behaviour")[0]
+    assert behaviour.run({"course_id": "C_1", "user_id": "U_3"}, user.learner_queries({"course_id": "C_1", "user_id": "U_3"})) == {
+        "user_video": [], "user_exercises": [{"from": "athena"}],
+    }
+    unstored = user.QUERIES["user_video_count"].bind({"course_id": "C_9", "user_id": "U_1"})
+    assert user.learner_queries({"course_id": "C_9", "user_id": "U_1"})([unstored]) == [[{"from": "athena"}]]
+    # The store is only read when queries run
+    user.learner_queries({"course_id": "C_1", "user_id": "U_1"})
+    assert reads == [("C_1", "U_3"), ("C_9", "U_1")]
+
+
+def test_course_compare_pivots_one_grouped_query(extracts, monkeypatch):
+    local = DuckDBBackend(extracts)
+    ran = []
+
+    def run(queries):
+        ran.extend(queries)
+        return local(queries)
+    monkeypatch.setattr(course, "run_athena_queries", run)
+
+    event = {"httpMethod": "GET", "path": "/api/course-compare",
+             "queryStringParameters": {"course_ids": "C_1,C_3,C_2", "metric": "videos"}}
+    response = course.lambda_handler(event, None)
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"]) == {
+        "metric": "videos",
+        "course_ids": ["C_1", "C_3", "C_2"],
+        "columns": [f"2020-{month:02d}" for month in range(3, 13)] + ["2021-01", "2021-02", "2021-03", "2021-04"],
+        "values": [[2] + [0] * 13, [0] * 14, [0] * 13 + [1]],
+    }
+    assert len(ran) == 1
+
+    event["queryStringParameters"]["metric"] = "labels"
+    assert json.loads(course.lambda_handler(event, None)["body"])["values"] == [
+        [2, 1, 0, 0, 0], [0, 0, 0, 0, 0], [0, 0, 1, 0, 0],
+    ]
+    event["queryStringParameters"]["metric"] = "views"
+    assert course.lambda_handler(event, None)["statusCode"] == 400
@@ -0,0 +1,179 @@
+import threading
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+from api.ml.registry import ModelRegistry, PickledPredictor
+from api.ml.features import predict_phase
+from api.ml.forest import CompactForest, export_forest
+from tests.benchmarks.fakes import FakeClock, FakeS3
+
+
+def test_registry_loads_once_and_reloads_on_etag_change():
+    s3 = FakeS3()
+    s3.put_pickle("bucket", "tools/school_mapping.pkl", {"a": 1})
+    clock = FakeClock()
+    registry = ModelRegistry(s3, "bucket", "tools/random-forest/", revalidate_after=60, clock=clock)
+
+    assert registry.school_map() == {"a": 1}
+    assert registry.school_map() == {"a": 1}
+    assert s3.gets == 1
+
+    s3.put_pickle("bucket", "tools/school_mapping.pkl", {"a": 2})
+    assert registry.school_map() == {"a": 1}
+    clock.now = 61
+    assert registry.school_map() == {"a": 2}
+    assert s3.gets == 2
+
+
+
+def test_registry_loads_do_not_block_other_artifacts():
+    s3 = FakeS3()
+    s3.put_pickle("bucket", "m/best_model_no_sample_phase1.pkl", "slow")
+    s3.put_pickle("bucket", "m/best_model_no_sample_phase2.pkl", "fast")
+    loading, release = threading.Event(), threading.Event()
+    get_object = s3.get_object
+
+    def slow_get_object(Bucket, Key):
+        if Key.endswith("phase1.pkl"):
+            loading.set()
+            release.wait(5)
+        return get_object(Bucket, Key)
+    s3.get_object = slow_get_object
+    registry = ModelRegistry(s3, "bucket", "m/")
+
+    slow = threading.Thread(target=registry.model, args=(1,))
+    slow.start()
+    loading.wait(5)
+    assert registry.model(2) == "fast"
+    release.set()
+    slow.join(5)
+    assert registry.model(1) == "slow" and s3.gets == 2
+
+def test_registry_evicts_least_recently_used():
+    s3 = FakeS3()
+    for phase in (1, 2):
+        s3.put_pickle("bucket", f"m/best_model_no_sample_phase{phase}.pkl", "x" * 1000)
+    registry = ModelRegistry(s3, "bucket", "m/", max_bytes=1500)
+
+    registry.model(1)
+    registry.model(2)
+    registry.model(2)
+    assert registry.stats["evictions"] == 1
+    registry.model(1)
+    assert s3.gets == 3
+
+
+class ScaleByTwo:
+    def transform(self, features):
+        return features.to_numpy() * 2
+
+
+class ThresholdModel:
+    def predict(self, X):
+        return (X.sum(axis=1) > 10).astype(int)
+
+
+class StaticModels:
+    def scaler(self, phase):
+        return ScaleByTwo()
+
+    def model(self, phase):
+        return ThresholdModel()
+
+    def predictor(self, phase):
+        return PickledPredictor(self.scaler(phase), self.model(phase))
+
+
+def test_batch_prediction_matches_single_rows():
+    rows = [
+        {"user_id": "U_1", "school": "A", "video_count": "1", "label": "A", "label_encoded": "0"},
+        {"user_id": "U_2", "school": "B", "video_count": "7", "label": "B", "label_encoded": "1"},
+        {"user_id": "U_3", "school": "Z", "video_count": None, "label": "C", "label_encoded": "2"},
+    ]
+    school_map = {"A": 1, "B": 2}
+    models = StaticModels()
+
+    df, features, batch = predict_phase(models, 1, rows, school_map)
+    single = [predict_phase(models, 1, [row], school_map)[2][0] for row in rows]
+    assert list(batch) == single == [0, 1, 0]
+    assert list(features.columns) == ["user_id", "school", "video_count"]
+
+
+def random_tree(rng, n_features, n_classes, depth):
+    # The tree_ arrays of a fitted scikit-learn tree, in preorder
+    feature, threshold, left, right, value = [], [], [], [], []
+
+    def grow(level):
+        node = len(feature)
+        for column in (feature, threshold, left, right, value):
+            column.append(None)
+        if level == depth or rng.random() < 0.2:
+            feature[node], threshold[node], left[node], right[node] = -2, -2.0, -1, -1
+        else:
+            feature[node] = int(rng.integers(n_features))
+            threshold[node] = float(np.float32(rng.normal()))
+            left[node] = grow(level + 1)
+            right[node] = grow(level + 1)
+        value[node] = [rng.integers(0, 5, n_classes).astype(float)]
+        return node
+
+    grow(0)
+    return SimpleNamespace(tree_=SimpleNamespace(
+        node_count=len(feature), max_depth=depth, feature=np.array(feature), threshold=np.array(threshold),
+        children_left=np.array(left), children_right=np.array(right), value=np.array(value),
+    ))
+
+
+def reference_predict(forest, scaler, X):
+    # RandomForestClassifier.predict, one row and one tree at a time
+    X = ((X - scaler.mean_) / scaler.scale_).astype(np.float32)
+    predictions = []
+    for row in X:
+        proba = np.zeros(len(forest.classes_))
+        for estimator in forest.estimators_:
+            tree, node = estimator.tree_, 0
+            while tree.children_left[node] != -1:
+                go_left = row[tree.feature[node]] <= tree.threshold[node]
+                node = tree.children_left[node] if go_left else tree.children_right[node]
+            value = tree.value[node, 0]
+            proba += value / (value.sum() or 1.0)
+        predictions.append(forest.classes_[np.argmax(proba / len(forest.estimators_))])
+    return np.array(predictions)
+
+
+def test_compact_forest_matches_tree_by_tree_prediction(tmp_path):
+    rng = np.random.default_rng(1)
+    forest = SimpleNamespace(
+        estimators_=[random_tree(rng, 5, 3, depth=6) for _ in range(25)], classes_=np.array([0, 1, 2])
+    )
+    scaler = SimpleNamespace(mean_=rng.normal(size=5), scale_=rng.uniform(0.5, 2, size=5),
+                             feature_names_in_=np.array(list("abcde")))
+    X = rng.normal(size=(500, 5))
+
+    s3 = FakeS3()
+    s3.put_object(Bucket="bucket", Key="m/forest_phase1.rfa", Body=export_forest(forest, scaler))
+    registry = ModelRegistry(s3, "bucket", "m/", model_format="compact", local_dir=str(tmp_path))
+    compact = registry.predictor(1)
+    array = compact.threshold
+    while not isinstance(array, np.memmap):
+        array = array.base
+    assert array.filename.startswith(str(tmp_path))
+
+    # Columns are picked by name, as the fitted scaler would
+    frame = pd.DataFrame(X, columns=list("abcde"))[list("edcba")]
+    assert np.array_equal(compact.predict(frame), reference_predict(forest, scaler, X))
+
+
+def test_compact_forest_matches_scikit_learn():
+    ensemble = pytest.importorskip("sklearn.ensemble")
+    preprocessing = pytest.importorskip("sklearn.preprocessing")
+    rng = np.random.default_rng(2)
+    X = rng.normal(size=(2000, 8))
+    y = (X[:, 0] + X[:, 3] * X[:, 5] > 0.3).astype(int) + (X[:, 1] > 1)
+    scaler = preprocessing.StandardScaler().fit(X)
+    model = ensemble.RandomForestClassifier(n_estimators=30, random_state=0).fit(scaler.transform(X), y)
+
+    test = rng.normal(size=(5000, 8))
+    compact = CompactForest.from_bytes(export_forest(model, scaler))
+    assert np.array_equal(compact.predict(test), model.predict(scaler.transform(test)))
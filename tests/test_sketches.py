@@ -0,0 +1,83 @@
+import json
+import importlib
+from api.athena.cache import QueryCache, LRUCache
+from api.athena.sketches import HyperLogLog, SketchStore
+
+
+class FixedSketches:
+    def __init__(self, store):
+        self.store = store
+
+    def get(self):
+        return self.store
+
+    def version(self):
+        return getattr(self.store, "etag", None)
+
+
+def test_hyperloglog_estimates_within_error_and_merges_idempotently():
+    first, second = HyperLogLog(), HyperLogLog()
+    for i in range(20000):
+        (first if i % 2 else second).add(f"U_{i}")
+        first.add(f"U_{i % 100}")
+
+    union = HyperLogLog.union([first, second])
+    assert abs(union.count() - 20000) <= 20000 * 4 * union.standard_error
+    assert HyperLogLog.union([union, first, second]).count() == union.count()
+
+    small = HyperLogLog()
+    for i in range(50):
+        small.add(f"U_{i}")
+        small.add(f"U_{i}")
+    assert abs(small.count() - 50) <= 1
+
+
+def test_sketch_store_answers_the_distinct_user_queries():
+    rows = [
+        {"user_year": str(year), "user_month": str(month), "course_id": f"C_{i % 3}", "user_id": f"U_{i}"}
+        for year, month in ((2018, 12), (2020, 6), (2020, 7), (2021, 1))
+        for i in range(40)
+    ]
+    store = SketchStore()
+    assert store.update(rows) == 160
+    store = SketchStore.from_bytes(store.to_bytes())
+
+    assert store.monthly_users() == [
+        {"year": "2020", "month": "6", "num_users": "40"},
+        {"year": "2020", "month": "7", "num_users": "40"},
+        {"year": "2021", "month": "1", "num_users": "40"},
+    ]
+    assert store.monthly_users().columns[2] == ("num_users", "bigint")
+    assert store.yearly_users() == [{"year": "2020", "num_users": "40"}, {"year": "2021", "num_users": "40"}]
+    assert store.summary_stats() == [{
+        "total_users": "40", "total_courses": "3", "courses_since_july_2020": "3", "users_in_2020": "40",
+    }]
+
+
+def test_course_handler_uses_sketches_unless_exact(monkeypatch):
+    course = importlib.import_module("api.lambda.course")
+    store = SketchStore()
+    store.add(2020, 1, "C_1", "U_1")
+    monkeypatch.setattr(course, "sketches", FixedSketches(store))
+    monkeypatch.setattr(course, "query_cache", QueryCache(LRUCache()))
+    exact = []
+    monkeypatch.setattr(course, "run_athena_queries", lambda queries: exact.extend(queries) or [[{"year": "2020"}]])
+
+    event = {"path": "/api/yearly-users", "httpMethod": "GET", "queryStringParameters": None}
+    assert json.loads(course.lambda_handler(event, None)["body"]) == [{"year": "2020", "num_users": "1"}]
+    assert exact == []
+
+    event["queryStringParameters"] = {"exact": "true"}
+    assert json.loads(course.lambda_handler(event, None)["body"]) == [{"year": "2020"}]
+    assert [query.name for query in exact] == ["yearly_users"]
+
+    event["queryStringParameters"] = {"exact": "maybe"}
+    assert course.lambda_handler(event, None)["statusCode"] == 400
+
+    # A refresh of the sketches alone changes the ETag
+    event["queryStringParameters"] = None
+    etag = course.lambda_handler(event, None)["headers"]["ETag"]
+    event["headers"] = {"If-None-Match": etag}
+    assert course.lambda_handler(event, None)["statusCode"] == 304
+    store.etag = '"v2"'
+    assert course.lambda_handler(event, None)["statusCode"] == 200